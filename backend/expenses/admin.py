@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from expenses.models import Category, Expense, Project
+from expenses.models import (
+    CategorizationRule,
+    Category,
+    CategoryMonthTotal,
+    Expense,
+    MerchantStat,
+    Project,
+    RecurringExpense,
+)
 
 
 class CategoryInline(admin.TabularInline):
@@ -21,7 +29,7 @@ class CategoryAdmin(admin.ModelAdmin):
     readonly_fields = ["public_id", "created_at", "updated_at", "id"]
     inlines = [CategoryInline]
     ordering = ["-created_at"]
-    list_display = ["public_id", "project", "name", "created_at", "updated_at"]
+    list_display = ["public_id", "project", "name", "monthly_budget", "created_at", "updated_at"]
     list_filter = ["created_at", "updated_at"]
     search_fields = ["public_id", "project__public_id", "name"]
 
@@ -30,10 +38,57 @@ class ExpenseAdmin(admin.ModelAdmin):
     readonly_fields = ["public_id", "created_at", "updated_at", "id"]
     ordering = ["-created_at"]
     list_display = ["public_id", "category", "amount", "source", "spent_at", "created_at", "updated_at"]
+    list_filter = ["created_at", "updated_at", "possible_duplicate"]
+    search_fields = ["public_id", "category__public_id", "source", "notes"]
+
+
+class CategorizationRuleAdmin(admin.ModelAdmin):
+    readonly_fields = ["public_id", "created_at", "updated_at", "id"]
+    ordering = ["project", "order"]
+    list_display = ["public_id", "project", "category", "order", "source_contains", "source_regex", "notes_keywords"]
     list_filter = ["created_at", "updated_at"]
-    search_fields = ["public_id", "category__public_id", "name"]
+    search_fields = ["public_id", "project__public_id", "source_contains", "source_regex", "notes_keywords"]
+
+
+class RecurringExpenseAdmin(admin.ModelAdmin):
+    readonly_fields = ["public_id", "created_at", "updated_at", "id", "materialized_until"]
+    ordering = ["-created_at"]
+    list_display = ["public_id", "project", "category", "amount", "source", "frequency", "interval", "starts_at"]
+    list_filter = ["frequency", "created_at", "updated_at"]
+    search_fields = ["public_id", "project__public_id", "source"]
+
+
+class CategoryMonthTotalAdmin(admin.ModelAdmin):
+    readonly_fields = ["category", "month", "total", "count"]
+    ordering = ["-month"]
+    list_display = ["category", "month", "total", "count"]
+    list_filter = ["month"]
+    search_fields = ["category__public_id", "category__project__public_id"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class MerchantStatAdmin(admin.ModelAdmin):
+    readonly_fields = ["project", "normalized_source", "source", "count", "last_spent_at", "category"]
+    ordering = ["-count"]
+    list_display = ["source", "project", "count", "last_spent_at", "category"]
+    search_fields = ["normalized_source", "project__public_id"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Project, ProjectAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Expense, ExpenseAdmin)
+admin.site.register(CategorizationRule, CategorizationRuleAdmin)
+admin.site.register(RecurringExpense, RecurringExpenseAdmin)
+admin.site.register(CategoryMonthTotal, CategoryMonthTotalAdmin)
+admin.site.register(MerchantStat, MerchantStatAdmin)
@@ -0,0 +1,291 @@
+import datetime
+import functools
+import json
+import logging
+import typing
+import uuid
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET, require_http_methods
+
+from auth.models import User
+from expenses.categorization import Classifier
+from expenses.cube import cubes
+from expenses.duplicates import DUPLICATE_MODES, deduplicate
+from expenses.forms import ExpenseApiForm
+from expenses.models import Category, Expense, Project
+from expenses.periods import MAX_AMOUNT, Granularity
+from expenses.search import search_expenses
+
+logger = logging.getLogger(__name__)
+
+API_PAGE_SIZE = 1000
+API_MAX_BATCH_SIZE = 1000
+API_SEARCH_LIMIT = 100
+EXPENSE_FIELDS = ["spent_at", "amount", "source", "category", "notes"]
+
+
+class AuthenticatedHttpRequest(HttpRequest):
+    user: User
+
+
+def api_login_required(view):
+    # Like login_required, but answering with a JSON 401 instead of redirecting to the login page. The API uses the
+    # session of the app, so it's meant for its pages: like their forms, POSTs need the CSRF token of the session (in
+    # the X-CSRFToken header), and are rejected with a 403 without it
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse(dict(error="Authentication required"), status=401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@api_login_required
+@require_GET
+def api_project_list(request: AuthenticatedHttpRequest):
+    projects = request.user.projects.order_by("order").values("public_id", "name", "notes")
+    return JsonResponse(dict(projects=list(projects)))
+
+
+@api_login_required
+@require_GET
+def api_category_list(request: AuthenticatedHttpRequest, project_public_id: str):
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    categories = (
+        Category.objects.filter(project=project)
+        .order_by("order")
+        .values("public_id", "name", "color", "notes", parent_public_id=F("parent__public_id"))
+    )
+    return JsonResponse(dict(categories=list(categories)))
+
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def api_expense_list(request: AuthenticatedHttpRequest, project_public_id: str):
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    if request.method == "POST":
+        return _apply_expense_batch(request, project=project)
+
+    # Keyset pagination: `next` is the (spent_at, id) of the last expense of the page
+    filter_args = [Q(project=project)]
+    arg_after = request.GET.get("after")
+    if arg_after:
+        try:
+            after_spent_at, after_id_ = arg_after.split("_")
+            after_datetime = datetime.datetime.fromisoformat(after_spent_at)
+            after_id = uuid.UUID(after_id_)
+        except ValueError:
+            return JsonResponse(dict(error=f"{arg_after!r} isn't a cursor"), status=400)
+        filter_args.append(Q(spent_at__gt=after_datetime) | Q(spent_at=after_datetime, id__gt=after_id))
+    expenses = list(
+        Expense.objects.filter(*filter_args)
+        .order_by("spent_at", "id")
+        .values(
+            "id", "public_id", "spent_at", "amount", "source", "notes", category_public_id=F("category__public_id")
+        )[: API_PAGE_SIZE + 1]
+    )
+    next_cursor = None
+    if len(expenses) > API_PAGE_SIZE:
+        expenses = expenses[:API_PAGE_SIZE]
+        next_cursor = f"{expenses[-1]['spent_at'].isoformat()}_{expenses[-1]['id'].hex}"
+    return JsonResponse(
+        dict(
+            expenses=[{key: value for key, value in expense.items() if key != "id"} for expense in expenses],
+            next=next_cursor,
+        )
+    )
+
+
+@api_login_required
+@require_GET
+def api_expense_search(request: AuthenticatedHttpRequest, project_public_id: str):
+    # "q" matches words starting with each of its terms, e.g. "sup mark" finds "Super Market" but not "Supermarket"
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    arg_limit = request.GET.get("limit") or str(API_SEARCH_LIMIT)
+    if not arg_limit.isdigit():
+        return JsonResponse(dict(error=f"{arg_limit!r} isn't a limit"), status=400)
+    ids = search_expenses(
+        project=project, query=request.GET.get("q", ""), limit=min(max(int(arg_limit), 1), API_SEARCH_LIMIT)
+    )
+    expenses_by_id = {
+        expense["id"]: {key: value for key, value in expense.items() if key != "id"}
+        for expense in Expense.objects.filter(id__in=ids).values(
+            "id", "public_id", "spent_at", "amount", "source", "notes", category_public_id=F("category__public_id")
+        )
+    }
+    return JsonResponse(dict(expenses=[expenses_by_id[id_] for id_ in ids if id_ in expenses_by_id]))
+
+
+@api_login_required
+@require_GET
+def api_project_slice(request: AuthenticatedHttpRequest, project_public_id: str):
+    """
+    Drill-down of the project: the totals per period of a category ("category", the roots when missing) and of each of
+    its children with their subcategories, plus the sources that add up the most in those periods. It's all computed
+    from the in-memory cube of the project, so slicing it again and again doesn't hit the database
+    """
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    try:
+        granularity = Granularity.from_query_args(request.GET)
+        amount = min(max(int(request.GET.get("periods") or granularity.default_amount), 1), MAX_AMOUNT)
+        arg_to = request.GET.get("to")
+        to_datetime = datetime.datetime.fromisoformat(arg_to) if arg_to else None
+        # Going back from an early date can pass the first year there is
+        periods = granularity.generate_periods(amount=amount, to_datetime=to_datetime)
+    except (ValueError, OverflowError) as exc:
+        return JsonResponse(dict(error=str(exc)), status=400)
+
+    children_by_parent = Category.build_tree(project=project)
+    categories = {category.public_id: category for children in children_by_parent.values() for category in children}
+    arg_category = request.GET.get("category")
+    if arg_category and arg_category not in categories:
+        return JsonResponse(dict(error=f"The category {arg_category!r} doesn't exist"), status=404)
+    parent = categories.get(arg_category) if arg_category else None
+
+    cube = cubes.get(project)
+    subtree_totals = cube.get_subtree_totals(cube.get_period_totals(periods), children_by_parent=children_by_parent)
+    children = children_by_parent.get(parent.id if parent else None, [])
+    if parent:
+        totals = subtree_totals[parent.id]
+        subtree_ids = [category.id for category in categories.values() if category.path.startswith(parent.path)]
+    else:
+        totals = sum((subtree_totals[child.id] for child in children), start=np.zeros(len(periods)))
+        subtree_ids = None
+    top_sources = cube.get_top_sources(
+        from_datetime=periods[0][0], to_datetime=periods[-1][1], category_ids=subtree_ids
+    )
+    return JsonResponse(
+        dict(
+            periods=[dict(name=granularity.get_name(start), start=start, end=end) for start, end in periods],
+            category=parent.public_id if parent else None,
+            totals=[float(total) for total in totals],
+            children=[
+                dict(
+                    public_id=child.public_id,
+                    name=child.name,
+                    totals=[float(total) for total in subtree_totals[child.id]],
+                )
+                for child in children
+            ],
+            top_sources=[dict(source=source, total=total, count=count) for source, total, count in top_sources],
+        )
+    )
+
+
+def _apply_expense_batch(request: AuthenticatedHttpRequest, *, project: Project) -> JsonResponse:
+    """
+    The body is a JSON object with any of:
+    - "create": a list of expenses, each with the fields of EXPENSE_FIELDS (category is its public id, or missing for
+      the categorization rules of the project to pick it).
+    - "update": a list of expenses, each with its "public_id" and the fields to change.
+    - "delete": a list of expense public ids.
+    - "duplicates": what to do with the created expenses that are already stored, one of DUPLICATE_MODES (default:
+      "skip"). Their positions in "create" are sent back.
+    Either the whole batch is applied, in a single transaction, or none of it and every invalid item is reported.
+    """
+    try:
+        batch = json.loads(request.body)
+    except ValueError:
+        return JsonResponse(dict(error="The body must be valid JSON"), status=400)
+    if not isinstance(batch, dict):
+        return JsonResponse(dict(error="The body must be a JSON object"), status=400)
+    to_create = batch.get("create") or []
+    to_update = batch.get("update") or []
+    to_delete = batch.get("delete") or []
+    if not all(isinstance(items, list) for items in [to_create, to_update, to_delete]):
+        return JsonResponse(dict(error="create, update and delete must be lists"), status=400)
+    if len(to_create) + len(to_update) + len(to_delete) > API_MAX_BATCH_SIZE:
+        return JsonResponse(dict(error=f"A batch can't have more than {API_MAX_BATCH_SIZE} items"), status=400)
+
+    if not all(isinstance(public_id, str) for public_id in to_delete):
+        return JsonResponse(dict(error="delete must be a list of public ids"), status=400)
+    duplicates_mode = batch.get("duplicates") or "skip"
+    if duplicates_mode not in DUPLICATE_MODES:
+        return JsonResponse(dict(error=f"duplicates must be one of {DUPLICATE_MODES}"), status=400)
+
+    categories = {category.public_id: category for category in Category.objects.filter(project=project)}
+    category_public_ids = {category.id: public_id for public_id, category in categories.items()}
+    classifier = Classifier.for_project(project)
+    errors: list[dict[str, typing.Any]] = list()
+
+    new_expenses = list()
+    for index, item in enumerate(to_create):
+        form = ExpenseApiForm(item if isinstance(item, dict) else dict(), categories=categories, classifier=classifier)
+        if form.is_valid():
+            new_expenses.append(Expense(**form.cleaned_data))
+        else:
+            errors.append(dict(operation="create", index=index, errors=form.errors.get_json_data()))
+
+    update_public_ids = [item.get("public_id") for item in to_update if isinstance(item, dict)]
+    stored_expenses = {
+        expense.public_id: expense
+        for expense in Expense.objects.filter(project=project, public_id__in=update_public_ids)
+    }
+    updated_expenses = list()
+    updated_public_ids: set[str] = set()
+    for index, item in enumerate(to_update):
+        public_id = item.get("public_id") if isinstance(item, dict) else None
+        expense = stored_expenses.get(public_id) if isinstance(public_id, str) else None
+        if expense is None:
+            errors.append(dict(operation="update", index=index, errors=dict(public_id=[dict(message="Not found")])))
+            continue
+        # Applying both would move the monthly totals of the expense twice
+        if expense.public_id in updated_public_ids:
+            errors.append(
+                dict(operation="update", index=index, errors=dict(public_id=[dict(message="Updated more than once")]))
+            )
+            continue
+        updated_public_ids.add(expense.public_id)
+        # Fields missing from the item keep their stored value
+        stored_data = dict(
+            spent_at=expense.spent_at,
+            amount=expense.amount,
+            source=expense.source,
+            category=category_public_ids.get(expense.category_id, ""),
+            notes=expense.notes,
+        )
+        form = ExpenseApiForm({**stored_data, **item}, categories=categories, classifier=classifier)
+        if form.is_valid():
+            for field, value in form.cleaned_data.items():
+                setattr(expense, field, value)
+            updated_expenses.append(expense)
+        else:
+            errors.append(dict(operation="update", index=index, errors=form.errors.get_json_data()))
+
+    deleted_public_ids = set(
+        Expense.objects.filter(project=project, public_id__in=to_delete).values_list("public_id", flat=True)
+    )
+    for index, public_id in enumerate(to_delete):
+        if public_id not in deleted_public_ids:
+            errors.append(dict(operation="delete", index=index, errors=dict(public_id=[dict(message="Not found")])))
+
+    if errors:
+        return JsonResponse(dict(errors=errors), status=400)
+
+    with transaction.atomic():
+        deduplicated = deduplicate(new_expenses, project=project, mode=duplicates_mode)
+        if deduplicated.to_create:
+            Expense.create_in_bulk(deduplicated.to_create, project=project)
+        if deduplicated.to_update:
+            Expense.update_in_bulk(deduplicated.to_update, fields=["notes"], project=project)
+        if updated_expenses:
+            Expense.update_in_bulk(updated_expenses, fields=EXPENSE_FIELDS, project=project)
+        if deleted_public_ids:
+            Expense.delete_in_bulk(
+                Expense.objects.filter(project=project, public_id__in=deleted_public_ids), project=project
+            )
+
+    return JsonResponse(
+        dict(
+            created=[expense.public_id for expense in deduplicated.to_create],
+            duplicates=deduplicated.duplicates,
+            updated=[expense.public_id for expense in updated_expenses],
+            deleted=sorted(deleted_public_ids),
+        )
+    )
@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ExpensesConfig(AppConfig):
     name = "expenses"
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        import expenses.signals  # noqa: F401
+        from expenses.search import restore_sqlite_triggers
+        from helpers.querylog import install_query_log
+
+        if settings.QUERY_LOG_PATH:
+            connection_created.connect(install_query_log, dispatch_uid="install_query_log")
+        post_migrate.connect(restore_sqlite_triggers, sender=self, dispatch_uid="restore_sqlite_triggers")
@@ -0,0 +1,67 @@
+import datetime
+import typing
+import uuid
+from dataclasses import dataclass
+
+from expenses.models import Category, CategoryMonthTotal
+from expenses.periods import MONTHS_PER_PERIOD, Granularity
+
+MONTHS_PER_WEEK = 12 / 52
+
+
+@dataclass(frozen=True)
+class ExceededBudget:
+    category: Category
+    spent: float
+    budget: float
+
+
+def roll_up_budgets(categories: typing.Iterable[Category]) -> dict[uuid.UUID, float]:
+    """
+    The monthly budget of every category that has one: its own, or else the sum of those of its children. Takes whole
+    subtrees, e.g. the categories of Category.build_tree(), so it never queries
+    """
+    # By id, as e.g. the dashboard values list the parents twice (their total and their "other" cell)
+    categories_by_id = {category.id: category for category in categories}
+    budgets: dict[uuid.UUID, float] = dict()
+    children_budgets: dict[uuid.UUID, float] = dict()
+    # Deepest first, so the children are done before their parents
+    for category in sorted(categories_by_id.values(), key=lambda category: category.path.count("/"), reverse=True):
+        budget = category.monthly_budget if category.monthly_budget is not None else children_budgets.get(category.id)
+        if budget is None:
+            continue
+        budgets[category.id] = budget
+        if category.parent_id in categories_by_id:
+            children_budgets[category.parent_id] = children_budgets.get(category.parent_id, 0.0) + budget
+    return budgets
+
+
+def get_period_budget(monthly_budget: float, granularity: Granularity) -> float:
+    if granularity.name == "week":
+        return monthly_budget * MONTHS_PER_WEEK
+    return monthly_budget * MONTHS_PER_PERIOD[granularity.name]
+
+
+def get_exceeded_budgets(*, category: Category, month: datetime.date) -> list[ExceededBudget]:
+    """
+    The budgets of the category and its parents that the month is over, the category first. The spending comes from
+    the monthly totals (kept by every expense write), so it costs two queries however many expenses there are
+    """
+    root_path = category.path.split("/")[0] + "/"
+    categories = list(Category.objects.filter(project_id=category.project_id, path__startswith=root_path))
+    budgets = roll_up_budgets(categories)
+    budgeted = [c for c in categories if c.id in budgets and category.path.startswith(c.path)]
+    if not budgeted:
+        return []
+    totals = list(
+        CategoryMonthTotal.objects.filter(
+            category__project_id=category.project_id, category__path__startswith=root_path, month=month
+        ).values_list("category__path", "total")
+    )
+    exceeded = list()
+    for budgeted_category in sorted(budgeted, key=lambda c: len(c.path), reverse=True):
+        spent = sum(total for path, total in totals if path.startswith(budgeted_category.path))
+        # Whatever the sign the project records its spending with
+        if abs(spent) > budgets[budgeted_category.id]:
+            exceeded.append(ExceededBudget(budgeted_category, spent, budgets[budgeted_category.id]))
+    return exceeded
@@ -0,0 +1,133 @@
+import collections
+import re
+import typing
+import uuid
+
+from expenses.models import CategorizationRule, Project
+
+
+class AhoCorasick:
+    """
+    Finds which of many substrings a text contains in a single pass over the text, however many substrings there are.
+    Each substring is a node of a trie, and the failure links jump to the longest suffix that is also in the trie
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self.transitions: list[dict[str, int]] = [dict()]
+        self.outputs: list[set[str]] = [set()]
+        for pattern in patterns:
+            node = 0
+            for char in pattern:
+                next_node = self.transitions[node].get(char)
+                if next_node is None:
+                    next_node = self.transitions[node][char] = len(self.transitions)
+                    self.transitions.append(dict())
+                    self.outputs.append(set())
+                node = next_node
+            self.outputs[node].add(pattern)
+
+        # Breadth first, so the failure link of every shallower node is known already
+        self.failures = [0] * len(self.transitions)
+        pending = collections.deque(self.transitions[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, next_node in self.transitions[node].items():
+                failure = self.failures[node]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[next_node] = self.transitions[failure].get(char, 0)
+                self.outputs[next_node] |= self.outputs[self.failures[next_node]]
+                pending.append(next_node)
+
+    def find(self, text: str) -> set[str]:
+        found: set[str] = set()
+        node = 0
+        for char in text:
+            while node and char not in self.transitions[node]:
+                node = self.failures[node]
+            node = self.transitions[node].get(char, 0)
+            if self.outputs[node]:
+                found |= self.outputs[node]
+        return found
+
+
+class Classifier:
+    """
+    All the rules of a project compiled into one matcher: an Aho-Corasick automaton for the literal conditions (source
+    substrings and notes keywords) and a single regex for the source regexes. Classifying an expense runs each of them
+    once, and only checks the few rules they hit instead of every rule
+    """
+
+    def __init__(self, rules: typing.Iterable[CategorizationRule]):
+        self.rules = sorted(rules, key=lambda rule: (rule.order, rule.created_at))
+        self.keywords_by_rule = [set(rule.notes_keywords.lower().split()) for rule in self.rules]
+        self.source_matcher = AhoCorasick(rule.source_contains.lower() for rule in self.rules if rule.source_contains)
+        self.notes_matcher = AhoCorasick(keyword for keywords in self.keywords_by_rule for keyword in keywords)
+        # Every regex is an optional lookahead with its own group, so one match tells which of them are found. Those with
+        # groups of their own are matched one by one instead: combined, their names could clash and their numbered
+        # backreferences would point at the groups of other rules
+        regexes = [(i, rule.source_regex) for i, rule in enumerate(self.rules) if rule.source_regex]
+        self.separate_regexes = [
+            (i, re.compile(regex, re.IGNORECASE | re.DOTALL)) for i, regex in regexes if re.compile(regex).groups
+        ]
+        separate_ids = {i for i, _ in self.separate_regexes}
+        combined = [(i, regex) for i, regex in regexes if i not in separate_ids]
+        self.source_regex = (
+            re.compile("".join(f"(?:(?=.*?(?P<rule{i}>{regex})))?" for i, regex in combined), re.IGNORECASE | re.DOTALL)
+            if combined
+            else None
+        )
+        # Rules with no text condition can't be hit by the matchers, so they are always checked
+        self.always_checked = [
+            i
+            for i, rule in enumerate(self.rules)
+            if not (rule.source_contains or rule.source_regex or self.keywords_by_rule[i])
+        ]
+        self.rules_by_substring: dict[str, list[int]] = collections.defaultdict(list)
+        self.rules_by_keyword: dict[str, list[int]] = collections.defaultdict(list)
+        for i, rule in enumerate(self.rules):
+            if rule.source_contains:
+                self.rules_by_substring[rule.source_contains.lower()].append(i)
+            for keyword in self.keywords_by_rule[i]:
+                self.rules_by_keyword[keyword].append(i)
+
+    @staticmethod
+    def for_project(project: Project) -> "Classifier":
+        return Classifier(CategorizationRule.objects.filter(project=project))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def classify(self, *, source: str, amount: float, notes: str = "") -> typing.Optional[uuid.UUID]:
+        """The category id of the first rule the expense matches, if any"""
+        if not self.rules:
+            return None
+        source = source.lower()
+        substrings = self.source_matcher.find(source)
+        regex_hits: set[int] = set()
+        if self.source_regex:
+            match = self.source_regex.match(source)
+            if match is not None:
+                regex_hits = {int(name[4:]) for name, value in match.groupdict().items() if value is not None}
+        regex_hits.update(i for i, regex in self.separate_regexes if regex.search(source))
+        keywords = self.notes_matcher.find(notes.lower()) if notes else set()
+
+        candidates = set(self.always_checked) | regex_hits
+        for substring in substrings:
+            candidates.update(self.rules_by_substring[substring])
+        for keyword in keywords:
+            candidates.update(self.rules_by_keyword[keyword])
+        for i in sorted(candidates):
+            rule = self.rules[i]
+            if rule.source_contains and rule.source_contains.lower() not in substrings:
+                continue
+            if rule.source_regex and i not in regex_hits:
+                continue
+            if self.keywords_by_rule[i] and not self.keywords_by_rule[i] & keywords:
+                continue
+            if rule.amount_min is not None and amount < rule.amount_min:
+                continue
+            if rule.amount_max is not None and amount > rule.amount_max:
+                continue
+            return rule.category_id
+        return None
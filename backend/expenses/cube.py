@@ -0,0 +1,199 @@
+import collections
+import datetime
+import logging
+import threading
+import typing
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+from expenses.models import Category, Expense, Project
+
+logger = logging.getLogger(__name__)
+
+ROW_FIELDS = ["id", "category_id", "spent_at", "amount", "source", "created_at"]
+# Transactions may commit after others that started later, so writes are read again from a bit before the watermark
+WATERMARK_MARGIN = datetime.timedelta(minutes=1)
+
+
+class ProjectCube:
+    """
+    A columnar copy of the expenses of a project: one NumPy array per column, with the categories and sources
+    replaced by their index. Slicing it by periods, categories or sources is vectorized, instead of a query per slice.
+
+    It remembers the data version of the project it was loaded at, and the last write it has seen (the "created_at"
+    of BaseModel is auto_now, so it's really the time of the last write). Newer writes are merged into it, and deleted
+    expenses (which leave no trace) are noticed by counting the expenses, in which case it's loaded from scratch
+    """
+
+    def __init__(self, *, project: Project):
+        self.project_id = project.id
+        self.data_version = project.data_version
+        self.watermark: typing.Optional[datetime.datetime] = None
+        self.category_ids: list[uuid.UUID] = list()
+        self.category_indexes: dict[uuid.UUID, int] = dict()
+        self.sources: list[str] = list()
+        self.source_indexes: dict[str, int] = dict()
+        self.row_indexes: dict[uuid.UUID, int] = dict()
+        self.category = np.empty(0, dtype=np.int32)
+        self.day = np.empty(0, dtype=np.int32)
+        self.amount = np.empty(0, dtype=np.float64)
+        self.source = np.empty(0, dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        # The arrays plus a rough estimate of the dictionaries mapping ids and sources to indexes
+        arrays = self.category.nbytes + self.day.nbytes + self.amount.nbytes + self.source.nbytes
+        return arrays + 100 * (len(self.row_indexes) + len(self.source_indexes) + len(self.category_indexes))
+
+    @staticmethod
+    def load(project: Project) -> "ProjectCube":
+        cube = ProjectCube(project=project)
+        cube.merge(Expense.objects.filter(project=project).values_list(*ROW_FIELDS).iterator(chunk_size=10000))
+        return cube
+
+    def refresh(self, project: Project) -> "ProjectCube":
+        """Brings the cube up to date with the project, returning a new cube if it had to be loaded from scratch"""
+        if project.data_version == self.data_version:
+            return self
+        expenses = Expense.objects.filter(project=project)
+        if self.watermark:
+            # Merging the same write twice is harmless
+            self.merge(expenses.filter(created_at__gte=self.watermark - WATERMARK_MARGIN).values_list(*ROW_FIELDS))
+        if len(self.row_indexes) != expenses.count():
+            logger.info(f"Reloading the cube of project {project.id}: expenses were deleted")
+            return ProjectCube.load(project)
+        self.data_version = project.data_version
+        return self
+
+    def merge(self, rows: typing.Iterable[tuple]):
+        new_rows: list[tuple[int, int, float, int]] = list()
+        for expense_id, category_id, spent_at, amount, source, created_at in rows:
+            values = (
+                self._get_category_index(category_id),
+                spent_at.toordinal(),
+                amount,
+                self._get_source_index(source),
+            )
+            row_index = self.row_indexes.get(expense_id)
+            if row_index is None:
+                self.row_indexes[expense_id] = len(self.row_indexes)
+                new_rows.append(values)
+            else:
+                self.category[row_index], self.day[row_index], self.amount[row_index], self.source[row_index] = values
+            if self.watermark is None or created_at > self.watermark:
+                self.watermark = created_at
+        if new_rows:
+            categories, days, amounts, sources = zip(*new_rows)
+            self.category = np.concatenate([self.category, np.array(categories, dtype=np.int32)])
+            self.day = np.concatenate([self.day, np.array(days, dtype=np.int32)])
+            self.amount = np.concatenate([self.amount, np.array(amounts, dtype=np.float64)])
+            self.source = np.concatenate([self.source, np.array(sources, dtype=np.int32)])
+
+    def get_period_totals(self, periods: list[tuple[datetime.datetime, datetime.datetime]]) -> np.ndarray:
+        """The total of each category (columns, by index) in each period (rows)"""
+        shape = (len(periods), len(self.category_ids))
+        if not periods:
+            return np.zeros(shape)
+        period_index, in_periods = self._get_period_index(periods)
+        cells = period_index[in_periods] * len(self.category_ids) + self.category[in_periods]
+        return np.bincount(cells, weights=self.amount[in_periods], minlength=shape[0] * shape[1]).reshape(shape)
+
+    def get_subtree_totals(
+        self,
+        totals: np.ndarray,
+        *,
+        children_by_parent: dict[typing.Optional[uuid.UUID], list[Category]],
+    ) -> dict[uuid.UUID, np.ndarray]:
+        """
+        The totals of each category plus all of its descendants. In depth-first order every subtree is a contiguous
+        range of columns, so each sum is the difference of two cumulative sums
+        """
+        preorder: list[Category] = list()
+        subtree_ends: dict[uuid.UUID, int] = dict()
+        pending: list[tuple[Category, bool]] = [(root, False) for root in reversed(children_by_parent.get(None, []))]
+        while pending:
+            category, visited = pending.pop()
+            if visited:
+                subtree_ends[category.id] = len(preorder)
+                continue
+            preorder.append(category)
+            pending.append((category, True))
+            pending.extend((child, False) for child in reversed(children_by_parent.get(category.id, [])))
+
+        columns = np.zeros((totals.shape[0], len(preorder)))
+        for a, category in enumerate(preorder):
+            if category.id in self.category_indexes:
+                columns[:, a] = totals[:, self.category_indexes[category.id]]
+        cumulative = np.concatenate([np.zeros((totals.shape[0], 1)), np.cumsum(columns, axis=1)], axis=1)
+        return {
+            category.id: cumulative[:, subtree_ends[category.id]] - cumulative[:, a]
+            for a, category in enumerate(preorder)
+        }
+
+    def get_top_sources(
+        self,
+        *,
+        from_datetime: datetime.datetime,
+        to_datetime: datetime.datetime,
+        category_ids: typing.Optional[typing.Collection[uuid.UUID]] = None,
+        limit: int = 10,
+    ) -> list[tuple[str, float, int]]:
+        """The sources with the biggest absolute total in the range (and categories), with their total and count"""
+        mask = (self.day >= from_datetime.toordinal()) & (self.day < to_datetime.toordinal())
+        if category_ids is not None:
+            indexes = [self.category_indexes[id_] for id_ in category_ids if id_ in self.category_indexes]
+            mask &= np.isin(self.category, np.array(indexes, dtype=np.int32))
+        totals = np.bincount(self.source[mask], weights=self.amount[mask], minlength=len(self.sources))
+        counts = np.bincount(self.source[mask], minlength=len(self.sources))
+        top = np.argsort(-np.abs(totals), kind="stable")[:limit]
+        return [(self.sources[i], float(totals[i]), int(counts[i])) for i in top if counts[i]]
+
+    def _get_period_index(self, periods: list[tuple[datetime.datetime, datetime.datetime]]):
+        # Periods are contiguous, so the edges are their starts plus the end of the last one
+        edges = np.array([start.toordinal() for start, _ in periods] + [periods[-1][1].toordinal()], dtype=np.int32)
+        period_index = np.searchsorted(edges, self.day, side="right") - 1
+        return period_index, (period_index >= 0) & (period_index < len(periods))
+
+    def _get_category_index(self, category_id: uuid.UUID) -> int:
+        index = self.category_indexes.get(category_id)
+        if index is None:
+            index = self.category_indexes[category_id] = len(self.category_ids)
+            self.category_ids.append(category_id)
+        return index
+
+    def _get_source_index(self, source: str) -> int:
+        index = self.source_indexes.get(source)
+        if index is None:
+            index = self.source_indexes[source] = len(self.sources)
+            self.sources.append(source)
+        return index
+
+
+class CubeCache:
+    """The cubes of the most recently used projects, evicting the least recently used ones over `max_bytes`"""
+
+    def __init__(self, *, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._cubes: collections.OrderedDict[uuid.UUID, ProjectCube] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project: Project) -> ProjectCube:
+        with self._lock:
+            cube = self._cubes.pop(project.id, None)
+        cube = cube.refresh(project) if cube else ProjectCube.load(project)
+        with self._lock:
+            self._cubes[project.id] = cube
+            total_bytes = sum(cube_.nbytes for cube_ in self._cubes.values())
+            while total_bytes > self.max_bytes and len(self._cubes) > 1:
+                _, evicted = self._cubes.popitem(last=False)
+                total_bytes -= evicted.nbytes
+        return cube
+
+    def clear(self):
+        with self._lock:
+            self._cubes.clear()
+
+
+cubes = CubeCache(max_bytes=settings.PROJECT_CUBE_MAX_BYTES)
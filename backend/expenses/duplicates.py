@@ -0,0 +1,76 @@
+import collections
+import typing
+from dataclasses import dataclass, field
+
+from expenses.models import Expense, Project
+
+# What to do with the new expenses that look like stored ones: leave them out, create them marked as possible
+# duplicates, fold their notes into the stored ones, or create them anyway
+DUPLICATE_MODES = ["skip", "flag", "merge", "allow"]
+
+
+@dataclass
+class DeduplicatedBatch:
+    to_create: list[Expense] = field(default_factory=list)
+    to_update: list[Expense] = field(default_factory=list)
+    # Positions in the batch of the expenses that were found to be duplicates
+    duplicates: list[int] = field(default_factory=list)
+
+
+class Deduplicator:
+    """
+    Finds which new expenses are already stored, by their fingerprints, in a single query per batch.
+
+    Expenses with the same fingerprint can be legit (two coffees on the same day), so they are paired one to one: when
+    a fingerprint is stored twice and comes three times, only the first two are duplicates. The batches of one import
+    are checked against what was stored before the first of them: the stored expenses of a fingerprint are only looked
+    up the first time it comes, so the expenses the earlier batches created never count, whatever the batch size
+    """
+
+    def __init__(self, *, project: Project, mode: str = "skip"):
+        if mode not in DUPLICATE_MODES:
+            raise ValueError(f"{mode!r} isn't a duplicate mode, try one of {DUPLICATE_MODES}")
+        self.project = project
+        self.mode = mode
+        # The stored expenses of every fingerprint seen so far that haven't been paired yet
+        self.stored: dict[str, collections.deque[Expense]] = dict()
+
+    def deduplicate(self, expenses: list[Expense]) -> DeduplicatedBatch:
+        if self.mode == "allow":
+            return DeduplicatedBatch(to_create=list(expenses))
+
+        for expense in expenses:
+            expense.update_fingerprint()
+        new_fingerprints = {expense.fingerprint for expense in expenses} - self.stored.keys()
+        if new_fingerprints:
+            for fingerprint in new_fingerprints:
+                self.stored[fingerprint] = collections.deque()
+            for stored_expense in (
+                Expense.objects.filter(project=self.project, fingerprint__in=new_fingerprints)
+                .select_related("category")
+                .order_by("updated_at")
+            ):
+                self.stored[stored_expense.fingerprint].append(stored_expense)
+
+        batch = DeduplicatedBatch()
+        updated: dict[typing.Any, Expense] = dict()
+        for index, expense in enumerate(expenses):
+            matches = self.stored[expense.fingerprint]
+            if not matches:
+                batch.to_create.append(expense)
+                continue
+            stored_expense = matches.popleft()
+            batch.duplicates.append(index)
+            if self.mode == "flag":
+                expense.possible_duplicate = True
+                batch.to_create.append(expense)
+            elif self.mode == "merge" and expense.notes and expense.notes not in stored_expense.notes:
+                stored_expense.notes = f"{stored_expense.notes}\n{expense.notes}".strip()[:1000]
+                updated[stored_expense.pk] = stored_expense
+        batch.to_update = list(updated.values())
+        return batch
+
+
+def deduplicate(expenses: list[Expense], *, project: Project, mode: str = "skip") -> DeduplicatedBatch:
+    """A single batch, see Deduplicator"""
+    return Deduplicator(project=project, mode=mode).deduplicate(expenses)
@@ -3,7 +3,11 @@ import datetime
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Button, Column, Div, Field, Layout, Row, Submit
 from django import forms
+from django.urls import reverse
 
+from expenses.categorization import Classifier
+from expenses.duplicates import DUPLICATE_MODES
+from expenses.importers import DEFAULT_CSV_COLUMNS, PARSERS
 from expenses.models import Category, Expense, Project
 
 
@@ -46,6 +50,43 @@ class ExpenseForm(forms.ModelForm):
         self.fields["category"].empty_label = None
 
 
+class ExpenseApiForm(forms.Form):
+    # The same rules as ExpenseForm, but the category is looked up by public id in an index of the project categories
+    # instead of running one query per expense of a batch. Without a category, the categorization rules pick it
+    spent_at = ExpenseForm.base_fields["spent_at"]
+    amount = ExpenseForm.base_fields["amount"]
+    source = ExpenseForm.base_fields["source"]
+    category = forms.CharField(required=False)
+    notes = ExpenseForm.base_fields["notes"]
+
+    def __init__(self, *args, categories: dict[str, Category], classifier: Classifier, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.categories = categories
+        self.classifier = classifier
+
+    def clean_category(self):
+        if not self.cleaned_data["category"]:
+            return None
+        category = self.categories.get(self.cleaned_data["category"])
+        if category is None:
+            raise forms.ValidationError("There is no such category in this project.")
+        return category
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if "category" in cleaned_data and cleaned_data["category"] is None:
+            category_id = None
+            if self.classifier and "source" in cleaned_data and "amount" in cleaned_data:
+                category_id = self.classifier.classify(
+                    source=cleaned_data["source"], amount=cleaned_data["amount"], notes=cleaned_data.get("notes", "")
+                )
+            category = next((c for c in self.categories.values() if c.id == category_id), None)
+            if category is None:
+                self.add_error("category", "This field is required when no categorization rule matches.")
+            cleaned_data["category"] = category
+        return cleaned_data
+
+
 class UpdateExpenseForm(ExpenseForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -66,15 +107,23 @@ class UpdateExpenseForm(ExpenseForm):
 
 
 class CreateExpenseFormInline(ExpenseForm):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, *args, project, **kwargs):
+        super().__init__(*args, project=project, **kwargs)
         self.helper = FormHelper()
         self.helper.form_method = "post"
         self.helper.form_show_labels = False
         self.helper.layout = Layout(
             Row(
                 Column(
-                    Field("source", placeholder="e.g. McDonalds", size=20),
+                    # Autocompleted by merchants.js
+                    Field(
+                        "source",
+                        placeholder="e.g. McDonalds",
+                        size=20,
+                        autocomplete="off",
+                        list="merchant-suggestions",
+                        data_merchants_url=reverse("expenses:merchant_list", args=[project.public_id]),
+                    ),
                     css_class="col-12 col-sm col-xl-auto order-1",
                 ),
                 Column("category", css_class="col-12 col-sm-auto mr-xl-auto order-2"),
@@ -97,3 +146,40 @@ class CreateExpenseFormInline(ExpenseForm):
                 ),
             ),
         )
+
+
+class ExpenseImportForm(forms.Form):
+    statement = forms.FileField()
+    format = forms.ChoiceField(choices=[(format_, format_.upper()) for format_ in PARSERS], initial="csv")
+    default_category = forms.ModelChoiceField(
+        queryset=Category.objects.none(),
+        required=False,
+        help_text="Used for the rows without a category, or with one that doesn't exist in the project.",
+    )
+    date_format = forms.CharField(required=False, help_text="e.g. %Y-%m-%d. Leave it empty to use the default.")
+    negate_amounts = forms.BooleanField(required=False, help_text="Flip the sign of every amount.")
+    duplicates = forms.ChoiceField(
+        choices=[(mode, mode.capitalize()) for mode in DUPLICATE_MODES],
+        initial="skip",
+        required=False,
+        help_text=(
+            "What to do with the rows already stored (same day, amount and source): skip them, import them flagged,"
+            " add their notes to the stored ones, or import them anyway."
+        ),
+    )
+    spent_at_column = forms.CharField(initial=DEFAULT_CSV_COLUMNS["spent_at"], label="Date column (CSV)")
+    amount_column = forms.CharField(initial=DEFAULT_CSV_COLUMNS["amount"], label="Amount column (CSV)")
+    source_column = forms.CharField(initial=DEFAULT_CSV_COLUMNS["source"], label="Source column (CSV)")
+    notes_column = forms.CharField(initial=DEFAULT_CSV_COLUMNS["notes"], label="Notes column (CSV)")
+    category_column = forms.CharField(initial=DEFAULT_CSV_COLUMNS["category"], label="Category column (CSV)")
+
+    def __init__(self, *args, project, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["default_category"].queryset = Category.objects.filter(project=project).order_by("order")
+        self.fields["default_category"].label_from_instance = lambda c: c.name
+        self.helper = FormHelper()
+        self.helper.form_method = "post"
+        self.helper.add_input(
+            Button("cancel", "Cancel", css_class="btn btn-secondary", onclick="window.history.back()")
+        )
+        self.helper.add_input(Submit("submit", "Import"))
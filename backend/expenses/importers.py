@@ -0,0 +1,226 @@
+import csv
+import datetime
+import functools
+import itertools
+import logging
+import re
+import time
+import typing
+import uuid
+from dataclasses import dataclass
+
+from django.db import transaction
+
+from expenses.categorization import Classifier
+from expenses.duplicates import Deduplicator
+from expenses.models import Category, Expense, Project
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CSV_COLUMNS = dict(spent_at="date", amount="amount", source="source", notes="notes", category="category")
+OFX_CHUNK_SIZE = 64 * 1024
+OFX_TAG_REGEX = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+class InvalidStatement(Exception):
+    pass
+
+
+@dataclass
+class StatementRow:
+    line: int
+    spent_at: datetime.datetime
+    amount: float
+    source: str
+    notes: str = ""
+    category_name: str = ""
+
+
+@dataclass
+class ImportResult:
+    created: int
+    seconds: float
+    duplicates: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.created / self.seconds if self.seconds else 0.0
+
+
+def parse_csv(
+    lines: typing.Iterable[str],
+    *,
+    columns: typing.Optional[dict[str, str]] = None,
+    date_format: str = "%Y-%m-%d",
+    delimiter: str = ",",
+) -> typing.Iterator[StatementRow]:
+    columns = {**DEFAULT_CSV_COLUMNS, **(columns or dict())}
+    reader = csv.DictReader(lines, delimiter=delimiter)
+    missing_columns = [
+        columns[field] for field in ["spent_at", "amount", "source"] if columns[field] not in (reader.fieldnames or [])
+    ]
+    if missing_columns:
+        raise InvalidStatement(f"The CSV header is missing the columns {missing_columns}")
+
+    for row in reader:
+        yield StatementRow(
+            line=reader.line_num,
+            spent_at=_parse_datetime(row[columns["spent_at"]], date_format, line=reader.line_num),
+            amount=_parse_amount(row[columns["amount"]], line=reader.line_num),
+            source=row[columns["source"]].strip(),
+            notes=(row.get(columns["notes"]) or "").strip(),
+            category_name=(row.get(columns["category"]) or "").strip(),
+        )
+
+
+def parse_ofx(lines: typing.Iterable[str], **_) -> typing.Iterator[StatementRow]:
+    # OFX 1.x is SGML (elements are not closed) and many banks put the whole file in a single line, so tokenize tags
+    # instead of lines. Only the <STMTTRN> aggregates matter
+    if hasattr(lines, "read"):
+        lines = iter(functools.partial(lines.read, OFX_CHUNK_SIZE), "")
+    transaction_: typing.Optional[dict[str, str]] = None
+    number = 0
+    for closing, tag, value in _tokenize_ofx(lines):
+        tag = tag.upper()
+        if tag == "STMTTRN":
+            if not closing:
+                transaction_ = dict()
+                continue
+            if transaction_ is not None:
+                number += 1
+                posted = transaction_.get("DTPOSTED", "")
+                yield StatementRow(
+                    line=number,
+                    spent_at=_parse_datetime(posted[:14].ljust(14, "0"), "%Y%m%d%H%M%S", line=number),
+                    amount=_parse_amount(transaction_.get("TRNAMT", ""), line=number),
+                    source=transaction_.get("NAME") or transaction_.get("PAYEE") or "",
+                    notes=transaction_.get("MEMO", ""),
+                )
+            transaction_ = None
+        elif transaction_ is not None and not closing:
+            transaction_[tag] = value.strip()
+
+
+def parse_qif(lines: typing.Iterable[str], *, date_format: str = "%m/%d/%Y", **_) -> typing.Iterator[StatementRow]:
+    record: dict[str, str] = dict()
+    for number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code != "^":
+            record[code] = value
+            continue
+        if record:
+            yield StatementRow(
+                line=number,
+                spent_at=_parse_datetime(record.get("D", "").replace("'", "/"), date_format, line=number),
+                amount=_parse_amount(record.get("T") or record.get("U") or "", line=number),
+                source=record.get("P", ""),
+                notes=record.get("M", ""),
+                # Subcategories are written as "Parent:Child"; transfers as "[Account]"
+                category_name=record.get("L", "").split(":")[-1] if not record.get("L", "").startswith("[") else "",
+            )
+        record = dict()
+
+
+PARSERS: dict[str, typing.Callable[..., typing.Iterator[StatementRow]]] = dict(
+    csv=parse_csv, ofx=parse_ofx, qif=parse_qif
+)
+
+
+@transaction.atomic
+def import_expenses(
+    rows: typing.Iterable[StatementRow],
+    *,
+    project: Project,
+    default_category: typing.Optional[Category] = None,
+    negate_amounts: bool = False,
+    duplicates: str = "skip",
+    batch_size: int = 1000,
+) -> ImportResult:
+    """
+    Imports the rows in batches, to keep the memory flat. It's all in one transaction, so that an invalid row further
+    down the statement leaves nothing imported rather than the batches before it
+    """
+    categories_by_name: dict[str, Category] = dict()
+    categories_by_id: dict[uuid.UUID, Category] = dict()
+    for stored_category in Category.objects.filter(project=project).order_by("order"):
+        categories_by_name.setdefault(stored_category.name.lower(), stored_category)
+        categories_by_id[stored_category.id] = stored_category
+    classifier = Classifier.for_project(project)
+    deduplicator = Deduplicator(project=project, mode=duplicates)
+
+    started_at = time.monotonic()
+    created = duplicate_count = 0
+    rows_iterator = iter(rows)
+    while batch := list(itertools.islice(rows_iterator, batch_size)):
+        expenses = list()
+        for row in batch:
+            amount = -row.amount if negate_amounts else row.amount
+            # The category of the statement first, then the categorization rules of the project, then the default one
+            category: typing.Optional[Category] = (
+                categories_by_name.get(row.category_name.lower()) if row.category_name else None
+            )
+            if category is None and classifier:
+                category_id = classifier.classify(source=row.source, amount=amount, notes=row.notes)
+                category = categories_by_id.get(category_id) if category_id else None
+            category = category or default_category
+            if category is None:
+                raise InvalidStatement(
+                    f"Line {row.line}: no category or rule matches {row.category_name!r} and no default"
+                )
+            expenses.append(
+                Expense(
+                    category=category,
+                    spent_at=row.spent_at,
+                    amount=amount,
+                    source=row.source[:200],
+                    notes=row.notes[:1000],
+                )
+            )
+        # Overlapping statements repeat expenses, which are told apart from the ones stored before the import
+        deduplicated = deduplicator.deduplicate(expenses)
+        Expense.create_in_bulk(deduplicated.to_create, project=project, batch_size=batch_size)
+        if deduplicated.to_update:
+            Expense.update_in_bulk(deduplicated.to_update, fields=["notes"], project=project, batch_size=batch_size)
+        created += len(deduplicated.to_create)
+        duplicate_count += len(deduplicated.duplicates)
+        logger.info(f"Imported {created} expenses into {project} ({duplicate_count} duplicates)")
+
+    result = ImportResult(created=created, seconds=time.monotonic() - started_at, duplicates=duplicate_count)
+    metrics.IMPORTED_EXPENSES.inc(result.created)
+    metrics.IMPORT_DURATION.observe(result.seconds)
+    return result
+
+
+def _tokenize_ofx(chunks: typing.Iterable[str]) -> typing.Iterator[tuple[bool, str, str]]:
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        # Keep the last tag around: its value could continue in the next chunk
+        last_tag_at = pending.rfind("<")
+        for match in OFX_TAG_REGEX.finditer(pending, 0, last_tag_at if last_tag_at > 0 else 0):
+            yield match.group(1) == "/", match.group(2), match.group(3)
+        pending = pending[max(last_tag_at, 0) :]
+    for match in OFX_TAG_REGEX.finditer(pending):
+        yield match.group(1) == "/", match.group(2), match.group(3)
+
+
+def _parse_datetime(value: str, date_format: str, *, line: int) -> datetime.datetime:
+    try:
+        return datetime.datetime.strptime(value.strip(), date_format)
+    except ValueError as exc:
+        raise InvalidStatement(f"Line {line}: {value!r} doesn't match the date format {date_format!r}") from exc
+
+
+def _parse_amount(value: str, *, line: int) -> float:
+    value = value.strip().replace(" ", "")
+    if "," in value and "." in value:
+        # Thousands separators, e.g. "1,234.56" or "1.234,56"
+        value = value.replace("," if value.rfind(",") < value.rfind(".") else ".", "")
+    try:
+        return float(value.replace(",", "."))
+    except ValueError as exc:
+        raise InvalidStatement(f"Line {line}: {value!r} isn't a valid amount") from exc
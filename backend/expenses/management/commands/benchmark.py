@@ -0,0 +1,147 @@
+import json
+import statistics
+import time
+import tracemalloc
+import typing
+from dataclasses import asdict, dataclass
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from auth.models import User
+from expenses.models import Project
+
+
+@dataclass
+class Measurement:
+    seconds: float
+    queries: int
+    peak_kib: float
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the main views against the biggest project (see generate_synthetic_data), recording wall time,"
+        " query count and peak memory, and optionally fails when they regress over a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", help="Public id of the project (default: the one with the most expenses)")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each scenario (default: %(default)s)")
+        parser.add_argument("--baseline", help="Path of a JSON baseline to compare against")
+        parser.add_argument("--save-baseline", action="store_true", help="Store the results as the --baseline")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative regression of time and memory over the baseline (default: %(default)s)",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["project"]:
+            project = Project.objects.get(public_id=kwargs["project"])
+        else:
+            project = Project.objects.annotate(expense_count=Count("expenses")).order_by("-expense_count").first()
+        if project is None:
+            raise CommandError("There are no projects. Try running generate_synthetic_data first.")
+
+        admin, created = User.objects.get_or_create(
+            username="benchmark-admin", defaults=dict(is_staff=True, is_superuser=True)
+        )
+        if created:
+            admin.set_unusable_password()
+            admin.save()
+        owner_client = Client(SERVER_NAME="localhost")
+        owner_client.force_login(project.user)
+        admin_client = Client(SERVER_NAME="localhost")
+        admin_client.force_login(admin)
+
+        category = project.categories.order_by("order").first()
+        project_kwargs = dict(project_public_id=project.public_id)
+
+        def get_project_detail_cold():
+            cache.clear()
+            return owner_client.get(reverse("expenses:project_detail", kwargs=project_kwargs))
+
+        scenarios: dict[str, typing.Callable[[], typing.Any]] = dict(
+            project_detail_cold=get_project_detail_cold,
+            project_detail_warm=lambda: owner_client.get(reverse("expenses:project_detail", kwargs=project_kwargs)),
+            expense_list=lambda: owner_client.get(reverse("expenses:expense_list", kwargs=project_kwargs)),
+            expense_create=lambda: owner_client.post(
+                reverse("expenses:expense_create", kwargs=project_kwargs),
+                dict(spent_at="2022-01-01T10:00", amount="12.34", source="Benchmark", category=category.pk, notes=""),
+            ),
+            admin_expense_changelist=lambda: admin_client.get(reverse("admin:expenses_expense_changelist")),
+            admin_category_changelist=lambda: admin_client.get(reverse("admin:expenses_category_changelist")),
+            admin_project_changelist=lambda: admin_client.get(reverse("admin:expenses_project_changelist")),
+        )
+
+        results = dict()
+        for name, scenario in scenarios.items():
+            # Nothing is kept: expense_create would otherwise make every later run slightly bigger
+            with transaction.atomic():
+                results[name] = self._measure(scenario, repeat=kwargs["repeat"])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{name:<28} {results[name].seconds * 1000:9.1f}ms {results[name].queries:5} queries"
+                f" {results[name].peak_kib:9.0f}KiB"
+            )
+
+        if kwargs["baseline"] and kwargs["save_baseline"]:
+            with open(kwargs["baseline"], "w", encoding="utf-8") as file:
+                json.dump({name: asdict(result) for name, result in results.items()}, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Successfully saved the baseline to {kwargs['baseline']}."))
+        elif kwargs["baseline"]:
+            with open(kwargs["baseline"], encoding="utf-8") as file:
+                baseline = {name: Measurement(**values) for name, values in json.load(file).items()}
+            regressions = [
+                f"{name}: {regression}"
+                for name, result in results.items()
+                if name in baseline
+                for regression in self._find_regressions(result, baseline[name], tolerance=kwargs["tolerance"])
+            ]
+            if regressions:
+                raise CommandError("Performance regressed over the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("Successfully compared against the baseline, no regressions."))
+
+    @staticmethod
+    def _measure(scenario: typing.Callable[[], typing.Any], *, repeat: int) -> Measurement:
+        scenario()  # Warm up (imports, template loading, ...)
+        timings = list()
+        queries = list()
+
+        # CaptureQueriesContext can't be used: every request resets the connection queries log when it starts
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            queries.clear()
+            with connection.execute_wrapper(count_query):
+                started_at = time.perf_counter()
+                scenario()
+                timings.append(time.perf_counter() - started_at)
+
+        # tracemalloc slows everything down, so the memory is measured on a separate run
+        tracemalloc.start()
+        try:
+            scenario()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return Measurement(seconds=statistics.median(timings), queries=len(queries), peak_kib=peak / 1024)
+
+    @staticmethod
+    def _find_regressions(result: Measurement, baseline: Measurement, *, tolerance: float) -> list[str]:
+        regressions = list()
+        if result.seconds > baseline.seconds * (1 + tolerance):
+            regressions.append(f"{result.seconds * 1000:.1f}ms > {baseline.seconds * 1000:.1f}ms")
+        if result.queries > baseline.queries:
+            regressions.append(f"{result.queries} queries > {baseline.queries} queries")
+        if result.peak_kib > baseline.peak_kib * (1 + tolerance):
+            regressions.append(f"{result.peak_kib:.0f}KiB > {baseline.peak_kib:.0f}KiB")
+        return regressions
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max
+
+from expenses.models import Expense, Project
+
+
+class Command(BaseCommand):
+    help = "Finds the expenses stored more than once (same day, amount and source), grouped by their fingerprint"
+
+    def add_arguments(self, parser):
+        # An option, as public ids can start with a dash: --project=<public id>
+        parser.add_argument("--project", required=True, help="Public id of the project")
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Groups of duplicates to print (default: %(default)s)"
+        )
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument("--flag", action="store_true", help="Flag every copy but the first one of each group")
+        action.add_argument("--delete", action="store_true", help="Delete every copy but the first one of each group")
+
+    def handle(self, *args, **kwargs):
+        project = Project.objects.filter(public_id=kwargs["project"]).first()
+        if project is None:
+            raise CommandError(f"The project {kwargs['project']!r} doesn't exist")
+
+        # A single GROUP BY over the (project, fingerprint) index instead of comparing the expenses pairwise
+        groups = list(
+            Expense.objects.filter(project=project)
+            .values("fingerprint")
+            .annotate(count=Count("id"), last_spent_at=Max("spent_at"))
+            .filter(count__gt=1)
+            .order_by("-count", "-last_spent_at")
+        )
+        copies = sum(group["count"] - 1 for group in groups)
+        for group in groups[: kwargs["limit"]]:
+            expense = Expense.objects.filter(project=project, fingerprint=group["fingerprint"]).first()
+            self.stdout.write(
+                f"{group['count']} times: ${expense.amount} at {expense.source} on {expense.spent_at:%Y-%m-%d}"
+            )
+        if len(groups) > kwargs["limit"]:
+            self.stdout.write(f"... and {len(groups) - kwargs['limit']} more groups")
+
+        if kwargs["flag"] or kwargs["delete"]:
+            # The first stored copy of each group is the one kept
+            extra_ids = list()
+            fingerprints = [group["fingerprint"] for group in groups]
+            kept_fingerprints = set()
+            expenses = Expense.objects.filter(project=project, fingerprint__in=fingerprints).order_by(
+                "fingerprint", "updated_at", "id"
+            )
+            for expense_id, fingerprint in expenses.values_list("id", "fingerprint"):
+                if fingerprint in kept_fingerprints:
+                    extra_ids.append(expense_id)
+                kept_fingerprints.add(fingerprint)
+            if kwargs["flag"]:
+                Expense.objects.filter(pk__in=extra_ids).update(possible_duplicate=True)
+            else:
+                # One by one, so the signals move the monthly totals and the merchant stats
+                Expense.objects.filter(pk__in=extra_ids).delete()
+            verb = "flagged" if kwargs["flag"] else "deleted"
+            self.stdout.write(self.style.SUCCESS(f"Successfully {verb} {len(extra_ids)} duplicates."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Found {copies} duplicates in {len(groups)} groups."))
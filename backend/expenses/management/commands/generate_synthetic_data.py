@@ -0,0 +1,106 @@
+import datetime
+import itertools
+import random
+import typing
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from auth.models import User
+from expenses.models import Category, Expense, Project
+
+SOURCES = [
+    "McDonalds",
+    "Mercadona",
+    "Amazon",
+    "Rent",
+    "Payroll",
+    "Netflix",
+    "Spotify",
+    "Shell",
+    "Ikea",
+    "Pharmacy",
+    "Bakery",
+    "Electricity",
+    "Water",
+    "Gym",
+    "Cinema",
+]
+COLORS = ["#247BA0", "#70C1B3", "#50514F", "#F25F5C", "#FFE066"]
+
+
+class Command(BaseCommand):
+    help = "Generates synthetic users, projects, category trees and expenses, e.g. for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1, help="(default: %(default)s)")
+        parser.add_argument("--projects", type=int, default=1, help="Projects per user (default: %(default)s)")
+        parser.add_argument("--depth", type=int, default=3, help="Depth of the category trees (default: %(default)s)")
+        parser.add_argument("--fan-out", type=int, default=3, help="Children per category (default: %(default)s)")
+        parser.add_argument(
+            "--expenses-per-month", type=int, default=100, help="Expenses per project and month (default: %(default)s)"
+        )
+        parser.add_argument("--years", type=int, default=2, help="Years of history (default: %(default)s)")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default: %(default)s)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="(default: %(default)s)")
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs["seed"])
+        now = timezone.now()
+        first_month = now.year * 12 + now.month - 1 - kwargs["years"] * 12 + 1
+
+        for user_number in range(kwargs["users"]):
+            user, created = User.objects.get_or_create(username=f"synthetic-{kwargs['seed']}-{user_number}")
+            if created:
+                user.set_unusable_password()
+                user.save()
+            for project_number in range(kwargs["projects"]):
+                project = Project.objects.create(user=user, name=f"Synthetic project {project_number}")
+                categories = self._create_category_tree(
+                    project, depth=kwargs["depth"], fan_out=kwargs["fan_out"], rng=rng
+                )
+
+                expenses = (
+                    Expense(
+                        category=rng.choice(categories),
+                        spent_at=datetime.datetime(
+                            year=month // 12,
+                            month=month % 12 + 1,
+                            day=rng.randint(1, 28),
+                            hour=rng.randint(0, 23),
+                            minute=rng.randint(0, 59),
+                        ),
+                        amount=round(rng.lognormvariate(3, 1), 2),
+                        source=rng.choice(SOURCES),
+                    )
+                    for month in range(first_month, first_month + kwargs["years"] * 12)
+                    for _ in range(kwargs["expenses_per_month"])
+                )
+                created_expenses = 0
+                while batch := list(itertools.islice(expenses, kwargs["batch_size"])):
+                    Expense.create_in_bulk(batch, project=project)
+                    created_expenses += len(batch)
+
+                self.stdout.write(
+                    f"Created {project.public_id} for {user.username}:"
+                    f" {len(categories)} categories and {created_expenses} expenses."
+                )
+
+        self.stdout.write(self.style.SUCCESS("Successfully generated the synthetic data."))
+
+    @staticmethod
+    def _create_category_tree(project: Project, *, depth: int, fan_out: int, rng: random.Random) -> list[Category]:
+        categories: list[Category] = list()
+        # A Sequence, as the children (never None) become the next parents
+        parents: typing.Sequence[Category | None] = [None]
+        for _ in range(depth):
+            children: list[Category] = list()
+            for parent in parents:
+                for number in range(fan_out):
+                    name = f"{parent.name}.{number}" if parent else f"Category {number}"
+                    category = Category(project=project, name=name, parent=parent, color=rng.choice(COLORS))
+                    category.save()
+                    children.append(category)
+            categories.extend(children)
+            parents = children
+        return categories
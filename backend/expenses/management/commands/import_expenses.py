@@ -0,0 +1,77 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.duplicates import DUPLICATE_MODES
+from expenses.importers import DEFAULT_CSV_COLUMNS, PARSERS, InvalidStatement, import_expenses
+from expenses.models import Category, Project
+
+
+class Command(BaseCommand):
+    help = "Imports the expenses of a bank statement (CSV, OFX or QIF) into a project"
+
+    def add_arguments(self, parser):
+        # An option, as public ids can start with a dash: --project=<public id>
+        parser.add_argument("--project", required=True, help="Public id of the project")
+        parser.add_argument("path", help="Path of the statement file")
+        parser.add_argument("--format", default="csv", choices=sorted(PARSERS), help="(default: %(default)s)")
+        parser.add_argument(
+            "--default-category",
+            help="Public id of the category used when a row has none, or one that doesn't exist in the project",
+        )
+        parser.add_argument("--date-format", help="strptime format of the dates (default: depends on the format)")
+        parser.add_argument("--delimiter", default=",", help="CSV delimiter (default: %(default)s)")
+        for field, column in DEFAULT_CSV_COLUMNS.items():
+            parser.add_argument(
+                f"--{field.replace('_', '-')}-column",
+                default=column,
+                help=f"CSV column holding the expense {field} (default: %(default)s)",
+            )
+        parser.add_argument("--negate-amounts", action="store_true", help="Flip the sign of every amount")
+        parser.add_argument(
+            "--duplicates",
+            default="skip",
+            choices=DUPLICATE_MODES,
+            help="What to do with the rows already stored (default: %(default)s)",
+        )
+        parser.add_argument("--encoding", default="utf-8-sig", help="(default: %(default)s)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="(default: %(default)s)")
+
+    def handle(self, *args, **kwargs):
+        try:
+            project = Project.objects.get(public_id=kwargs["project"])
+        except Project.DoesNotExist as exc:
+            raise CommandError(f"There is no project {kwargs['project']!r}") from exc
+        default_category = None
+        if kwargs["default_category"]:
+            try:
+                default_category = Category.objects.get(project=project, public_id=kwargs["default_category"])
+            except Category.DoesNotExist as exc:
+                raise CommandError(f"There is no category {kwargs['default_category']!r} in {project}") from exc
+
+        parser_kwargs = dict()
+        if kwargs["date_format"]:
+            parser_kwargs["date_format"] = kwargs["date_format"]
+        if kwargs["format"] == "csv":
+            parser_kwargs["delimiter"] = kwargs["delimiter"]
+            parser_kwargs["columns"] = {field: kwargs[f"{field}_column"] for field in DEFAULT_CSV_COLUMNS}
+
+        with open(kwargs["path"], encoding=kwargs["encoding"], newline="") as statement:
+            try:
+                result = import_expenses(
+                    PARSERS[kwargs["format"]](statement, **parser_kwargs),
+                    project=project,
+                    default_category=default_category,
+                    negate_amounts=kwargs["negate_amounts"],
+                    duplicates=kwargs["duplicates"],
+                    batch_size=kwargs["batch_size"],
+                )
+            except (InvalidStatement, csv.Error) as exc:
+                raise CommandError(str(exc)) from exc
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully imported {result.created} expenses in {result.seconds:.2f}s"
+                f" ({result.rows_per_second:.0f} rows/s), {result.duplicates} were already stored."
+            )
+        )
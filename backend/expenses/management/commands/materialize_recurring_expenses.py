@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses import recurring
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the expenses of the recurring expenses up to a horizon. Meant to run from cron: every run only creates"
+        " the occurrences the previous ones didn't, so it can run as often as wanted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--horizon-days",
+            type=int,
+            default=0,
+            help="Days after today to create the occurrences of, 0 for up to the end of today (default: %(default)s)",
+        )
+
+    def handle(self, *args, **kwargs):
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        until = today + datetime.timedelta(days=kwargs["horizon_days"] + 1)
+        created = recurring.materialize(until=until)
+        self.stdout.write(self.style.SUCCESS(f"Successfully created {created} expenses up to {until:%Y-%m-%d}."))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from helpers.querylog import ORDER_BY_COLUMNS, QueryLog
+
+
+class Command(BaseCommand):
+    help = "Prints the query shapes that cost the most, aggregated by the query log (see QUERY_LOG_PATH)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", help="Path of the query log (default: settings.QUERY_LOG_PATH)")
+        parser.add_argument("--limit", type=int, default=10, help="Amount of query shapes (default: %(default)s)")
+        parser.add_argument(
+            "--order-by",
+            choices=[column.removesuffix("_ms") for column in ORDER_BY_COLUMNS],
+            default="total",
+            help="Stat to rank the query shapes by (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--samples", type=int, default=3, help="Slowest executions to show of each one (default: %(default)s)"
+        )
+        parser.add_argument("--reset", action="store_true", help="Delete every stat once printed")
+
+    def handle(self, *args, **kwargs):
+        path = kwargs["path"] or settings.QUERY_LOG_PATH
+        if not path:
+            raise CommandError("The query log is disabled. Set QUERY_LOG_PATH or pass --path.")
+        query_log = QueryLog(path, slow_threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS)
+
+        order_by = next(column for column in ORDER_BY_COLUMNS if column.removesuffix("_ms") == kwargs["order_by"])
+        top = query_log.get_top(order_by=order_by, limit=kwargs["limit"])
+        if not top:
+            self.stdout.write("No queries have been logged yet.")
+        for rank, (fingerprint, stats) in enumerate(top, start=1):
+            self.stdout.write(
+                f"#{rank} [{fingerprint}] {stats.count} queries, {stats.total_ms:.1f}ms in total,"
+                f" {stats.mean_ms:.1f}ms on average, p95 {stats.get_percentile_ms(95):.1f}ms, max {stats.max_ms:.1f}ms"
+            )
+            self.stdout.write(f"    {stats.sql}")
+            for slow_query in query_log.get_slowest(fingerprint, limit=kwargs["samples"]):
+                self.stdout.write(
+                    f"    {slow_query.duration_ms:9.1f}ms {slow_query.recorded_at:%Y-%m-%d %H:%M}"
+                    f" {slow_query.view} at {slow_query.location}"
+                )
+
+        if kwargs["reset"]:
+            query_log.reset()
+            self.stdout.write(self.style.SUCCESS("Successfully reset the query log."))
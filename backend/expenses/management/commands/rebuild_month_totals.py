@@ -0,0 +1,53 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from expenses.models import CategoryMonthTotal
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the monthly totals of every category from scratch and verifies them against the expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the stored monthly totals, without rebuilding them",
+        )
+
+    def handle(self, *args, **kwargs):
+        if not kwargs["check"]:
+            with transaction.atomic():
+                CategoryMonthTotal.objects.all().delete()
+                CategoryMonthTotal.objects.bulk_create(
+                    (
+                        CategoryMonthTotal(category_id=category_id, month=month, total=total, count=count)
+                        for (category_id, month), (total, count) in CategoryMonthTotal.compute_from_expenses().items()
+                    ),
+                    batch_size=1000,
+                )
+            self.stdout.write("Rebuilt the monthly totals.")
+
+        expected = CategoryMonthTotal.compute_from_expenses()
+        stored = {
+            (category_id, month): (total, count)
+            for category_id, month, total, count in CategoryMonthTotal.objects.exclude(count=0).values_list(
+                "category_id", "month", "total", "count"
+            )
+        }
+        mismatches = 0
+        for key in expected.keys() | stored.keys():
+            expected_total, expected_count = expected.get(key, (0.0, 0))
+            stored_total, stored_count = stored.get(key, (0.0, 0))
+            if expected_count != stored_count or not math.isclose(expected_total, stored_total, abs_tol=1e-6):
+                mismatches += 1
+                category_id, month = key
+                self.stderr.write(
+                    f"Category {category_id} on {month:%b %Y}: expected ${expected_total} of {expected_count} expenses,"
+                    f" found ${stored_total} of {stored_count}"
+                )
+        if mismatches:
+            raise CommandError(f"{mismatches} monthly totals don't match the expenses")
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully verified {len(expected)} monthly totals."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from expenses import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the SQLite full-text index of the expenses, needed after a VACUUM (Postgres keeps its own in sync)"
+
+    def handle(self, *args, **kwargs):
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Successfully rebuilt the search index."))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.categorization import Classifier
+from expenses.models import Category, Expense, Project
+
+
+class Command(BaseCommand):
+    help = "Files the existing expenses of a project under the category of the first categorization rule they match"
+
+    def add_arguments(self, parser):
+        # An option, as public ids can start with a dash: --project=<public id>
+        parser.add_argument("--project", required=True, help="Public id of the project")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Expenses updated at once (default: %(default)s)"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only count the expenses that would change")
+
+    def handle(self, *args, **kwargs):
+        project = Project.objects.filter(public_id=kwargs["project"]).first()
+        if project is None:
+            raise CommandError(f"The project {kwargs['project']!r} doesn't exist")
+        classifier = Classifier.for_project(project)
+        if not classifier:
+            raise CommandError(f"{project} has no categorization rules")
+        categories_by_id = {category.id: category for category in Category.objects.filter(project=project)}
+
+        expenses = Expense.objects.filter(project=project).order_by("id")
+        checked = changed = 0
+        # Pages by id rather than one long cursor, as the expenses are updated along the way
+        last_id = None
+        while batch := list((expenses.filter(id__gt=last_id) if last_id else expenses)[: kwargs["batch_size"]]):
+            last_id = batch[-1].id
+            checked += len(batch)
+            changed_expenses = [
+                expense
+                for expense in batch
+                if self._recategorize(expense, classifier=classifier, categories_by_id=categories_by_id)
+            ]
+            if changed_expenses and not kwargs["dry_run"]:
+                Expense.update_in_bulk(changed_expenses, fields=["category"], project=project)
+            changed += len(changed_expenses)
+            self.stdout.write(f"Checked {checked} expenses, {changed} recategorized so far...")
+
+        verb = "Would recategorize" if kwargs["dry_run"] else "Successfully recategorized"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {changed} of {checked} expenses."))
+
+    @staticmethod
+    def _recategorize(expense: Expense, *, classifier: Classifier, categories_by_id: dict) -> bool:
+        category = categories_by_id.get(
+            classifier.classify(source=expense.source, amount=expense.amount, notes=expense.notes)
+        )
+        if category is None or category.id == expense.category_id:
+            return False
+        expense.category = category
+        return True
@@ -0,0 +1,84 @@
+import bisect
+import collections
+import datetime
+import heapq
+import threading
+import typing
+import uuid
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.utils import timezone
+
+from expenses.models import MerchantStat, Project
+from helpers import metrics
+
+# A merchant used 10 times 3 months ago ranks like one used 5 times today
+HALF_LIFE_DAYS = 90
+
+
+@dataclass(frozen=True)
+class Merchant:
+    source: str
+    count: int
+    last_spent_at: typing.Optional[datetime.datetime]
+    category_id: typing.Optional[uuid.UUID]
+
+    def get_score(self, now: datetime.datetime) -> float:
+        if self.last_spent_at is None:
+            return self.count
+        age_days = max((now - self.last_spent_at).total_seconds() / 86400, 0.0)
+        return self.count * 0.5 ** (age_days / HALF_LIFE_DAYS)
+
+
+class MerchantIndex:
+    """The merchants of a project sorted by their normalized source, so the ones with a prefix are a bisected range"""
+
+    def __init__(self, *, project: Project):
+        self.data_version = project.data_version
+        stats = sorted(
+            MerchantStat.objects.filter(project=project, count__gt=0).values_list(
+                "normalized_source", "source", "count", "last_spent_at", "category_id"
+            )
+        )
+        self.keys = [normalized_source for normalized_source, *_ in stats]
+        self.merchants = [
+            Merchant(source=source, count=count, last_spent_at=last_spent_at, category_id=category_id)
+            for _, source, count, last_spent_at, category_id in stats
+        ]
+
+    def search(self, prefix: str, *, limit: int) -> list[Merchant]:
+        prefix = MerchantStat.normalize_source(prefix)
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + chr(0x10FFFF), lo=start)
+        now = timezone.now()
+        return heapq.nlargest(limit, self.merchants[start:end], key=lambda merchant: merchant.get_score(now))
+
+
+class MerchantIndexCache:
+    """The merchant indexes of the `max_size` most recently used projects, rebuilt when their data version changes"""
+
+    def __init__(self, *, max_size: int):
+        self.max_size = max_size
+        self._indexes: collections.OrderedDict[uuid.UUID, MerchantIndex] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project: Project) -> MerchantIndex:
+        with self._lock:
+            index = self._indexes.pop(project.id, None)
+        is_hit = index is not None and index.data_version == project.data_version
+        metrics.CACHE_REQUESTS.inc(cache="merchants", result="hit" if is_hit else "miss")
+        if index is None or not is_hit:
+            index = MerchantIndex(project=project)
+        with self._lock:
+            self._indexes[project.id] = index
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+merchant_indexes = MerchantIndexCache(max_size=settings.MERCHANT_INDEX_CACHE_SIZE)
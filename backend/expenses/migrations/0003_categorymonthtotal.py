@@ -0,0 +1,54 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_month_totals(apps, schema_editor):
+    Expense = apps.get_model("expenses", "Expense")
+    CategoryMonthTotal = apps.get_model("expenses", "CategoryMonthTotal")
+    cells = (
+        Expense.objects.annotate(month=TruncMonth("spent_at"))
+        .values("category_id", "month")
+        .annotate(total=Sum("amount"), count=Count("id"))
+        .values_list("category_id", "month", "total", "count")
+    )
+    CategoryMonthTotal.objects.bulk_create(
+        (
+            CategoryMonthTotal(category_id=category_id, month=month.date(), total=total, count=count)
+            for category_id, month, total, count in cells
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0002_category_notes_alter_expense_notes_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CategoryMonthTotal",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("month", models.DateField()),
+                ("total", models.FloatField(default=0.0)),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="month_totals", to="expenses.category"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="categorymonthtotal",
+            constraint=models.UniqueConstraint(fields=("category", "month"), name="unique_category_month"),
+        ),
+        migrations.RunPython(populate_month_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model("expenses", "Category")
+    categories = {category.id: category for category in Category.objects.all()}
+
+    def get_path(category, visited):
+        if category.path:
+            return category.path
+        parent = categories.get(category.parent_id)
+        if parent is None or parent.id in visited:
+            # Roots, and also a way out of any pre-existing cycle
+            category.path = f"{category.public_id}/"
+        else:
+            category.path = f"{get_path(parent, visited | {category.id})}{category.public_id}/"
+        return category.path
+
+    for category in categories.values():
+        get_path(category, {category.id})
+    Category.objects.bulk_update(categories.values(), ["path"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0003_categorymonthtotal"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=1000),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
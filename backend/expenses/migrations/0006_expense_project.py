@@ -0,0 +1,65 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_expense_projects(apps, schema_editor):
+    Category = apps.get_model("expenses", "Category")
+    Expense = apps.get_model("expenses", "Expense")
+    Expense.objects.update(
+        project_id=Subquery(Category.objects.filter(pk=OuterRef("category_id")).values("project_id")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0005_project_data_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="project",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="expenses",
+                to="expenses.project",
+            ),
+        ),
+        migrations.RunPython(populate_expense_projects, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="expense",
+            name="project",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="expenses",
+                to="expenses.project",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="expense",
+            name="category",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="expenses",
+                to="expenses.category",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(fields=["project", "spent_at", "category", "amount"], name="expense_project_spent_at"),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(fields=["category", "spent_at"], name="expense_category_spent_at"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0006_expense_project"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="category_version",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
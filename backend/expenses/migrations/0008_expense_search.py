@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# Must match the expression queried by expenses.search, or Postgres won't use the index
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, source), 'A')"
+    " || setweight(to_tsvector('simple'::regconfig, notes), 'B')"
+)
+SQLITE_COLUMNS = "project_id, source, notes"
+SQLITE_OLD_VALUES = "old.rowid, old.project_id, old.source, old.notes"
+SQLITE_NEW_VALUES = "new.rowid, new.project_id, new.source, new.notes"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        # Concurrently, so creating it doesn't block the writes to a big table
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS expense_search ON expenses_expense USING GIN (({POSTGRES_VECTOR}))"
+        )
+    elif schema_editor.connection.vendor == "sqlite" and _has_fts5(schema_editor):
+        # An external content table: it only stores the index, and reads the expenses table when rebuilt
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE expenses_expense_fts USING fts5({SQLITE_COLUMNS}, content='expenses_expense',"
+            " prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        )
+        delete_old = (
+            f"INSERT INTO expenses_expense_fts(expenses_expense_fts, rowid, {SQLITE_COLUMNS})"
+            f" VALUES ('delete', {SQLITE_OLD_VALUES});"
+        )
+        insert_new = f"INSERT INTO expenses_expense_fts(rowid, {SQLITE_COLUMNS}) VALUES ({SQLITE_NEW_VALUES});"
+        schema_editor.execute(
+            f"CREATE TRIGGER expenses_expense_fts_insert AFTER INSERT ON expenses_expense BEGIN {insert_new} END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER expenses_expense_fts_delete AFTER DELETE ON expenses_expense BEGIN {delete_old} END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER expenses_expense_fts_update AFTER UPDATE OF {SQLITE_COLUMNS} ON expenses_expense"
+            f" BEGIN {delete_old} {insert_new} END"
+        )
+        schema_editor.execute("INSERT INTO expenses_expense_fts(expenses_expense_fts) VALUES ('rebuild')")
+
+
+def delete_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS expense_search")
+    elif schema_editor.connection.vendor == "sqlite":
+        for action in ["insert", "delete", "update"]:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS expenses_expense_fts_{action}")
+        schema_editor.execute("DROP TABLE IF EXISTS expenses_expense_fts")
+
+
+def _has_fts5(schema_editor) -> bool:
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return ("ENABLE_FTS5",) in cursor.fetchall()
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("expenses", "0007_project_category_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, delete_search_index),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.0.4 on 2026-10-18 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_merchant_stats(apps, schema_editor):
+    Expense = apps.get_model("expenses", "Expense")
+    MerchantStat = apps.get_model("expenses", "MerchantStat")
+    stats: dict[tuple, dict] = dict()
+    # Oldest first, so the last expense of each merchant is the one that stays
+    expenses = Expense.objects.order_by("spent_at").values_list("project_id", "source", "spent_at", "category_id")
+    for project_id, source, spent_at, category_id in expenses.iterator(chunk_size=10000):
+        key = (project_id, " ".join(source.casefold().split()))
+        count = stats[key]["count"] if key in stats else 0
+        stats[key] = dict(source=source, count=count + 1, last_spent_at=spent_at, category_id=category_id)
+    MerchantStat.objects.bulk_create(
+        (
+            MerchantStat(project_id=project_id, normalized_source=normalized_source, **values)
+            for (project_id, normalized_source), values in stats.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0008_expense_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MerchantStat",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("normalized_source", models.CharField(max_length=200)),
+                ("source", models.CharField(max_length=200)),
+                ("count", models.IntegerField(default=0)),
+                ("last_spent_at", models.DateTimeField(null=True)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="expenses.category",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="merchant_stats",
+                        to="expenses.project",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="merchantstat",
+            constraint=models.UniqueConstraint(fields=("project", "normalized_source"), name="unique_project_merchant"),
+        ),
+        migrations.RunPython(populate_merchant_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.0.4 on 2026-10-18 23:40
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import helpers.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0009_merchantstat"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CategorizationRule",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                (
+                    "public_id",
+                    models.CharField(
+                        default=helpers.models.generate_unsecure_public_id, editable=False, max_length=50, unique=True
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now=True)),
+                ("updated_at", models.DateTimeField(auto_now_add=True)),
+                ("order", models.IntegerField(default=helpers.models.generate_order)),
+                ("source_contains", models.CharField(blank=True, max_length=200)),
+                ("source_regex", models.CharField(blank=True, max_length=200)),
+                ("notes_keywords", models.CharField(blank=True, max_length=1000)),
+                ("amount_min", models.FloatField(blank=True, null=True)),
+                ("amount_max", models.FloatField(blank=True, null=True)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="categorization_rules",
+                        to="expenses.category",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="categorization_rules",
+                        to="expenses.project",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
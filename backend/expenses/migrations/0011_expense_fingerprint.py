@@ -0,0 +1,45 @@
+# Generated by Django 4.0.4 on 2026-10-19 00:20
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def populate_fingerprints(apps, schema_editor):
+    # The same as Expense.compute_fingerprint
+    Expense = apps.get_model("expenses", "Expense")
+    expenses = Expense.objects.only("id", "spent_at", "amount", "source").order_by("id")
+    last_id = None
+    # Pages by id rather than one long cursor, as the expenses are updated along the way
+    while batch := list((expenses.filter(id__gt=last_id) if last_id else expenses)[:1000]):
+        last_id = batch[-1].id
+        for expense in batch:
+            source = " ".join(expense.source.casefold().split())
+            key = f"{expense.spent_at.date().isoformat()}|{round(expense.amount, 2) + 0.0:.2f}|{source}"
+            expense.fingerprint = hashlib.sha1(key.encode()).hexdigest()
+        Expense.objects.bulk_update(batch, ["fingerprint"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0010_categorizationrule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="fingerprint",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="possible_duplicate",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(populate_fingerprints, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(fields=["project", "fingerprint"], name="expense_project_fingerprint"),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.0.4 on 2026-10-19 01:10
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import helpers.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0011_expense_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecurringExpense",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                (
+                    "public_id",
+                    models.CharField(
+                        default=helpers.models.generate_unsecure_public_id, editable=False, max_length=50, unique=True
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now=True)),
+                ("updated_at", models.DateTimeField(auto_now_add=True)),
+                ("amount", models.FloatField()),
+                ("source", models.CharField(max_length=200)),
+                ("notes", models.CharField(blank=True, max_length=1000)),
+                (
+                    "frequency",
+                    models.CharField(
+                        choices=[
+                            ("daily", "Daily"),
+                            ("weekly", "Weekly"),
+                            ("monthly", "Monthly"),
+                            ("yearly", "Yearly"),
+                        ],
+                        default="monthly",
+                        max_length=10,
+                    ),
+                ),
+                ("interval", models.PositiveIntegerField(default=1)),
+                ("starts_at", models.DateTimeField()),
+                ("ends_at", models.DateTimeField(blank=True, null=True)),
+                ("materialized_until", models.DateTimeField(blank=True, editable=False, null=True)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recurring_expenses",
+                        to="expenses.category",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recurring_expenses",
+                        to="expenses.project",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="recurring_expense",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="expenses",
+                to="expenses.recurringexpense",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="expense",
+            constraint=models.UniqueConstraint(
+                fields=("recurring_expense", "spent_at"), name="unique_recurring_occurrence"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-19 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0012_recurringexpense"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="monthly_budget",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
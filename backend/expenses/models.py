@@ -1,11 +1,22 @@
+import calendar
+import datetime
+import hashlib
 import itertools
 import logging
+import re
 import typing
+import uuid
+from collections import defaultdict
 
 from colorfield.fields import ColorField
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, QuerySet, Sum, Value, When
+from django.db.models.functions import Concat, Substr, TruncMonth
+from django.utils import timezone
 
 from auth.models import User
+from expenses.periods import MONTHLY, Granularity
 from helpers.models import BaseModel, generate_order
 
 logger = logging.getLogger(__name__)
@@ -16,10 +27,24 @@ class Project(BaseModel):
     name = models.CharField(max_length=200)
     order = models.IntegerField(default=generate_order)
     notes = models.CharField(max_length=1000, blank=True)
+    # Bumped on every write to the expenses or categories of the project, so it can key cached computations
+    data_version = models.IntegerField(default=0, editable=False)
+    # Bumped (along with the data version) on every write to the categories only, e.g. to cache the dashboard headers
+    category_version = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"Project {self.name}"
 
+    @staticmethod
+    def bump_data_version(**filter_):
+        Project.objects.filter(**filter_).update(data_version=F("data_version") + 1)
+
+    @staticmethod
+    def bump_category_version(**filter_):
+        Project.objects.filter(**filter_).update(
+            data_version=F("data_version") + 1, category_version=F("category_version") + 1
+        )
+
 
 class Category(BaseModel):
     project = models.ForeignKey(Project, related_name="categories", on_delete=models.CASCADE)
@@ -28,6 +53,9 @@ class Category(BaseModel):
     color = ColorField(default="#FF0000")
     notes = models.CharField(max_length=1000, blank=True)
     parent = models.ForeignKey("self", related_name="children", null=True, blank=True, on_delete=models.SET_NULL)
+    path = models.CharField(max_length=1000, db_index=True, editable=False)
+    # Covers the expenses of the whole subtree. Parents without one get the sum of the budgets of their children
+    monthly_budget = models.FloatField(null=True, blank=True)
 
     class Meta:
         verbose_name_plural = "categories"
@@ -38,68 +66,525 @@ class Category(BaseModel):
         else:
             return f"Category {self.name}"
 
+    def clean(self):
+        if self.parent_id and self.path:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list("path", flat=True).first() or ""
+            if parent_path.startswith(self.path):
+                raise ValidationError(dict(parent="A category can't be nested under itself or its descendants."))
+
+    def save(self, *args, **kwargs):
+        # `path` is the chain of public ids from the root down to this category, e.g. "<root>/<child>/<self>/"
+        # That turns "every descendant" into a single prefix query
+        with transaction.atomic():
+            parent_path = ""
+            if self.parent_id:
+                parent_path = Category.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+            stored_path = self.path
+            if stored_path and parent_path.startswith(stored_path):
+                raise ValueError(f"{self} can't be nested under itself or its descendants")
+
+            self.path = f"{parent_path}{self.public_id}/"
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if not adding:
+                self.expenses.exclude(project_id=self.project_id).update(project_id=self.project_id)
+            if stored_path and stored_path != self.path:
+                Category.objects.filter(path__startswith=stored_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr("path", len(stored_path) + 1))
+                )
+
     def build_levels(
-        self: typing.Optional["Category"], iteration=0, project=None
+        self: typing.Optional["Category"], *, children_by_parent: dict[typing.Optional[uuid.UUID], list["Category"]]
     ) -> list[list[tuple["Category", bool]]]:
-        if iteration > 50:
-            raise Exception(
-                f"We hit 50 iterations on the recursive levels call. There might be something wrong with {self}"
-            )
-
-        if self is None:
-            children = Category.objects.filter(parent=None, project=project).all()
-            levels = list()
-        else:
-            children = self.children.all()
-            levels = [[(self, bool(children))]]
-
-        children_levels = [child.build_levels(iteration=iteration + 1) for child in children]
-        if children_levels:
-            for list_of_each_level in itertools.zip_longest(*children_levels):
-                # zip_longest adds None if one of the children levels was shorter
-                list_of_each_level = [i for i in list_of_each_level if i is not None]
-                levels.append(list(itertools.chain(*list_of_each_level)))
+        # Each level holds the categories of one depth, in the same order as a depth-first walk of the tree
+        levels: list[list[tuple[Category, bool]]] = list()
+        roots = [self] if self else children_by_parent.get(None, [])
+        pending = [(root, 0) for root in reversed(roots)]
+        while pending:
+            category, depth = pending.pop()
+            children = children_by_parent.get(category.id, [])
+            if depth == len(levels):
+                levels.append(list())
+            levels[depth].append((category, bool(children)))
+            pending.extend((child, depth + 1) for child in reversed(children))
         return levels
 
-    def build_values(
-        self: typing.Optional["Category"], iteration=0, filter_=None, project=None
-    ) -> list[tuple[float, bool, typing.Optional["Category"]]]:
-        if filter_ is None:
-            filter_ = dict()
-        if iteration > 50:
-            raise Exception(
-                f"We hit 50 iterations on the recursive levels call. There might be something wrong with {self}"
-            )
+    @staticmethod
+    def build_tree(*, project: Project) -> dict[typing.Optional[uuid.UUID], list["Category"]]:
+        # All the categories of the project in a single query, grouped by their parent id (None for the roots)
+        children_by_parent: dict[typing.Optional[uuid.UUID], list[Category]] = defaultdict(list)
+        # Ordered, as the header rows and the value rows of the dashboard are cached apart and must line up
+        categories = list(Category.objects.filter(project=project).order_by("order", "name", "id"))
+        categories_by_id = {category.id: category for category in categories}
+        for category in categories:
+            # Avoid one extra query per category when following their project or parent
+            category.project = project
+            if category.parent_id in categories_by_id:
+                category.parent = categories_by_id[category.parent_id]
+            children_by_parent[category.parent_id].append(category)
+        return children_by_parent
 
-        if self is None:
-            children = Category.objects.filter(parent=None, project=project).all()
-            other = 0.0
-        else:
-            children = self.children.all()
-            other = sum(expense.amount for expense in self.expenses.filter(**filter_).all())
+    @staticmethod
+    def build_values_per_period(
+        *,
+        project: Project,
+        periods: list[tuple[datetime.datetime, datetime.datetime]],
+        granularity: Granularity = MONTHLY,
+        extra_amounts: typing.Optional[list[dict[uuid.UUID, float]]] = None,
+    ) -> list[list[tuple[float, bool, typing.Optional["Category"]]]]:
+        # extra_amounts are added to the stored ones of each period and category, e.g. the projected recurring expenses
+        children_by_parent = Category.build_tree(project=project)
+        amounts_per_period: list[dict[uuid.UUID, float]] = [dict() for _ in periods]
+        if periods:
+            # A single query grouped by period and category. Periods of whole months add up the monthly totals, weeks
+            # need the expenses themselves (the covering index of the project expenses serves them)
+            cells: QuerySet
+            if granularity.name == "week":
+                cells = (
+                    Expense.objects.filter(project=project, spent_at__gte=periods[0][0], spent_at__lt=periods[-1][1])
+                    .annotate(period=granularity.get_bucket_expression("spent_at"))
+                    .values("period", "category_id")
+                    .annotate(period_total=Sum("amount"))
+                )
+            else:
+                cells = (
+                    CategoryMonthTotal.objects.filter(
+                        category__project=project, month__gte=periods[0][0].date(), month__lt=periods[-1][1].date()
+                    )
+                    .annotate(period=granularity.get_bucket_expression("month"))
+                    .values("period", "category_id")
+                    .annotate(period_total=Sum("total"))
+                )
+            is_date = granularity.name != "week"
+            period_indexes = {
+                granularity.get_bucket_key(period_start, is_date=is_date): a
+                for a, (period_start, _) in enumerate(periods)
+            }
+            for period, category_id, total in cells.order_by().values_list("period", "category_id", "period_total"):
+                amounts_per_period[period_indexes[period]][category_id] = total
+        for amounts, extra in zip(amounts_per_period, extra_amounts or []):
+            for category_id, amount in extra.items():
+                amounts[category_id] = amounts.get(category_id, 0.0) + amount
+
+        return [
+            Category._roll_up_values(None, children_by_parent=children_by_parent, amounts=amounts)
+            for amounts in amounts_per_period
+        ]
 
+    @staticmethod
+    def _roll_up_values(
+        category: typing.Optional["Category"],
+        *,
+        children_by_parent: dict[typing.Optional[uuid.UUID], list["Category"]],
+        amounts: dict[uuid.UUID, float],
+    ) -> list[tuple[float, bool, typing.Optional["Category"]]]:
+        children = children_by_parent.get(category.id if category else None, [])
+        other = amounts.get(category.id, 0.0) if category else 0.0
         if not children:
-            return [(other, False, self)]
+            return [(other, False, category)]
 
         children_values = list(
-            itertools.chain(*[child.build_values(iteration=iteration + 1, filter_=filter_) for child in children])
+            itertools.chain(
+                *[
+                    Category._roll_up_values(child, children_by_parent=children_by_parent, amounts=amounts)
+                    for child in children
+                ]
+            )
         )
-        if self is None:
+        if category is None:
             return children_values
         return [
-            (other + sum(value for value, is_total, _ in children_values if not is_total), True, self),
+            (other + sum(value for value, is_total, _ in children_values if not is_total), True, category),
             *children_values,
-            (other, False, self),
+            (other, False, category),
         ]
 
 
 class Expense(BaseModel):
-    category = models.ForeignKey(Category, related_name="expenses", on_delete=models.CASCADE)
+    # Denormalized from the category, so that the hot queries of a project don't need to join the categories
+    project = models.ForeignKey(
+        Project, related_name="expenses", on_delete=models.CASCADE, editable=False, db_index=False
+    )
+    category = models.ForeignKey(Category, related_name="expenses", on_delete=models.CASCADE, db_index=False)
     spent_at = models.DateTimeField()
     amount = models.FloatField()
     source = models.CharField(max_length=200)
     notes = models.CharField(max_length=1000, blank=True)
     parent = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL)
+    # The same day, amount and normalized source, which is how the duplicates of overlapping statements look alike
+    fingerprint = models.CharField(max_length=40, blank=True, editable=False)
+    possible_duplicate = models.BooleanField(default=False)
+    # The schedule that generated it, see RecurringExpense
+    recurring_expense = models.ForeignKey(
+        "RecurringExpense", related_name="expenses", null=True, blank=True, editable=False, on_delete=models.SET_NULL
+    )
+    # What the database held before the save in progress, set by the pre_save signal (see expenses.signals)
+    _previous_values: typing.Optional[dict[str, typing.Any]]
+
+    class Meta:
+        constraints = [
+            # One expense per occurrence of a schedule, however many times it's materialized
+            models.UniqueConstraint(fields=["recurring_expense", "spent_at"], name="unique_recurring_occurrence")
+        ]
+        indexes = [
+            # Leading with (project, spent_at) serves every ranged read of a project, and carrying the category and the
+            # amount lets the aggregations run on the index alone
+            models.Index(fields=["project", "spent_at", "category", "amount"], name="expense_project_spent_at"),
+            models.Index(fields=["category", "spent_at"], name="expense_category_spent_at"),
+            models.Index(fields=["project", "fingerprint"], name="expense_project_fingerprint"),
+        ]
 
     def __str__(self):
         return f"Expense ${self.amount} at {self.source} on {self.spent_at} ({self.category})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_stored_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The signals that keep the monthly totals up to date must share the transaction with the write itself
+        self.project_id = self.category.project_id
+        self.update_fingerprint()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @staticmethod
+    def compute_fingerprint(*, spent_at: datetime.datetime, amount: float, source: str) -> str:
+        # Adding 0.0 turns -0.0 into 0.0
+        key = f"{spent_at.date().isoformat()}|{round(amount, 2) + 0.0:.2f}|{MerchantStat.normalize_source(source)}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def update_fingerprint(self):
+        self.fingerprint = Expense.compute_fingerprint(spent_at=self.spent_at, amount=self.amount, source=self.source)
+
+    def remember_stored_values(self):
+        self._stored_values = {field: getattr(self, field) for field in STORED_FIELDS if field in self.__dict__}
+
+    def get_stored_values(self) -> typing.Optional[dict[str, typing.Any]]:
+        # What the database holds for this expense (None if it has never been saved)
+        if self._state.adding:
+            return None
+        stored_values = getattr(self, "_stored_values", dict())
+        if all(field in stored_values for field in STORED_FIELDS):
+            return stored_values
+        return Expense.objects.filter(pk=self.pk).values(*STORED_FIELDS).first()
+
+    @staticmethod
+    def create_in_bulk(expenses: list["Expense"], *, project: Project, batch_size: int = 1000):
+        # bulk_create skips the signals, so the monthly totals and the data version are updated here
+        for expense in expenses:
+            expense.project_id = expense.category.project_id
+            expense.update_fingerprint()
+        with transaction.atomic():
+            Expense.objects.bulk_create(expenses, batch_size=batch_size)
+            stored_values = [{field: getattr(expense, field) for field in STORED_FIELDS} for expense in expenses]
+            CategoryMonthTotal.add_expenses(stored_values)
+            MerchantStat.add_expenses(stored_values, project_id=project.pk)
+            Project.bump_data_version(pk=project.pk)
+        for expense in expenses:
+            expense.remember_stored_values()
+
+    @staticmethod
+    def update_in_bulk(expenses: list["Expense"], *, fields: list[str], project: Project, batch_size: int = 1000):
+        # Same as create_in_bulk, for bulk_update
+        if len({expense.pk for expense in expenses}) < len(expenses):
+            # Its stored values would be taken out of the monthly totals (and merchant stats) once per copy
+            raise ValueError("An expense can't be updated more than once in the same bulk update")
+        with transaction.atomic():
+            previous_values = [expense.get_stored_values() for expense in expenses]
+            now = timezone.now()
+            for expense in expenses:
+                expense.project_id = expense.category.project_id
+                # created_at is auto_now (the time of the last write), which bulk_update doesn't refresh on its own
+                expense.created_at = now
+                expense.update_fingerprint()
+            Expense.objects.bulk_update(
+                expenses, [*fields, "project", "created_at", "fingerprint"], batch_size=batch_size
+            )
+            stored_values = [{field: getattr(expense, field) for field in STORED_FIELDS} for expense in expenses]
+            removed_expenses = [values for values in previous_values if values]
+            CategoryMonthTotal.add_expenses(stored_values, removed_expenses=removed_expenses)
+            MerchantStat.add_expenses(stored_values, removed_expenses=removed_expenses, project_id=project.pk)
+            Project.bump_data_version(pk=project.pk)
+        for expense in expenses:
+            expense.remember_stored_values()
+
+    @staticmethod
+    def delete_in_bulk(expenses: QuerySet, *, project: Project) -> int:
+        # Same as create_in_bulk, for deletes: QuerySet.delete() sends post_delete (and its queries) once per expense
+        with transaction.atomic():
+            removed_expenses = list(expenses.values(*STORED_FIELDS))
+            # The raw delete skips on_delete too, so the children are detached here like SET_NULL would
+            Expense.objects.filter(parent__in=expenses).update(parent=None)
+            deleted = expenses._raw_delete(expenses.db)
+            CategoryMonthTotal.add_expenses(removed_expenses=removed_expenses)
+            MerchantStat.add_expenses(removed_expenses=removed_expenses, project_id=project.pk)
+            Project.bump_data_version(pk=project.pk)
+        return deleted
+
+
+# Fields whose stored value must be known to move the monthly totals (and merchant stats) around when an expense is
+# updated
+STORED_FIELDS = ("category_id", "spent_at", "amount", "source")
+
+
+class CategoryMonthTotal(models.Model):
+    category = models.ForeignKey(Category, related_name="month_totals", on_delete=models.CASCADE)
+    month = models.DateField()
+    total = models.FloatField(default=0.0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["category", "month"], name="unique_category_month")]
+
+    def __str__(self):
+        return f"Total ${self.total} of {self.count} expenses on {self.month:%b %Y} ({self.category})"
+
+    @staticmethod
+    def get_month(spent_at: datetime.datetime) -> datetime.date:
+        return spent_at.date().replace(day=1)
+
+    @staticmethod
+    def add_expenses(
+        expenses: typing.Iterable[dict[str, typing.Any]] = (),
+        *,
+        removed_expenses: typing.Iterable[dict[str, typing.Any]] = (),
+    ):
+        # Each expense is a dict with the STORED_FIELDS
+        deltas: dict[tuple[uuid.UUID, datetime.date], tuple[float, int]] = defaultdict(lambda: (0.0, 0))
+        for sign, expenses_ in [(1, expenses), (-1, removed_expenses)]:
+            for expense in expenses_:
+                key = (expense["category_id"], CategoryMonthTotal.get_month(expense["spent_at"]))
+                total, count = deltas[key]
+                deltas[key] = (total + sign * expense["amount"], count + sign)
+        CategoryMonthTotal.apply_deltas(deltas)
+
+    @staticmethod
+    def apply_deltas(deltas: dict[tuple[uuid.UUID, datetime.date], tuple[float, int]]):
+        # The missing rows are created in a single query. Removals never create rows: they could belong to a category
+        # that is being deleted
+        CategoryMonthTotal.objects.bulk_create(
+            [
+                CategoryMonthTotal(category_id=category_id, month=month)
+                for (category_id, month), (_, count) in deltas.items()
+                if count > 0
+            ],
+            ignore_conflicts=True,
+        )
+        for (category_id, month), (total, count) in deltas.items():
+            if total == 0 and count == 0:
+                continue
+            CategoryMonthTotal.objects.filter(category_id=category_id, month=month).update(
+                total=F("total") + total, count=F("count") + count
+            )
+
+    @staticmethod
+    def compute_from_expenses() -> dict[tuple[uuid.UUID, datetime.date], tuple[float, int]]:
+        cells = (
+            Expense.objects.annotate(month=TruncMonth("spent_at"))
+            .values("category_id", "month")
+            .annotate(total=Sum("amount"), count=Count("id"))
+            .values_list("category_id", "month", "total", "count")
+        )
+        return {(category_id, month.date()): (total, count) for category_id, month, total, count in cells}
+
+
+class MerchantStat(models.Model):
+    """
+    How often each source (merchant) of a project is used, to suggest it while typing. Sources are grouped by their
+    normalized form, and remember how they were last written and the category they were last filed under
+    """
+
+    project = models.ForeignKey(Project, related_name="merchant_stats", on_delete=models.CASCADE)
+    normalized_source = models.CharField(max_length=200)
+    source = models.CharField(max_length=200)
+    count = models.IntegerField(default=0)
+    last_spent_at = models.DateTimeField(null=True)
+    category = models.ForeignKey(Category, related_name="+", null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["project", "normalized_source"], name="unique_project_merchant")]
+
+    def __str__(self):
+        return f"Merchant {self.source} used {self.count} times ({self.project})"
+
+    @staticmethod
+    def normalize_source(source: str) -> str:
+        # e.g. "  McDonalds  Downtown" and "mcdonalds downtown" are the same merchant
+        return " ".join(source.casefold().split())
+
+    @staticmethod
+    def add_expenses(
+        expenses: typing.Iterable[dict[str, typing.Any]] = (),
+        *,
+        removed_expenses: typing.Iterable[dict[str, typing.Any]] = (),
+        project_id: uuid.UUID,
+    ):
+        # Each expense is a dict with the STORED_FIELDS. The count is exact, while the last use only moves forward: a
+        # removed expense doesn't bring back the one before it
+        counts: dict[str, int] = defaultdict(int)
+        last_expenses: dict[str, dict[str, typing.Any]] = dict()
+        for expense in expenses:
+            normalized_source = MerchantStat.normalize_source(expense["source"])
+            counts[normalized_source] += 1
+            last_expense = last_expenses.get(normalized_source)
+            if last_expense is None or expense["spent_at"] >= last_expense["spent_at"]:
+                last_expenses[normalized_source] = expense
+        for expense in removed_expenses:
+            counts[MerchantStat.normalize_source(expense["source"])] -= 1
+
+        # Removals never create rows, as with the monthly totals
+        MerchantStat.objects.bulk_create(
+            [
+                MerchantStat(project_id=project_id, normalized_source=normalized_source, source=normalized_source)
+                for normalized_source, count in counts.items()
+                if count > 0
+            ],
+            ignore_conflicts=True,
+        )
+        for normalized_source, count in counts.items():
+            last_expense = last_expenses.get(normalized_source)
+            # A single update for both the count and the last use (only if it's newer than the stored one)
+            updates: dict[str, typing.Any] = dict()
+            if count:
+                updates["count"] = F("count") + count
+            if last_expense:
+                is_newer = Q(last_spent_at=None) | Q(last_spent_at__lte=last_expense["spent_at"])
+                last_values = dict(
+                    source=last_expense["source"],
+                    last_spent_at=last_expense["spent_at"],
+                    category_id=last_expense["category_id"],
+                )
+                for field, value in last_values.items():
+                    updates[field] = Case(
+                        When(is_newer, then=Value(value)),
+                        default=F(field),
+                        output_field=typing.cast(models.Field, MerchantStat._meta.get_field(field)),
+                    )
+            if updates:
+                MerchantStat.objects.filter(project_id=project_id, normalized_source=normalized_source).update(
+                    **updates
+                )
+
+
+class CategorizationRule(BaseModel):
+    """
+    Files the expenses that match every condition set on it under its category. Text conditions are case insensitive:
+    the source contains `source_contains`, the source matches the `source_regex` anywhere, and the notes contain any
+    of the space separated `notes_keywords`. The first matching rule (by order) wins, see expenses.categorization
+    """
+
+    project = models.ForeignKey(Project, related_name="categorization_rules", on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name="categorization_rules", on_delete=models.CASCADE)
+    order = models.IntegerField(default=generate_order)
+    source_contains = models.CharField(max_length=200, blank=True)
+    source_regex = models.CharField(max_length=200, blank=True)
+    notes_keywords = models.CharField(max_length=1000, blank=True)
+    amount_min = models.FloatField(null=True, blank=True)
+    amount_max = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Rule {self.public_id} into {self.category}"
+
+    def clean(self):
+        if not any([self.source_contains, self.source_regex, self.notes_keywords]) and (
+            self.amount_min is None and self.amount_max is None
+        ):
+            raise ValidationError("A rule needs at least one condition.")
+        if self.source_regex:
+            try:
+                # Wrapped as the classifier combines it with the others, which e.g. rejects flags like "(?i)" midway.
+                # Regexes with groups of their own are never combined
+                if not re.compile(self.source_regex).groups:
+                    re.compile(f"(?:(?=.*?(?P<rule0>{self.source_regex})))?")
+            except re.error as exc:
+                raise ValidationError(dict(source_regex=f"Invalid regular expression: {exc}")) from exc
+        if self.amount_min is not None and self.amount_max is not None and self.amount_min > self.amount_max:
+            raise ValidationError(dict(amount_max="The maximum amount can't be below the minimum."))
+        if self.category_id and self.project_id and self.category.project_id != self.project_id:
+            raise ValidationError(dict(category="The category belongs to another project."))
+
+
+class RecurringExpense(BaseModel):
+    """
+    An expense that repeats every `interval` days, weeks, months or years since `starts_at` (and until `ends_at`, if
+    set), like the FREQ and INTERVAL of an iCalendar RRULE. Monthly and yearly occurrences keep the day of `starts_at`,
+    or the last day of the shorter months. Its occurrences become expenses up to a horizon, see expenses.recurring
+    """
+
+    FREQUENCIES = ["daily", "weekly", "monthly", "yearly"]
+
+    project = models.ForeignKey(Project, related_name="recurring_expenses", on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name="recurring_expenses", on_delete=models.CASCADE)
+    amount = models.FloatField()
+    source = models.CharField(max_length=200)
+    notes = models.CharField(max_length=1000, blank=True)
+    frequency = models.CharField(
+        max_length=10, choices=[(frequency, frequency.capitalize()) for frequency in FREQUENCIES], default="monthly"
+    )
+    interval = models.PositiveIntegerField(default=1)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField(null=True, blank=True)
+    # Every occurrence before it is an expense already
+    materialized_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return f"Recurring expense ${self.amount} at {self.source} {self.frequency} ({self.category})"
+
+    def clean(self):
+        if self.interval == 0:
+            raise ValidationError(dict(interval="The interval must be at least 1."))
+        if self.ends_at and self.starts_at and self.ends_at < self.starts_at:
+            raise ValidationError(dict(ends_at="The schedule can't end before it starts."))
+        if self.category_id and self.project_id and self.category.project_id != self.project_id:
+            raise ValidationError(dict(category="The category belongs to another project."))
+
+    def save(self, *args, **kwargs):
+        # Moved back, or repeating at other dates, the schedule can have occurrences before the watermark that aren't
+        # expenses yet: the next run goes through it all again (skipping those that already are, see
+        # expenses.recurring)
+        if not self._state.adding:
+            stored = RecurringExpense.objects.filter(pk=self.pk).values("starts_at", "frequency", "interval").first()
+            if stored and (
+                self.starts_at < stored["starts_at"]
+                or (self.frequency, self.interval) != (stored["frequency"], stored["interval"])
+            ):
+                self.materialized_until = None
+                if kwargs.get("update_fields") is not None:
+                    kwargs["update_fields"] = {*kwargs["update_fields"], "materialized_until"}
+        super().save(*args, **kwargs)
+
+    def get_occurrence(self, number: int) -> datetime.datetime:
+        if self.frequency in ["daily", "weekly"]:
+            days = 7 if self.frequency == "weekly" else 1
+            return self.starts_at + datetime.timedelta(days=number * self.interval * days)
+        months = number * self.interval * (12 if self.frequency == "yearly" else 1)
+        year, month = divmod(self.starts_at.year * 12 + self.starts_at.month - 1 + months, 12)
+        day = min(self.starts_at.day, calendar.monthrange(year, month + 1)[1])
+        return self.starts_at.replace(year=year, month=month + 1, day=day)
+
+    def generate_occurrences(
+        self, from_datetime: datetime.datetime, to_datetime: datetime.datetime
+    ) -> typing.Iterator[datetime.datetime]:
+        """The occurrences from `from_datetime` (included) to `to_datetime` (excluded)"""
+        if self.interval < 1:
+            return
+        # Jumps straight to around the first one instead of walking from the start of the schedule
+        number = 0
+        if from_datetime > self.starts_at:
+            if self.frequency in ["daily", "weekly"]:
+                step = datetime.timedelta(days=self.interval * (7 if self.frequency == "weekly" else 1))
+                number = (from_datetime - self.starts_at) // step
+            else:
+                step_months = self.interval * (12 if self.frequency == "yearly" else 1)
+                months = (from_datetime.year - self.starts_at.year) * 12 + from_datetime.month - self.starts_at.month
+                number = max(months // step_months - 1, 0)
+        while True:
+            occurrence = self.get_occurrence(number)
+            if occurrence >= to_datetime or (self.ends_at and occurrence > self.ends_at):
+                return
+            if occurrence >= from_datetime:
+                yield occurrence
+            number += 1
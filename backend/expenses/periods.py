@@ -0,0 +1,120 @@
+import datetime
+import typing
+from dataclasses import dataclass
+
+from django.db.models import Expression, IntegerField, Value
+from django.db.models.functions import Cast, ExtractMonth, ExtractYear, TruncMonth, TruncQuarter, TruncWeek, TruncYear
+from django.utils import timezone
+
+GRANULARITIES = ["week", "month", "quarter", "year"]
+MONTHS_PER_PERIOD = dict(month=1, quarter=3, year=12)
+TRUNCATE_FUNCTIONS = dict(week=TruncWeek, month=TruncMonth, quarter=TruncQuarter, year=TruncYear)
+# How many periods are shown when not asked for a specific range
+DEFAULT_AMOUNTS = dict(week=12, month=6, quarter=4, year=5)
+MAX_AMOUNT = 120
+
+
+@dataclass(frozen=True)
+class Granularity:
+    """
+    The size of the periods expenses are grouped in. Quarters and years start on `fiscal_start` (a month number), so
+    e.g. Granularity("year", fiscal_start=4) groups them in fiscal years from April to March
+    """
+
+    name: str = "month"
+    fiscal_start: int = 1
+
+    def __post_init__(self):
+        if self.name not in GRANULARITIES:
+            raise ValueError(f"{self.name!r} isn't a granularity, try one of {GRANULARITIES}")
+        if not 1 <= self.fiscal_start <= 12:
+            raise ValueError(f"{self.fiscal_start!r} isn't a month number")
+
+    @staticmethod
+    def from_query_args(query_args: typing.Mapping[str, str]) -> "Granularity":
+        return Granularity(
+            name=query_args.get("granularity") or "month", fiscal_start=int(query_args.get("fiscal_start") or 1)
+        )
+
+    @property
+    def query_args(self) -> dict[str, str]:
+        # Only what differs from the default, to keep the links as they were
+        query_args = dict()
+        if self.name != "month":
+            query_args["granularity"] = self.name
+        if self.fiscal_start != 1:
+            query_args["fiscal_start"] = str(self.fiscal_start)
+        return query_args
+
+    @property
+    def default_amount(self) -> int:
+        return DEFAULT_AMOUNTS[self.name]
+
+    @property
+    def is_calendar_aligned(self) -> bool:
+        # Whether the periods are those of the database Trunc* functions
+        return self.name in ["week", "month"] or (self.fiscal_start - 1) % MONTHS_PER_PERIOD[self.name] == 0
+
+    def truncate(self, value: datetime.datetime) -> datetime.datetime:
+        """The start of the period that contains the value"""
+        if self.name == "week":
+            return datetime.datetime(value.year, value.month, value.day) - datetime.timedelta(days=value.weekday())
+        months = MONTHS_PER_PERIOD[self.name]
+        month_total = value.year * 12 + value.month - self.fiscal_start
+        return _get_datetime_from_month_total(month_total // months * months + self.fiscal_start - 1)
+
+    def shift(self, period_start: datetime.datetime, amount: int) -> datetime.datetime:
+        if self.name == "week":
+            return period_start + datetime.timedelta(weeks=amount)
+        month_total = period_start.year * 12 + period_start.month - 1
+        return _get_datetime_from_month_total(month_total + amount * MONTHS_PER_PERIOD[self.name])
+
+    def generate_periods(
+        self,
+        *,
+        amount: int,
+        from_datetime: typing.Optional[datetime.datetime] = None,
+        to_datetime: typing.Optional[datetime.datetime] = None,
+    ) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        # Up to (and including) the period of to_datetime, starting at the one of from_datetime or `amount` periods ago
+        ending_at = self.shift(self.truncate(to_datetime or timezone.now()), 1)
+        starting_at = self.truncate(from_datetime) if from_datetime else self.shift(ending_at, -amount)
+        periods: list[tuple[datetime.datetime, datetime.datetime]] = list()
+        while starting_at < ending_at and len(periods) < MAX_AMOUNT:
+            period_end = self.shift(starting_at, 1)
+            periods.append((starting_at, period_end))
+            starting_at = period_end
+        return periods
+
+    def get_name(self, period_start: datetime.datetime) -> str:
+        if self.name == "week":
+            return period_start.strftime("%d %b %Y")
+        if self.name == "month":
+            return period_start.strftime("%b %Y")
+        # Quarters belong to the year they start in. Fiscal years are named after both calendar years they span
+        year_start = Granularity("year", fiscal_start=self.fiscal_start).truncate(period_start).year
+        year = str(year_start) if self.fiscal_start == 1 else f"FY{year_start}/{(year_start + 1) % 100:02}"
+        if self.name == "year":
+            return year
+        return f"Q{(period_start.month - self.fiscal_start) % 12 // 3 + 1} {year}"
+
+    def get_bucket_expression(self, field: str) -> Expression:
+        """A database expression with the period of the date(time) field, comparable with get_bucket_key()"""
+        if self.is_calendar_aligned:
+            return TRUNCATE_FUNCTIONS[self.name](field)
+        # Fiscal quarters and years that don't start along with the calendar ones: number the periods since year 0.
+        # The extracted values are cast because Postgres returns them as numeric, which wouldn't be divided as integers
+        month_total = Cast(ExtractYear(field) * 12 + ExtractMonth(field) - self.fiscal_start, IntegerField())
+        return month_total / Value(MONTHS_PER_PERIOD[self.name])
+
+    def get_bucket_key(self, period_start: datetime.datetime, *, is_date: bool) -> typing.Hashable:
+        if self.is_calendar_aligned:
+            return period_start.date() if is_date else period_start
+        return (period_start.year * 12 + period_start.month - self.fiscal_start) // MONTHS_PER_PERIOD[self.name]
+
+
+MONTHLY = Granularity()
+
+
+def _get_datetime_from_month_total(month_total: int, /) -> datetime.datetime:
+    return datetime.datetime(year=month_total // 12, month=month_total % 12 + 1, day=1)
@@ -0,0 +1,82 @@
+import bisect
+import collections
+import datetime
+import uuid
+
+from django.db import transaction
+from django.db.models import Q
+
+from expenses.models import Expense, Project, RecurringExpense
+
+
+def materialize(*, until: datetime.datetime) -> int:
+    """
+    Creates the expenses of every occurrence before `until` that isn't one yet, and returns how many. Running it again
+    with the same (or an earlier) horizon creates nothing
+    """
+    with transaction.atomic():
+        # Locked, so that two overlapping runs don't both create the occurrences between the same watermarks
+        schedules = list(
+            RecurringExpense.objects.select_for_update(of=("self",))
+            .filter(Q(materialized_until=None) | Q(materialized_until__lt=until))
+            .select_related("project", "category")
+        )
+        occurrences: list[tuple[RecurringExpense, datetime.datetime]] = list()
+        for schedule in schedules:
+            from_datetime = schedule.materialized_until or schedule.starts_at
+            occurrences.extend((schedule, spent_at) for spent_at in schedule.generate_occurrences(from_datetime, until))
+            schedule.materialized_until = until
+        if not schedules:
+            return 0
+
+        # The watermark is enough on its own, unless the schedule was moved back (e.g. its start edited) after a run,
+        # which resets it (see RecurringExpense.save) and walks again over the occurrences that are expenses already
+        existing = set()
+        if occurrences:
+            existing = set(
+                Expense.objects.filter(
+                    recurring_expense__in=schedules, spent_at__gte=min(spent_at for _, spent_at in occurrences)
+                ).values_list("recurring_expense_id", "spent_at")
+            )
+        expenses_by_project: dict[uuid.UUID, list[Expense]] = collections.defaultdict(list)
+        projects: dict[uuid.UUID, Project] = dict()
+        for schedule, spent_at in occurrences:
+            if (schedule.id, spent_at) in existing:
+                continue
+            projects[schedule.project_id] = schedule.project
+            expenses_by_project[schedule.project_id].append(
+                Expense(
+                    category=schedule.category,
+                    recurring_expense=schedule,
+                    spent_at=spent_at,
+                    amount=schedule.amount,
+                    source=schedule.source,
+                    notes=schedule.notes,
+                )
+            )
+        for project_id, expenses in expenses_by_project.items():
+            Expense.create_in_bulk(expenses, project=projects[project_id])
+        RecurringExpense.objects.filter(pk__in=[schedule.pk for schedule in schedules]).update(materialized_until=until)
+    return sum(len(expenses) for expenses in expenses_by_project.values())
+
+
+def project_amounts(
+    *, project: Project, periods: list[tuple[datetime.datetime, datetime.datetime]]
+) -> list[dict[uuid.UUID, float]]:
+    """
+    How much the schedules of the project add to each category in each period, counting only the occurrences that
+    aren't expenses yet. Nothing is written, so the periods can be as far ahead as wanted
+    """
+    amounts_per_period: list[dict[uuid.UUID, float]] = [collections.defaultdict(float) for _ in periods]
+    if not periods:
+        return amounts_per_period
+    period_starts = [period_start for period_start, _ in periods]
+    schedules = RecurringExpense.objects.filter(
+        Q(ends_at=None) | Q(ends_at__gte=periods[0][0]), project=project, starts_at__lt=periods[-1][1]
+    )
+    for schedule in schedules:
+        from_datetime = max(periods[0][0], schedule.materialized_until or schedule.starts_at)
+        for spent_at in schedule.generate_occurrences(from_datetime, periods[-1][1]):
+            amounts = amounts_per_period[bisect.bisect_right(period_starts, spent_at) - 1]
+            amounts[schedule.category_id] += schedule.amount
+    return amounts_per_period
@@ -0,0 +1,105 @@
+import re
+import typing
+import uuid
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from expenses.models import Expense, Project
+
+MAX_TERMS = 10
+TERM_REGEX = re.compile(r"\w+")
+
+# Kept in sync on every write by the database itself (see the 0008_expense_search migration): a GIN index on this
+# expression in Postgres, and an FTS5 table filled by triggers in SQLite. The source weighs more than the notes
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, source), 'A')"
+    " || setweight(to_tsvector('simple'::regconfig, notes), 'B')"
+)
+SQLITE_TABLE = "expenses_expense_fts"
+SQLITE_COLUMNS = "project_id, source, notes"
+_SQLITE_DELETE_OLD = (
+    f"INSERT INTO {SQLITE_TABLE}({SQLITE_TABLE}, rowid, {SQLITE_COLUMNS})"
+    " VALUES ('delete', old.rowid, old.project_id, old.source, old.notes);"
+)
+_SQLITE_INSERT_NEW = (
+    f"INSERT INTO {SQLITE_TABLE}(rowid, {SQLITE_COLUMNS}) VALUES (new.rowid, new.project_id, new.source, new.notes);"
+)
+SQLITE_TRIGGERS = {
+    f"{SQLITE_TABLE}_insert": f"AFTER INSERT ON expenses_expense BEGIN {_SQLITE_INSERT_NEW} END",
+    f"{SQLITE_TABLE}_delete": f"AFTER DELETE ON expenses_expense BEGIN {_SQLITE_DELETE_OLD} END",
+    f"{SQLITE_TABLE}_update": (
+        f"AFTER UPDATE OF {SQLITE_COLUMNS} ON expenses_expense BEGIN {_SQLITE_DELETE_OLD} {_SQLITE_INSERT_NEW} END"
+    ),
+}
+
+
+def get_terms(query: str) -> list[str]:
+    return TERM_REGEX.findall(query.lower())[:MAX_TERMS]
+
+
+def search_expenses(*, project: Project, query: str, limit: int) -> list[uuid.UUID]:
+    """
+    The ids of the expenses of the project whose source or notes have words starting with every term of the query,
+    best matches first (and the most recent ones among equally good matches)
+    """
+    terms = get_terms(query)
+    if not terms:
+        return []
+    if connection.vendor == "postgresql":
+        tsquery = " & ".join(f"'{term}':*" for term in terms)
+        sql = (
+            f"SELECT id FROM expenses_expense WHERE project_id = %s AND {POSTGRES_VECTOR} @@ to_tsquery('simple', %s)"
+            f" ORDER BY ts_rank({POSTGRES_VECTOR}, to_tsquery('simple', %s)) DESC, spent_at DESC LIMIT %s"
+        )
+        params: list[typing.Any] = [project.id, tsquery, tsquery, limit]
+    elif connection.vendor == "sqlite" and _has_sqlite_table():
+        # The project id is indexed too, so the index intersects it with the terms instead of filtering afterwards
+        match = 'project_id : "{}" AND {{source notes}} : ({})'.format(
+            project.id.hex, " AND ".join(f'"{term}"*' for term in terms)
+        )
+        sql = (
+            f"SELECT expense.id FROM {SQLITE_TABLE} JOIN expenses_expense expense ON expense.rowid = {SQLITE_TABLE}.rowid"
+            f" WHERE {SQLITE_TABLE} MATCH %s ORDER BY bm25({SQLITE_TABLE}, 0.0, 2.0, 1.0), expense.spent_at DESC LIMIT %s"
+        )
+        params = [match, limit]
+    else:
+        # No full-text index (e.g. SQLite built without FTS5): scan the expenses of the project
+        filter_args = [Q(source__icontains=term) | Q(notes__icontains=term) for term in terms]
+        return list(
+            Expense.objects.filter(*filter_args, project=project)
+            .order_by("-spent_at")
+            .values_list("id", flat=True)[:limit]
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [Expense._meta.pk.to_python(id_) for id_, in cursor.fetchall()]
+
+
+def rebuild_index():
+    # SQLite may renumber the rowids the FTS5 table refers to when vacuuming, Postgres indexes don't need it
+    if connection.vendor == "sqlite" and _has_sqlite_table():
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SQLITE_TABLE}({SQLITE_TABLE}) VALUES ('rebuild')")
+
+
+def restore_sqlite_triggers(*, using: str = "default", **kwargs):
+    """
+    SQLite can't alter most columns, so migrations rebuild the expenses table as a copy, which drops its triggers and
+    renumbers its rowids. Run after every migration (post_migrate) to put them back and reindex
+    """
+    connection_ = connections[using]
+    if connection_.vendor != "sqlite" or not _has_sqlite_table(connection_):
+        return
+    with connection_.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expenses_expense'")
+        missing = SQLITE_TRIGGERS.keys() - {name for name, in cursor.fetchall()}
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(f"CREATE TRIGGER {name} {SQLITE_TRIGGERS[name]}")
+        cursor.execute(f"INSERT INTO {SQLITE_TABLE}({SQLITE_TABLE}) VALUES ('rebuild')")
+
+
+def _has_sqlite_table(connection_=connection) -> bool:
+    return SQLITE_TABLE in connection_.introspection.table_names()
@@ -0,0 +1,52 @@
+import logging
+
+from django.db.models.functions import Substr
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from expenses.models import STORED_FIELDS, Category, CategoryMonthTotal, Expense, MerchantStat, Project
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_save, sender=Expense)
+def fetch_stored_expense(sender, instance: Expense, raw: bool, **kwargs):
+    instance._previous_values = None if raw else instance.get_stored_values()
+
+
+@receiver(post_save, sender=Expense)
+def update_month_totals_on_save(sender, instance: Expense, raw: bool, **kwargs):
+    if raw:
+        return
+    stored_values = [{field: getattr(instance, field) for field in STORED_FIELDS}]
+    removed_expenses = [instance._previous_values] if instance._previous_values else []
+    CategoryMonthTotal.add_expenses(stored_values, removed_expenses=removed_expenses)
+    MerchantStat.add_expenses(stored_values, removed_expenses=removed_expenses, project_id=instance.project_id)
+    category_ids = {instance.category_id}
+    if instance._previous_values:
+        category_ids.add(instance._previous_values["category_id"])
+    Project.bump_data_version(categories__in=category_ids)
+    instance.remember_stored_values()
+
+
+@receiver(post_delete, sender=Expense)
+def update_month_totals_on_delete(sender, instance: Expense, **kwargs):
+    stored_values = getattr(instance, "_stored_values", dict())
+    if not all(field in stored_values for field in STORED_FIELDS):
+        stored_values = {field: getattr(instance, field) for field in STORED_FIELDS}
+    CategoryMonthTotal.add_expenses(removed_expenses=[stored_values])
+    MerchantStat.add_expenses(removed_expenses=[stored_values], project_id=instance.project_id)
+    Project.bump_data_version(categories=stored_values["category_id"])
+
+
+@receiver(post_save, sender=Category)
+def bump_category_version_on_category_save(sender, instance: Category, raw: bool, **kwargs):
+    if not raw:
+        Project.bump_category_version(pk=instance.project_id)
+
+
+@receiver(post_delete, sender=Category)
+def update_paths_on_category_delete(sender, instance: Category, **kwargs):
+    # The children were already detached (on_delete=SET_NULL) so the whole subtree moves up to the root
+    Category.objects.filter(path__startswith=instance.path).update(path=Substr("path", len(instance.path) + 1))
+    Project.bump_category_version(pk=instance.project_id)
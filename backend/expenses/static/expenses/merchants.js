@@ -0,0 +1,48 @@
+// Suggests the merchants of the project while typing the source of a new expense, and prefills the category the
+// picked one was last filed under
+document.addEventListener("DOMContentLoaded", () => {
+  const input = document.querySelector("input[data-merchants-url]");
+  if (!input) {
+    return;
+  }
+  const datalist = document.createElement("datalist");
+  datalist.id = input.getAttribute("list");
+  input.after(datalist);
+  const categories = new Map();
+  let controller = null;
+
+  input.addEventListener("input", async () => {
+    const category = categories.get(input.value);
+    if (category) {
+      const select = input.form.querySelector("select[name=category]");
+      if (select && select.querySelector(`option[value="${category}"]`)) {
+        select.value = category;
+      }
+      return;
+    }
+    // Only the suggestions of the last keystroke matter
+    if (controller) {
+      controller.abort();
+    }
+    controller = new AbortController();
+    let data;
+    try {
+      const url = `${input.dataset.merchantsUrl}?q=${encodeURIComponent(input.value)}`;
+      const response = await fetch(url, { signal: controller.signal });
+      if (!response.ok) {
+        return;
+      }
+      data = await response.json();
+    } catch (error) {
+      return;
+    }
+    datalist.replaceChildren(
+      ...data.merchants.map((merchant) => {
+        categories.set(merchant.source, merchant.category);
+        const option = document.createElement("option");
+        option.value = merchant.source;
+        return option;
+      })
+    );
+  });
+});
@@ -0,0 +1,23 @@
+// Loads the older periods of the dashboard on demand, prepending them to the table a page at a time
+document.addEventListener("DOMContentLoaded", () => {
+  const button = document.getElementById("load-older-rows");
+  if (!button) {
+    return;
+  }
+  button.addEventListener("click", async () => {
+    button.disabled = true;
+    const response = await fetch(button.dataset.url);
+    if (!response.ok) {
+      button.disabled = false;
+      return;
+    }
+    document.getElementById("value-rows").insertAdjacentHTML("afterbegin", await response.text());
+    const olderRowsLink = response.headers.get("X-Older-Rows");
+    if (olderRowsLink) {
+      button.dataset.url = olderRowsLink;
+      button.disabled = false;
+    } else {
+      button.remove();
+    }
+  });
+});
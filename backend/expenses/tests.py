@@ -1,3 +1,1413 @@
-# from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import tempfile
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from auth.models import User
+from expenses import budgets, duplicates, importers, recurring, views
+from expenses.categorization import AhoCorasick, Classifier
+from expenses.cube import CubeCache, ProjectCube, cubes
+from expenses.merchants import merchant_indexes
+from expenses.models import (
+    CategorizationRule,
+    Category,
+    CategoryMonthTotal,
+    Expense,
+    MerchantStat,
+    Project,
+    RecurringExpense,
+)
+from expenses.periods import Granularity
+from expenses.views import _generate_periods, _generate_value_rows
+from helpers import metrics
+from helpers.middleware import QueryBudgetExceeded
+from helpers.querylog import QueryLog, fingerprint_sql
+
+
+class ExpensesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="secret")
+        # Public ids are random, and some start with a dash like this one
+        self.project = Project.objects.create(user=self.user, name="Home", public_id="-pr0ject_id")
+        self.income = Category.objects.create(project=self.project, name="Income")
+        self.mandatory = Category.objects.create(project=self.project, name="Mandatory")
+        self.rent = Category.objects.create(project=self.project, name="Rent", parent=self.mandatory)
+        self.deposit = Category.objects.create(project=self.project, name="Deposit", parent=self.rent)
+        self.client.force_login(self.user)
+
+    def create_expense(self, category, amount, spent_at=None, source="Someone"):
+        if spent_at is None:
+            spent_at = _generate_periods(amount=1)[-1][0] + datetime.timedelta(days=1)
+        return Expense.objects.create(category=category, amount=amount, spent_at=spent_at, source=source)
+
+
+class ProjectDetailTests(ExpensesTestCase):
+    def test_value_rows_roll_up_the_category_tree(self):
+        self.create_expense(self.income, 1000)
+        self.create_expense(self.mandatory, 10)
+        self.create_expense(self.rent, 500)
+        self.create_expense(self.deposit, 50)
+        self.create_expense(self.deposit, 25)
+
+        value_rows = _generate_value_rows(project=self.project, periods=_generate_periods(amount=6))
+
+        self.assertEqual(len(value_rows), 6)
+        _, values = value_rows[-1]
+        self.assertEqual(
+            [(value.amount, value.is_total, value.category) for value in values],
+            [
+                (1000, False, self.income),
+                (585, True, self.mandatory),
+                (575, True, self.rent),
+                (75, False, self.deposit),
+                (500, False, self.rent),
+                (10, False, self.mandatory),
+                (1585, False, None),
+            ],
+        )
+        for _, values in value_rows[:-1]:
+            self.assertEqual({value.amount for value in values}, {0})
+
+    def test_value_rows_cost_a_constant_amount_of_queries(self):
+        for _ in range(3):
+            self.create_expense(Category.objects.create(project=self.project, name="Extra", parent=self.deposit), 1)
+
+        with self.assertNumQueries(2):
+            _generate_value_rows(project=self.project, periods=_generate_periods(amount=6))
+
+    def test_dashboard_links_resolve_the_url_once(self):
+        periods = _generate_periods(amount=6)
+        with mock.patch("expenses.views.reverse", wraps=reverse) as reverse_mock:
+            header_rows, value_rows = views._get_dashboard_rows(project=self.project, periods=periods)
+        self.assertEqual(reverse_mock.call_count, 1)
+
+        url = reverse("expenses:expense_list", args=[self.project.public_id])
+        self.assertEqual(
+            [(header.name, header.link) for header in header_rows[1]],
+            [
+                ("∑", f"{url}?category={self.mandatory.public_id}&show_children=True"),
+                ("Rent", f"{url}?category={self.rent.public_id}&show_children=True"),
+                ("Other", f"{url}?category={self.mandatory.public_id}"),
+            ],
+        )
+        period, values = value_rows[-1]
+        dates = f"from={periods[-1][0]:%Y-%m-%d}&to={periods[-1][1]:%Y-%m-%d}"
+        self.assertEqual(period.link, f"{url}?{dates}")
+        self.assertEqual(values[1].link, f"{url}?{dates}&show_children=True&category={self.mandatory.public_id}")
+        self.assertEqual(values[0].link, f"{url}?{dates}&category={self.income.public_id}")
+        self.assertEqual((values[-1].name, values[-1].link), ("0.00€", f"{url}?{dates}"))
+
+    def test_project_detail(self):
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Mandatory")
+
+
+class GranularityTests(ExpensesTestCase):
+    def test_periods_and_names(self):
+        to_datetime = datetime.datetime(2022, 1, 15, 10)
+        cases = [
+            (
+                Granularity("week"),
+                [(datetime.datetime(2022, 1, 3), "03 Jan 2022"), (datetime.datetime(2022, 1, 10), "10 Jan 2022")],
+            ),
+            (
+                Granularity("quarter"),
+                [(datetime.datetime(2021, 10, 1), "Q4 2021"), (datetime.datetime(2022, 1, 1), "Q1 2022")],
+            ),
+            (
+                Granularity("quarter", fiscal_start=2),
+                [(datetime.datetime(2021, 8, 1), "Q3 FY2021/22"), (datetime.datetime(2021, 11, 1), "Q4 FY2021/22")],
+            ),
+            (
+                Granularity("year", fiscal_start=4),
+                [(datetime.datetime(2020, 4, 1), "FY2020/21"), (datetime.datetime(2021, 4, 1), "FY2021/22")],
+            ),
+        ]
+        for granularity, expected in cases:
+            periods = granularity.generate_periods(amount=2, to_datetime=to_datetime)
+            self.assertEqual([(start, granularity.get_name(start)) for start, _ in periods], expected)
+            self.assertEqual(periods[0][1], periods[1][0])
+
+    def test_value_rows_are_grouped_in_a_single_query(self):
+        for month in range(1, 13):
+            self.create_expense(self.income, month, spent_at=datetime.datetime(2021, month, 2 + month))
+        cases = [
+            (Granularity("year"), 3, [0, 0, 78]),
+            (Granularity("year", fiscal_start=4), 2, [6, 72]),
+            (Granularity("quarter", fiscal_start=2), 4, [9, 18, 27, 11 + 12]),
+            (Granularity("week"), 3, [12, 0, 0]),
+        ]
+        for granularity, amount, expected in cases:
+            periods = granularity.generate_periods(amount=amount, to_datetime=datetime.datetime(2021, 12, 31))
+            with self.assertNumQueries(2):
+                value_rows = _generate_value_rows(project=self.project, periods=periods, granularity=granularity)
+            self.assertEqual([values[0].amount for _, values in value_rows], expected, granularity)
+
+    def test_views_follow_the_granularity(self):
+        self.create_expense(self.income, 10, spent_at=datetime.datetime(2021, 3, 5))
+        self.create_expense(self.income, 20, spent_at=datetime.datetime(2021, 11, 5))
+
+        response = self.client.get(
+            reverse("expenses:project_detail", args=[self.project.public_id]), {"granularity": "year", "periods": 10}
+        )
+        period, values = next(
+            (period, values) for period, values in response.context["value_rows"] if period.name == "2021"
+        )
+        self.assertEqual((period.name, values[0].amount), ("2021", 30))
+        self.assertIn("&granularity=year", period.link)
+
+        response = self.client.get(period.link)
+        self.assertEqual(
+            [
+                (period["period_start_name"], len(period["period_expenses"]))
+                for period in response.context["periods_expenses"]
+            ],
+            [("2021", 2)],
+        )
+        url = reverse("expenses:project_detail", args=[self.project.public_id])
+        self.assertEqual(self.client.get(url, {"granularity": "decade"}).status_code, 404)
+
+
+class OlderRowsTests(ExpensesTestCase):
+    def test_older_rows_are_loaded_until_there_are_no_more_expenses(self):
+        periods = _generate_periods(amount=13)
+        self.create_expense(self.income, 42, spent_at=periods[0][0] + datetime.timedelta(days=3))
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        self.assertContains(response, "Load older periods")
+
+        response = self.client.get(response.context["older_rows_link"])
+        self.assertEqual(
+            [period.name for period, _ in response.context["value_rows"]],
+            [period_start.strftime("%b %Y") for period_start, _ in periods[-12:-6]],
+        )
+        self.assertNotContains(response, "42.00€")
+
+        response = self.client.get(response["X-Older-Rows"] + "&format=json")
+        rows = response.json()["rows"]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual((rows[-1]["name"], rows[-1]["values"][0]["name"]), (periods[0][0].strftime("%b %Y"), "42.00€"))
+        self.assertIsNone(response.json()["older_rows_link"])
+
+    def test_rows_before_the_first_year_are_not_found(self):
+        url = reverse("expenses:project_rows", args=[self.project.public_id])
+        for query_args in [
+            dict(before="0001-01-01"),
+            dict(before="0001-03-01"),
+            dict(before="0001-01-08", granularity="week"),
+        ]:
+            self.assertEqual(self.client.get(url, query_args).status_code, 404, query_args)
+        self.assertEqual(self.client.get(url, dict(before="0001-07-01", periods=6)).status_code, 200)
+
+    def test_recent_projects_have_nothing_older_to_load(self):
+        self.create_expense(self.income, 42)
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        self.assertIsNone(response.context["older_rows_link"])
+        self.assertNotContains(response, "Load older periods")
+
+
+class CategoryMonthTotalTests(ExpensesTestCase):
+    def assertMonthTotals(self, expected):
+        self.assertEqual(
+            set(CategoryMonthTotal.objects.exclude(count=0).values_list("category_id", "month", "total", "count")),
+            expected,
+        )
+
+    def test_totals_follow_expense_writes(self):
+        expense = self.create_expense(self.rent, 500, spent_at=datetime.datetime(2022, 3, 31, 23, 59))
+        self.create_expense(self.rent, 20, spent_at=datetime.datetime(2022, 3, 1))
+        self.assertMonthTotals({(self.rent.id, datetime.date(2022, 3, 1), 520, 2)})
+
+        expense.amount = 400
+        expense.save()
+        self.assertMonthTotals({(self.rent.id, datetime.date(2022, 3, 1), 420, 2)})
+
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.category = self.deposit
+        expense.spent_at = datetime.datetime(2022, 4, 1)
+        expense.save()
+        self.assertMonthTotals(
+            {(self.rent.id, datetime.date(2022, 3, 1), 20, 1), (self.deposit.id, datetime.date(2022, 4, 1), 400, 1)}
+        )
+
+        expense.delete()
+        self.assertMonthTotals({(self.rent.id, datetime.date(2022, 3, 1), 20, 1)})
+
+        self.rent.delete()
+        self.assertMonthTotals(set())
+
+    def test_expense_detail_moves_totals(self):
+        expense = self.create_expense(self.rent, 500, spent_at=datetime.datetime(2022, 3, 5))
+        response = self.client.post(
+            reverse("expenses:expense_detail", args=[self.project.public_id, expense.public_id]),
+            dict(spent_at="2022-05-05T10:00", amount="300", source="Landlord", category=self.income.pk, notes=""),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertMonthTotals({(self.income.id, datetime.date(2022, 5, 1), 300, 1)})
+
+    def test_rebuild_command(self):
+        self.create_expense(self.rent, 500, spent_at=datetime.datetime(2022, 3, 5))
+        CategoryMonthTotal.objects.update(total=1)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_month_totals", "--check", stdout=io.StringIO(), stderr=io.StringIO())
+
+        call_command("rebuild_month_totals", stdout=io.StringIO())
+        self.assertMonthTotals({(self.rent.id, datetime.date(2022, 3, 1), 500, 1)})
+
+
+class CategoryPathTests(ExpensesTestCase):
+    def test_paths_follow_reparenting_and_deletion(self):
+        self.assertEqual(
+            self.deposit.path, f"{self.mandatory.public_id}/{self.rent.public_id}/{self.deposit.public_id}/"
+        )
+
+        self.rent.parent = self.income
+        self.rent.save()
+        self.deposit.refresh_from_db()
+        self.assertEqual(self.deposit.path, f"{self.income.public_id}/{self.rent.public_id}/{self.deposit.public_id}/")
+
+        self.income.delete()
+        self.deposit.refresh_from_db()
+        self.assertEqual(self.deposit.path, f"{self.rent.public_id}/{self.deposit.public_id}/")
+
+    def test_category_cannot_be_nested_under_its_descendants(self):
+        self.mandatory.parent = self.deposit
+        with self.assertRaises(ValueError):
+            self.mandatory.save()
+
+    def test_expense_list_shows_every_descendant(self):
+        self.create_expense(self.income, 1000, source="Payroll")
+        self.create_expense(self.rent, 500, source="Landlord")
+        self.create_expense(self.deposit, 50, source="Agency")
+
+        response = self.client.get(
+            reverse("expenses:expense_list", args=[self.project.public_id]),
+            dict(category=self.mandatory.public_id, show_children="True"),
+        )
+        self.assertContains(response, "Landlord")
+        self.assertContains(response, "Agency")
+        self.assertNotContains(response, "Payroll")
+
+
+class DashboardCacheTests(ExpensesTestCase):
+    def test_repeated_views_are_cached_until_the_project_changes(self):
+        url = reverse("expenses:project_detail", args=[self.project.public_id])
+        self.create_expense(self.rent, 500)
+        with CaptureQueriesContext(connection) as cold_queries:
+            self.assertContains(self.client.get(url), "500.00€")
+        with CaptureQueriesContext(connection) as warm_queries:
+            self.assertContains(self.client.get(url), "500.00€")
+        self.assertLess(len(warm_queries), len(cold_queries))
+
+        self.create_expense(self.rent, 250)
+        self.assertContains(self.client.get(url), "750.00€")
+
+        self.rent.name = "Housing"
+        self.rent.save()
+        self.assertContains(self.client.get(url), "Housing")
+
+    def test_the_tree_follows_the_order_of_the_categories(self):
+        Category.objects.filter(pk=self.income.pk).update(order=self.mandatory.order + 1)
+        Category.objects.create(project=self.project, name="Bills", parent=self.mandatory, order=self.rent.order)
+        children_by_parent = Category.build_tree(project=self.project)
+        self.assertEqual([category.name for category in children_by_parent[None]], ["Mandatory", "Income"])
+        # The same order falls back to the name
+        self.assertEqual([category.name for category in children_by_parent[self.mandatory.id]], ["Bills", "Rent"])
+
+    def test_header_rows_are_only_invalidated_by_category_writes(self):
+        periods = _generate_periods(amount=6)
+        self.project.refresh_from_db()
+        views._get_dashboard_rows(project=self.project, periods=periods)
+        self.create_expense(self.rent, 500)
+        self.project.refresh_from_db()
+        with mock.patch("expenses.views._generate_header_rows") as generate_header_rows_mock:
+            views._get_dashboard_rows(project=self.project, periods=periods)
+        generate_header_rows_mock.assert_not_called()
+
+        Category.objects.create(project=self.project, name="Utilities", parent=self.mandatory)
+        self.project.refresh_from_db()
+        header_rows, _ = views._get_dashboard_rows(project=self.project, periods=periods)
+        self.assertEqual(
+            [[(header.name, header.colspan, header.rowspan) for header in header_row] for header_row in header_rows],
+            [
+                [("Income", 1, 3), ("Mandatory", 6, 1)],
+                [("∑", 1, 2), ("Rent", 3, 1), ("Utilities", 1, 2), ("Other", 1, 2)],
+                [("∑", 1, 1), ("Deposit", 1, 1), ("Other", 1, 1)],
+            ],
+        )
+
+
+class ExpenseListTests(ExpensesTestCase):
+    @mock.patch("expenses.views.EXPENSE_LIST_PAGE_SIZE", 2)
+    def test_pages_continue_where_the_previous_one_stopped(self):
+        spent_at = _generate_periods(amount=1)[-1][0]
+        for a, source in enumerate(["Bakery", "Butcher", "Grocer"]):
+            self.create_expense(self.income, 10, spent_at=spent_at + datetime.timedelta(hours=a), source=source)
+
+        url = reverse("expenses:expense_list", args=[self.project.public_id])
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, "#1 Bakery")
+        self.assertContains(response, "#2 Butcher")
+        self.assertNotContains(response, "Grocer")
+
+        response = self.client.get(f"{url}?{response.context['load_more_query_arg']}")
+        self.assertContains(response, "#3 Grocer")
+        self.assertNotContains(response, "Bakery")
+        self.assertIsNone(response.context["load_more_query_arg"])
+
+    def test_malformed_cursors_are_not_found(self):
+        url = reverse("expenses:expense_list", args=[self.project.public_id])
+        for cursor in ["garbage", "2022-03-01T10:00:00_nope_1", "yesterday_" + "0" * 32 + "_1", "2022-03-01_1_2_3"]:
+            with self.subTest(cursor):
+                self.assertEqual(self.client.get(url, dict(after=cursor)).status_code, 404)
+
+
+class ExpenseImportTests(ExpensesTestCase):
+    def test_import_command_with_every_format(self):
+        statements = dict(
+            csv='date,amount,source,category\n2022-03-01,12.5,Bakery,Rent\n2022-03-02,"1,000.00",Payroll,Income\n',
+            ofx=(
+                "OFXHEADER:100\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>"
+                "<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20220301120000[0:GMT]<TRNAMT>12.50<NAME>Bakery</STMTTRN>"
+                "<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20220302<TRNAMT>1000<NAME>Payroll<MEMO>March</STMTTRN>"
+                "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>"
+            ),
+            qif="!Type:Bank\nD03/01/2022\nT12.50\nPBakery\nLMandatory:Rent\n^\nD03/02'2022\nT1,000.00\nPPayroll\n^\n",
+        )
+        for format_, statement in statements.items():
+            with self.subTest(format_):
+                Expense.objects.all().delete()
+                with tempfile.NamedTemporaryFile("w", suffix=f".{format_}") as file:
+                    file.write(statement)
+                    file.flush()
+                    call_command(
+                        "import_expenses",
+                        f"--project={self.project.public_id}",
+                        file.name,
+                        f"--format={format_}",
+                        f"--default-category={self.income.public_id}",
+                        stdout=io.StringIO(),
+                    )
+
+                self.assertEqual(
+                    set(Expense.objects.values_list("spent_at__date", "amount", "source", "category")),
+                    {
+                        (
+                            datetime.date(2022, 3, 1),
+                            12.5,
+                            "Bakery",
+                            self.income.id if format_ == "ofx" else self.rent.id,
+                        ),
+                        (datetime.date(2022, 3, 2), 1000, "Payroll", self.income.id),
+                    },
+                )
+                self.assertEqual(
+                    CategoryMonthTotal.objects.filter(month=datetime.date(2022, 3, 1)).aggregate(Sum("total")),
+                    dict(total__sum=1012.5),
+                )
+
+    def test_import_view(self):
+        statement = SimpleUploadedFile("statement.csv", b"date,amount,source\n2022-03-01,12.5,Bakery\n")
+        response = self.client.post(
+            reverse("expenses:expense_import", args=[self.project.public_id]),
+            dict(
+                statement=statement,
+                format="csv",
+                default_category=self.rent.pk,
+                spent_at_column="date",
+                amount_column="amount",
+                source_column="source",
+                notes_column="notes",
+                category_column="category",
+            ),
+        )
+        self.assertContains(response, "Imported 1 expenses")
+        self.assertEqual(Expense.objects.get().category, self.rent)
+
+    def test_rows_without_category_need_a_default(self):
+        rows = importers.parse_csv(io.StringIO("date,amount,source\n2022-03-01,12.5,Bakery\n"))
+        with self.assertRaises(importers.InvalidStatement):
+            importers.import_expenses(rows, project=self.project)
+
+    def test_invalid_rows_leave_nothing_imported(self):
+        rows = importers.parse_csv(
+            io.StringIO("date,amount,source,category\n2022-03-01,12.5,Bakery,Rent\n2022-03-02,3,Kiosk,\n")
+        )
+        with self.assertRaises(importers.InvalidStatement):
+            importers.import_expenses(rows, project=self.project, batch_size=1)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(CategoryMonthTotal.objects.exclude(count=0).exists())
+
+    def test_malformed_statements_are_reported(self):
+        oversized_field = "x" * (csv.field_size_limit() + 1)
+        statement = SimpleUploadedFile(
+            "statement.csv", f"date,amount,source\n2022-03-01,1,{oversized_field}\n".encode()
+        )
+        response = self.client.post(
+            reverse("expenses:expense_import", args=[self.project.public_id]),
+            dict(
+                statement=statement,
+                format="csv",
+                default_category=self.rent.pk,
+                spent_at_column="date",
+                amount_column="amount",
+                source_column="source",
+                notes_column="notes",
+                category_column="category",
+            ),
+        )
+        self.assertContains(response, "field larger than field limit")
+        self.assertFalse(Expense.objects.exists())
+
+
+class ExportTests(ExpensesTestCase):
+    def test_expense_export(self):
+        self.create_expense(self.rent, 500, spent_at=datetime.datetime(2022, 3, 5), source="Landlord")
+        url = reverse("expenses:expense_export", args=[self.project.public_id])
+
+        response = self.client.get(url, dict(format="csv"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "public_id,spent_at,amount,source,notes,category__public_id,category__name")
+        self.assertIn(",2022-03-05 00:00:00,500.0,Landlord,,", lines[1])
+
+        response = self.client.get(url, dict(format="ndjson"))
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["amount"], row["category__name"]) for row in rows], [(500, "Rent")])
+
+    def test_project_export(self):
+        self.create_expense(self.deposit, 50, spent_at=datetime.datetime(2022, 3, 5))
+        response = self.client.get(
+            reverse("expenses:project_export", args=[self.project.public_id]),
+            {"from": "2022-03-01", "to": "2022-03-31"},
+        )
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            lines,
+            [
+                "Period,Income,Mandatory (total),Rent (total),Deposit,Rent (other),Mandatory (other),Total",
+                "2022-03-01,0.00,50.00,50.00,50.00,0.00,0.00,50.00",
+            ],
+        )
+
+    def test_malformed_dates_are_not_found(self):
+        url = reverse("expenses:project_export", args=[self.project.public_id])
+        for query_args in [{"from": "garbage"}, {"to": "2022-13-01"}, {"to": "9999-12-31"}, {"to": "0001-01-01"}]:
+            self.assertEqual(self.client.get(url, query_args).status_code, 404, query_args)
+        url = reverse("expenses:expense_list", args=[self.project.public_id])
+        self.assertEqual(self.client.get(url, {"from": "garbage"}).status_code, 404)
+
+
+class ApiTests(ExpensesTestCase):
+    def post_batch(self, batch):
+        return self.client.post(
+            reverse("expenses:api_expense_list", args=[self.project.public_id]),
+            json.dumps(batch),
+            content_type="application/json",
+        )
+
+    def test_batch_create_update_delete(self):
+        kept = self.create_expense(self.rent, 500, spent_at=datetime.datetime(2022, 3, 5))
+        deleted = self.create_expense(self.rent, 20, spent_at=datetime.datetime(2022, 3, 6))
+        new_expenses = [
+            dict(spent_at=f"2022-03-{day:02d}T10:00", amount=day, source="Bakery", category=self.deposit.public_id)
+            for day in range(1, 21)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch(
+                dict(
+                    create=new_expenses,
+                    update=[dict(public_id=kept.public_id, amount=400, category=self.income.public_id)],
+                    delete=[deleted.public_id],
+                )
+            )
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(len(response.json()["created"]), 20)
+        # The cost depends on the touched months and categories, not on the amount of expenses
+        self.assertLess(len(queries), 40)
+
+        kept.refresh_from_db()
+        self.assertEqual((kept.amount, kept.category, kept.source), (400, self.income, "Someone"))
+        self.assertFalse(Expense.objects.filter(pk=deleted.pk).exists())
+        self.assertEqual(
+            dict(CategoryMonthTotal.objects.exclude(count=0).values_list("category_id", "total")),
+            {self.income.id: 400, self.deposit.id: sum(range(1, 21))},
+        )
+
+        response = self.client.get(reverse("expenses:api_expense_list", args=[self.project.public_id]))
+        self.assertEqual(len(response.json()["expenses"]), 21)
+
+    def test_invalid_items_are_reported_and_nothing_is_applied(self):
+        response = self.post_batch(
+            dict(
+                create=[
+                    dict(spent_at="2022-03-01T10:00", amount=1, source="Bakery", category=self.rent.public_id),
+                    dict(spent_at="yesterday", amount=1, source="Bakery", category="nope"),
+                ],
+                delete=["nope"],
+            )
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(error["operation"], error["index"], sorted(error["errors"])) for error in response.json()["errors"]],
+            [("create", 1, ["category", "spent_at"]), ("delete", 0, ["public_id"])],
+        )
+        self.assertFalse(Expense.objects.exists())
+
+    def test_batch_deletes_cost_the_same_however_many_expenses(self):
+        query_counts = list()
+        for amount in [2, 20]:
+            expenses = [
+                self.create_expense(self.rent, -day, spent_at=datetime.datetime(2022, 3, day), source="Bakery")
+                for day in range(1, amount + 1)
+            ]
+            child = self.create_expense(self.rent, -1, spent_at=datetime.datetime(2022, 3, 1))
+            child.parent = expenses[0]
+            child.save()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_batch(dict(delete=[expense.public_id for expense in expenses]))
+            self.assertEqual(len(response.json()["deleted"]), amount)
+            query_counts.append(len(queries))
+
+            child.refresh_from_db()
+            self.assertIsNone(child.parent)
+            self.assertEqual(
+                dict(CategoryMonthTotal.objects.exclude(count=0).values_list("category_id", "total")),
+                {self.rent.id: -1},
+            )
+            self.assertFalse(MerchantStat.objects.filter(source="Bakery", count__gt=0).exists())
+            child.delete()
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_posts_need_the_csrf_token_of_the_session(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        url = reverse("expenses:api_expense_list", args=[self.project.public_id])
+        body = json.dumps(
+            dict(create=[dict(spent_at="2022-03-01T10:00", amount=1, source="Kiosk", category=self.rent.public_id)])
+        )
+        self.assertEqual(client.post(url, body, content_type="application/json").status_code, 403)
+
+        # The pages of the app set it, e.g. the dashboard
+        client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        response = client.post(
+            url, body, content_type="application/json", HTTP_X_CSRFTOKEN=client.cookies["csrftoken"].value
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Expense.objects.get().amount, 1)
+
+    def test_an_expense_is_updated_once_per_batch(self):
+        expense = self.create_expense(self.rent, -10, spent_at=datetime.datetime(2022, 3, 5))
+        response = self.post_batch(
+            dict(update=[dict(public_id=expense.public_id, amount=-40), dict(public_id=expense.public_id, amount=-70)])
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(error["operation"], error["index"]) for error in response.json()["errors"]], [("update", 1)])
+        expense.refresh_from_db()
+        self.assertEqual(expense.amount, -10)
+        self.assertEqual(CategoryMonthTotal.objects.get(category=self.rent).total, -10)
+        with self.assertRaises(ValueError):
+            Expense.update_in_bulk(
+                [expense, Expense.objects.get(pk=expense.pk)], fields=["amount"], project=self.project
+            )
+
+    def test_search(self):
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 3, 1), source="Landlord")
+        newer = self.create_expense(self.rent, -20, spent_at=datetime.datetime(2022, 4, 1), source="Supermarket")
+        older = self.create_expense(self.rent, -10, spent_at=datetime.datetime(2022, 2, 1), source="Super Market")
+        in_notes = Expense.objects.create(
+            category=self.rent, amount=-5, spent_at=datetime.datetime(2022, 5, 1), source="Kiosk", notes="super cheap"
+        )
+        other_project = Project.objects.create(user=self.user, name="Work")
+        Expense.objects.create(
+            category=Category.objects.create(project=other_project, name="Food"),
+            amount=-1,
+            spent_at=datetime.datetime(2022, 3, 1),
+            source="Supermarket",
+        )
+        url = reverse("expenses:api_expense_search", args=[self.project.public_id])
+
+        response = self.client.get(url, dict(q="SUP"))
+        # Matches in the source rank above those in the notes, and the most recent come first among equal ones
+        self.assertEqual(
+            [expense["public_id"] for expense in response.json()["expenses"]],
+            [newer.public_id, older.public_id, in_notes.public_id],
+        )
+        response = self.client.get(url, dict(q="sup mark"))
+        self.assertEqual([expense["public_id"] for expense in response.json()["expenses"]], [older.public_id])
+        self.assertEqual(response.json()["expenses"][0]["category_public_id"], self.rent.public_id)
+
+        # The index follows updates and deletes
+        newer.source = "Bakery"
+        newer.save()
+        older.delete()
+        self.assertEqual(self.client.get(url, dict(q="bak")).json()["expenses"][0]["public_id"], newer.public_id)
+        self.assertEqual(
+            [expense["public_id"] for expense in self.client.get(url, dict(q="sup")).json()["expenses"]],
+            [in_notes.public_id],
+        )
+        self.assertEqual(self.client.get(url, dict(q=" ' \" ")).json()["expenses"], [])
+
+    def test_malformed_cursors_are_rejected(self):
+        url = reverse("expenses:api_expense_list", args=[self.project.public_id])
+        for cursor in ["garbage", "2022-03-01T10:00:00_nope", "yesterday_" + "0" * 32, "2022-03-01_1_2"]:
+            with self.subTest(cursor):
+                response = self.client.get(url, dict(after=cursor))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("cursor", response.json()["error"])
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.client.get(reverse("expenses:api_project_list"))
+        self.assertEqual(response.status_code, 401)
+
+
+class CategorizationTests(ExpensesTestCase):
+    def create_rule(self, category, order, **conditions):
+        return CategorizationRule.objects.create(project=self.project, category=category, order=order, **conditions)
+
+    def test_aho_corasick_finds_overlapping_substrings(self):
+        matcher = AhoCorasick(["he", "she", "his", "hers"])
+        self.assertEqual(matcher.find("ushers"), {"she", "he", "hers"})
+        self.assertEqual(matcher.find("this"), {"his"})
+        self.assertEqual(matcher.find("nothing"), set())
+
+    def test_first_matching_rule_wins(self):
+        self.create_rule(self.deposit, 1, source_contains="Landlord", amount_max=-1000)
+        self.create_rule(self.rent, 2, source_regex=r"^(landlord|agency)\b")
+        self.create_rule(self.income, 3, notes_keywords="salary bonus")
+        self.create_rule(self.mandatory, 4, amount_max=-5000)
+        classifier = Classifier.for_project(self.project)
+
+        for (source, amount, notes), category in [
+            (("Big LANDLORD Inc", -1500, ""), self.deposit),
+            (("Landlord Inc", -500, ""), self.rent),
+            (("Agency fees", -20, ""), self.rent),
+            (("Employer", 3000, "Yearly BONUS"), self.income),
+            (("Car dealer", -8000, ""), self.mandatory),
+        ]:
+            with self.subTest(source):
+                self.assertEqual(classifier.classify(source=source, amount=amount, notes=notes), category.id)
+        self.assertIsNone(classifier.classify(source="Bakery", amount=-5))
+        self.assertIsNone(Classifier([]).classify(source="Bakery", amount=-5))
+
+    def test_regexes_with_groups_dont_clash(self):
+        # Each is valid, but combined the names would repeat and \1 would point at the group of another rule
+        self.create_rule(self.rent, 1, source_regex=r"(?P<shop>bakery) (?P=shop)")
+        self.create_rule(self.deposit, 2, source_regex=r"(?P<shop>kiosk)")
+        self.create_rule(self.income, 3, source_regex=r"(\w+) and \1")
+        self.create_rule(self.mandatory, 4, source_regex=r"landlord")
+        for rule in CategorizationRule.objects.all():
+            rule.full_clean()
+        classifier = Classifier.for_project(self.project)
+
+        for source, category in [
+            ("Bakery bakery", self.rent),
+            ("Kiosk", self.deposit),
+            ("Tom and Tom", self.income),
+            ("The landlord", self.mandatory),
+        ]:
+            with self.subTest(source):
+                self.assertEqual(classifier.classify(source=source, amount=-5), category.id)
+        self.assertIsNone(classifier.classify(source="Tom and Jerry", amount=-5))
+
+    def test_invalid_rules(self):
+        for conditions in [dict(), dict(source_regex="(unclosed"), dict(amount_min=10, amount_max=0)]:
+            with self.subTest(conditions):
+                with self.assertRaises(ValidationError):
+                    CategorizationRule(project=self.project, category=self.rent, **conditions).full_clean()
+
+    def test_rules_apply_to_imports_and_api_batches(self):
+        self.create_rule(self.rent, 1, source_contains="landlord")
+        importers.import_expenses(
+            importers.parse_csv(io.StringIO("date,amount,source\n2022-03-01,-500,Landlord\n2022-03-02,-5,Bakery\n")),
+            project=self.project,
+            default_category=self.income,
+        )
+        self.assertEqual(
+            dict(Expense.objects.values_list("source", "category")), dict(Landlord=self.rent.id, Bakery=self.income.id)
+        )
+
+        response = self.client.post(
+            reverse("expenses:api_expense_list", args=[self.project.public_id]),
+            json.dumps(
+                dict(
+                    create=[
+                        dict(spent_at="2022-04-01T10:00", amount=-500, source="Landlord"),
+                        dict(spent_at="2022-04-01T10:00", amount=-5, source="Bakery"),
+                    ]
+                )
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(error["index"], list(error["errors"])) for error in response.json()["errors"]], [(1, ["category"])]
+        )
+
+    def test_recategorize_command(self):
+        landlord = self.create_expense(self.income, -500, spent_at=datetime.datetime(2022, 3, 1), source="Landlord")
+        bakery = self.create_expense(self.income, -5, spent_at=datetime.datetime(2022, 3, 2), source="Bakery")
+        self.create_rule(self.rent, 1, source_contains="landlord")
+
+        call_command("recategorize", f"--project={self.project.public_id}", "--dry-run", stdout=io.StringIO())
+        self.assertEqual(Expense.objects.get(pk=landlord.pk).category, self.income)
+
+        stdout = io.StringIO()
+        call_command("recategorize", f"--project={self.project.public_id}", "--batch-size=1", stdout=stdout)
+        self.assertIn("Successfully recategorized 1 of 2 expenses.", stdout.getvalue())
+        self.assertEqual(Expense.objects.get(pk=landlord.pk).category, self.rent)
+        self.assertEqual(Expense.objects.get(pk=bakery.pk).category, self.income)
+        self.assertEqual(
+            dict(CategoryMonthTotal.objects.exclude(count=0).values_list("category_id", "total")),
+            {self.rent.id: -500, self.income.id: -5},
+        )
+
+
+class DuplicateTests(ExpensesTestCase):
+    def import_csv(self, statement, duplicates="skip", batch_size=1000):
+        return importers.import_expenses(
+            importers.parse_csv(io.StringIO("date,amount,source,notes\n" + statement)),
+            project=self.project,
+            default_category=self.rent,
+            duplicates=duplicates,
+            batch_size=batch_size,
+        )
+
+    def test_fingerprint_ignores_the_time_and_the_source_formatting(self):
+        fingerprint = Expense.compute_fingerprint(
+            spent_at=datetime.datetime(2022, 3, 1, 10), amount=-4.5, source="Coffee Shop"
+        )
+        self.assertEqual(
+            Expense.compute_fingerprint(
+                spent_at=datetime.datetime(2022, 3, 1, 18), amount=-4.5001, source=" coffee  SHOP"
+            ),
+            fingerprint,
+        )
+        self.assertNotEqual(
+            Expense.compute_fingerprint(spent_at=datetime.datetime(2022, 3, 2), amount=-4.5, source="Coffee Shop"),
+            fingerprint,
+        )
+        self.assertEqual(
+            self.create_expense(self.rent, -4.5, datetime.datetime(2022, 3, 1), "Coffee Shop").fingerprint, fingerprint
+        )
+
+    def test_overlapping_statements_skip_the_stored_expenses(self):
+        result = self.import_csv("2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-02,-500,Landlord,\n")
+        self.assertEqual((result.created, result.duplicates), (3, 0))
+
+        # A third coffee on the same day is a new expense, the first two were already stored
+        with self.assertNumQueries(1):
+            batch = [
+                Expense(category=self.rent, spent_at=datetime.datetime(2022, 3, 1, 9), amount=-4.5, source="coffee")
+                for _ in range(3)
+            ]
+            deduplicated = duplicates.deduplicate(batch, project=self.project)
+        self.assertEqual((len(deduplicated.to_create), deduplicated.duplicates), (1, [0, 1]))
+
+        result = self.import_csv(
+            "2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-02,-500,Landlord,\n"
+        )
+        self.assertEqual((result.created, result.duplicates), (1, 3))
+        self.assertEqual(CategoryMonthTotal.objects.get(category=self.rent).total, -513.5)
+
+    def test_batches_of_an_import_dont_count_as_stored(self):
+        self.import_csv("2022-03-01,-4.5,Coffee,\n")
+        statement = (
+            "2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-02,-500,Landlord,\n"
+        )
+        for batch_size in [1000, 1]:
+            with self.subTest(batch_size=batch_size):
+                Expense.objects.exclude(pk=Expense.objects.order_by("updated_at").first().pk).delete()
+                result = self.import_csv(statement, batch_size=batch_size)
+                self.assertEqual((result.created, result.duplicates), (3, 1))
+                self.assertEqual(Expense.objects.count(), 4)
+
+    def test_flag_and_merge(self):
+        self.import_csv("2022-03-02,-500,Landlord,March\n")
+        result = self.import_csv("2022-03-02,-500,Landlord,Paid late\n", duplicates="merge")
+        self.assertEqual((result.created, result.duplicates), (0, 1))
+        self.assertEqual(Expense.objects.get().notes, "March\nPaid late")
+
+        result = self.import_csv("2022-03-02,-500,Landlord,\n", duplicates="flag")
+        self.assertEqual((result.created, result.duplicates), (1, 1))
+        self.assertEqual(
+            list(Expense.objects.order_by("possible_duplicate").values_list("possible_duplicate", flat=True)),
+            [False, True],
+        )
+
+    def test_api_batches_report_the_duplicates(self):
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 3, 2), source="Landlord")
+        response = self.client.post(
+            reverse("expenses:api_expense_list", args=[self.project.public_id]),
+            json.dumps(
+                dict(
+                    create=[
+                        dict(spent_at="2022-03-02T10:00", amount=-5, source="Bakery", category=self.rent.public_id),
+                        dict(spent_at="2022-03-02T10:00", amount=-500, source="Landlord", category=self.rent.public_id),
+                    ]
+                )
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((len(response.json()["created"]), response.json()["duplicates"]), (1, [1]))
+
+    def test_find_duplicates_command(self):
+        self.import_csv("2022-03-01,-4.5,Coffee,\n2022-03-01,-4.5,Coffee,\n2022-03-02,-500,Landlord,\n", "allow")
+        self.import_csv("2022-03-01,-4.5,Coffee,\n2022-03-02,-500,Landlord,\n", "allow")
+
+        stdout = io.StringIO()
+        call_command("find_duplicates", f"--project={self.project.public_id}", stdout=stdout)
+        self.assertIn("3 times: $-4.5 at Coffee on 2022-03-01", stdout.getvalue())
+        self.assertIn("Found 3 duplicates in 2 groups.", stdout.getvalue())
+
+        call_command("find_duplicates", f"--project={self.project.public_id}", "--delete", stdout=io.StringIO())
+        self.assertEqual(Expense.objects.count(), 2)
+        self.assertEqual(CategoryMonthTotal.objects.get(category=self.rent).total, -504.5)
+
+
+class RecurringExpenseTests(ExpensesTestCase):
+    def create_schedule(self, **kwargs):
+        defaults = dict(category=self.rent, amount=-500, source="Landlord", starts_at=datetime.datetime(2022, 1, 31, 9))
+        return RecurringExpense.objects.create(project=self.project, **{**defaults, **kwargs})
+
+    def test_occurrences(self):
+        schedule = self.create_schedule()
+        self.assertEqual(
+            [
+                o.date()
+                for o in schedule.generate_occurrences(datetime.datetime(2022, 2, 1), datetime.datetime(2022, 6, 1))
+            ],
+            [datetime.date(2022, m, d) for m, d in [(2, 28), (3, 31), (4, 30), (5, 31)]],
+        )
+        schedule = self.create_schedule(frequency="weekly", interval=2, ends_at=datetime.datetime(2022, 3, 1))
+        self.assertEqual(
+            [
+                o.date()
+                for o in schedule.generate_occurrences(datetime.datetime(2022, 2, 10), datetime.datetime(2023, 1, 1))
+            ],
+            [datetime.date(2022, 2, 14), datetime.date(2022, 2, 28)],
+        )
+        schedule = self.create_schedule(frequency="yearly", starts_at=datetime.datetime(2020, 2, 29))
+        self.assertEqual(
+            [
+                o.date()
+                for o in schedule.generate_occurrences(datetime.datetime(2019, 1, 1), datetime.datetime(2022, 3, 1))
+            ],
+            [datetime.date(2020, 2, 29), datetime.date(2021, 2, 28), datetime.date(2022, 2, 28)],
+        )
+
+    def test_materialize_is_idempotent(self):
+        schedule = self.create_schedule()
+        self.create_schedule(
+            category=self.income, amount=2000, source="Salary", starts_at=datetime.datetime(2022, 1, 1)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(recurring.materialize(until=datetime.datetime(2022, 4, 1)), 6)
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "expenses_expense"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(recurring.materialize(until=datetime.datetime(2022, 4, 1)), 0)
+        self.assertEqual(recurring.materialize(until=datetime.datetime(2022, 3, 1)), 0)
+        self.assertEqual(
+            list(schedule.expenses.order_by("spent_at").values_list("spent_at", flat=True)),
+            [datetime.datetime(2022, 1, 31, 9), datetime.datetime(2022, 2, 28, 9), datetime.datetime(2022, 3, 31, 9)],
+        )
+        self.assertEqual(
+            CategoryMonthTotal.objects.get(category=self.rent, month=datetime.date(2022, 3, 1)).total, -500
+        )
+
+        # Moving a schedule back creates its earlier occurrences, but not the others twice
+        schedule.refresh_from_db()
+        schedule.starts_at = datetime.datetime(2021, 10, 31, 9)
+        schedule.save()
+        self.assertIsNone(schedule.materialized_until)
+        # Its 4 missing occurrences, and the April one of the other schedule
+        self.assertEqual(recurring.materialize(until=datetime.datetime(2022, 5, 1)), 5)
+        self.assertEqual(
+            list(schedule.expenses.order_by("spent_at").values_list("spent_at", flat=True)),
+            [
+                datetime.datetime(year, month, day, 9)
+                for year, month, day in [(2021, 10, 31), (2021, 11, 30), (2021, 12, 31), (2022, 1, 31), (2022, 2, 28)]
+                + [(2022, 3, 31), (2022, 4, 30)]
+            ],
+        )
+        # Other edits keep the watermark
+        schedule.refresh_from_db()
+        schedule.amount = -600
+        schedule.save()
+        self.assertEqual(RecurringExpense.objects.get(pk=schedule.pk).materialized_until, datetime.datetime(2022, 5, 1))
+
+    def test_materialize_command(self):
+        self.create_schedule(frequency="daily", starts_at=timezone.now() - datetime.timedelta(days=2, hours=1))
+        stdout = io.StringIO()
+        call_command("materialize_recurring_expenses", "--horizon-days=1", stdout=stdout)
+        self.assertIn("Successfully created 4 expenses", stdout.getvalue())
+        self.assertEqual(Expense.objects.count(), 4)
+
+    def test_projected_periods(self):
+        now = timezone.now()
+        self.create_schedule(starts_at=now - datetime.timedelta(days=90))
+        recurring.materialize(until=now)
+        expense_count = Expense.objects.count()
+
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]), {"projected": 3})
+        projected_rows = response.context["projected_rows"]
+        self.assertEqual(len(projected_rows), 3)
+        for period, values in projected_rows:
+            self.assertTrue(period.name.endswith(" (projected)"))
+            self.assertEqual(values[-1].amount, -500)
+            self.assertEqual(values[1].amount, -500)
+        # The future periods come after the ones shown, and nothing is written
+        self.assertEqual(projected_rows[0][0].period_start, response.context["value_rows"][-1][0].period_end)
+        self.assertEqual(Expense.objects.count(), expense_count)
+        self.assertNotIn("projected=", response.context["projection_link"])
+
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        self.assertEqual(response.context["projected_rows"], [])
+        self.assertIn("projected=6", response.context["projection_link"])
+
+
+class BudgetTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        for category, budget in [(self.rent, 500), (self.deposit, 100)]:
+            category.monthly_budget = budget
+            category.save()
+
+    def test_budgets_roll_up_to_the_parents_without_one(self):
+        Category.objects.filter(pk=self.income.pk).update(monthly_budget=3000)
+        self.assertEqual(
+            budgets.roll_up_budgets(Category.objects.filter(project=self.project)),
+            {self.income.id: 3000, self.mandatory.id: 500, self.rent.id: 500, self.deposit.id: 100},
+        )
+
+    def test_creating_an_expense_warns_of_the_exceeded_budgets(self):
+        self.create_expense(self.rent, 420, datetime.datetime(2022, 3, 1))
+        url = reverse("expenses:expense_create", args=[self.project.public_id])
+        data = dict(spent_at="2022-03-15 10:00", amount=120, source="Plumber", category=self.deposit.pk, notes="")
+
+        with self.assertNumQueries(2):
+            exceeded = budgets.get_exceeded_budgets(category=self.deposit, month=datetime.date(2022, 3, 1))
+        self.assertEqual(exceeded, [])
+        response = self.client.post(url, data, follow=True)
+        self.assertEqual(
+            [str(message) for message in response.context["messages"]],
+            [
+                "Deposit is over its budget for Mar 2022: 120.00€ of 100.00€.",
+                "Rent is over its budget for Mar 2022: 540.00€ of 500.00€.",
+                "Mandatory is over its budget for Mar 2022: 540.00€ of 500.00€.",
+            ],
+        )
+        response = self.client.post(url, dict(data, spent_at="2022-04-15 10:00", amount=50), follow=True)
+        self.assertEqual(list(response.context["messages"]), [])
+
+    def test_dashboard_shows_the_budgets_at_no_query_cost(self):
+        self.create_expense(self.deposit, 150)
+        with self.assertNumQueries(2):
+            value_rows = _generate_value_rows(project=self.project, periods=_generate_periods(amount=2))
+        _, values = value_rows[-1]
+        self.assertEqual(
+            [(value.amount, value.budget, value.is_over_budget) for value in values],
+            [
+                (0, None, False),
+                (150, 500, False),
+                (150, 500, False),
+                (150, 100, True),
+                (0, None, False),
+                (0, None, False),
+                (150, None, False),
+            ],
+        )
+        self.assertContains(
+            self.client.get(reverse("expenses:project_detail", args=[self.project.public_id])), "/ 100.00€"
+        )
+
+        # Budgets are per month, the periods scale them
+        value_rows = _generate_value_rows(
+            project=self.project,
+            periods=_generate_periods(amount=1, granularity=Granularity("quarter")),
+            granularity=Granularity("quarter"),
+        )
+        self.assertEqual(value_rows[-1][1][1].budget, 1500)
+
+
+class MerchantTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        merchant_indexes.clear()
+        self.url = reverse("expenses:merchant_list", args=[self.project.public_id])
+
+    def get_suggestions(self, query):
+        return [
+            (merchant["source"], merchant["count"], merchant["category"])
+            for merchant in self.client.get(self.url, dict(q=query)).json()["merchants"]
+        ]
+
+    def test_stats_follow_the_writes(self):
+        today = timezone.now()
+        first = self.create_expense(self.rent, -500, spent_at=today - datetime.timedelta(days=40), source="Landlord")
+        self.create_expense(self.deposit, -100, spent_at=today - datetime.timedelta(days=10), source=" landlord ")
+        Expense.create_in_bulk(
+            [Expense(category=self.income, amount=1000, spent_at=today, source="Payroll")], project=self.project
+        )
+        self.assertEqual(
+            list(MerchantStat.objects.order_by("normalized_source").values_list("normalized_source", "count")),
+            [("landlord", 2), ("payroll", 1)],
+        )
+        landlord = MerchantStat.objects.get(normalized_source="landlord")
+        self.assertEqual((landlord.source, landlord.category), (" landlord ", self.deposit))
+
+        first.source = "Payroll"
+        first.save()
+        Expense.objects.filter(source=" landlord ").delete()
+        self.assertEqual(
+            list(MerchantStat.objects.order_by("normalized_source").values_list("normalized_source", "count")),
+            [("landlord", 0), ("payroll", 2)],
+        )
+
+    def test_suggestions_rank_by_frequency_and_recency(self):
+        today = timezone.now()
+        for days in [400, 410, 420]:
+            self.create_expense(self.rent, -5, spent_at=today - datetime.timedelta(days=days), source="McFlurry")
+        self.create_expense(self.rent, -5, spent_at=today - datetime.timedelta(days=2), source="McDonalds")
+        self.create_expense(self.deposit, -5, spent_at=today - datetime.timedelta(days=1), source="mcdonalds")
+        self.create_expense(self.rent, -5, spent_at=today, source="Landlord")
+
+        # Twice today beats three times a year ago, and the category is the one of the last use
+        self.assertEqual(
+            self.get_suggestions(" MC"), [("mcdonalds", 2, str(self.deposit.pk)), ("McFlurry", 3, str(self.rent.pk))]
+        )
+        self.assertEqual(self.get_suggestions("mcf"), [("McFlurry", 3, str(self.rent.pk))])
+        self.assertEqual(self.get_suggestions("zzz"), [])
+
+    def test_suggestions_are_served_from_memory(self):
+        self.create_expense(self.rent, -5, source="McDonalds")
+        self.get_suggestions("m")
+        with self.assertNumQueries(3):  # The session, the user and the project
+            self.assertEqual(len(self.get_suggestions("mc")), 1)
+
+        self.create_expense(self.rent, -5, source="McFlurry")
+        self.assertEqual(len(self.get_suggestions("mc")), 2)
+
+
+class ProjectCubeTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        cubes.clear()
+        self.periods = Granularity().generate_periods(amount=3, to_datetime=datetime.datetime(2022, 3, 1))
+
+    def get_cube(self) -> ProjectCube:
+        self.project.refresh_from_db()
+        return cubes.get(self.project)
+
+    def test_period_totals_match_the_rollups(self):
+        self.create_expense(self.income, 1000, spent_at=datetime.datetime(2022, 1, 31, 23))
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1))
+        self.create_expense(self.deposit, -100, spent_at=datetime.datetime(2022, 3, 15))
+        self.create_expense(self.deposit, -7, spent_at=datetime.datetime(2022, 4, 1))
+
+        cube = self.get_cube()
+        totals = cube.get_period_totals(self.periods)
+        rollups = CategoryMonthTotal.objects.filter(month__lt=datetime.datetime(2022, 4, 1))
+        for category_id, month, total in rollups.values_list("category_id", "month", "total"):
+            period_index = [start.date() for start, _ in self.periods].index(month)
+            self.assertEqual(totals[period_index, cube.category_indexes[category_id]], total)
+
+        subtree_totals = cube.get_subtree_totals(totals, children_by_parent=Category.build_tree(project=self.project))
+        self.assertEqual(list(subtree_totals[self.mandatory.id]), [0, -500, -100])
+        self.assertEqual(list(subtree_totals[self.income.id]), [1000, 0, 0])
+
+    def test_refresh_merges_new_and_updated_expenses(self):
+        expense = self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1))
+        cube = self.get_cube()
+
+        self.create_expense(self.deposit, -100, spent_at=datetime.datetime(2022, 3, 15))
+        expense.amount = -450
+        Expense.update_in_bulk([expense], fields=["amount"], project=self.project)
+        with self.assertNumQueries(3):
+            refreshed = self.get_cube()
+        self.assertIs(refreshed, cube)
+        self.assertEqual(len(cube.row_indexes), 2)
+        self.assertEqual(cube.get_period_totals(self.periods).sum(axis=1).tolist(), [0, -450, -100])
+
+        with self.assertNumQueries(1):
+            self.assertIs(self.get_cube(), cube)
+
+    def test_deleted_expenses_reload_the_cube(self):
+        expense = self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1))
+        cube = self.get_cube()
+        expense.delete()
+        reloaded = self.get_cube()
+        self.assertIsNot(reloaded, cube)
+        self.assertEqual(reloaded.get_period_totals(self.periods).sum(), 0)
+
+    def test_least_recently_used_cubes_are_evicted(self):
+        other_project = Project.objects.create(user=self.user, name="Work")
+        Expense.objects.create(
+            category=Category.objects.create(project=other_project, name="Salary"),
+            amount=10,
+            spent_at=datetime.datetime(2022, 2, 1),
+            source="Someone",
+        )
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1))
+        cache = CubeCache(max_bytes=ProjectCube.load(self.project).nbytes)
+        cube = cache.get(self.project)
+        cache.get(other_project)
+        self.assertIsNot(cache.get(self.project), cube)
+
+    def test_top_sources(self):
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1), source="Landlord")
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 3, 1), source="Landlord")
+        self.create_expense(self.deposit, -700, spent_at=datetime.datetime(2022, 2, 1), source="Agency")
+        self.create_expense(self.income, 800, spent_at=datetime.datetime(2022, 2, 1), source="Employer")
+        cube = self.get_cube()
+        from_datetime, to_datetime = self.periods[0][0], self.periods[-1][1]
+
+        self.assertEqual(
+            cube.get_top_sources(from_datetime=from_datetime, to_datetime=to_datetime, limit=2),
+            [("Landlord", -1000, 2), ("Employer", 800, 1)],
+        )
+        self.assertEqual(
+            cube.get_top_sources(
+                from_datetime=from_datetime, to_datetime=to_datetime, category_ids=[self.deposit.id, self.income.id]
+            ),
+            [("Employer", 800, 1), ("Agency", -700, 1)],
+        )
+
+    def test_slice_endpoint(self):
+        self.create_expense(self.rent, -500, spent_at=datetime.datetime(2022, 2, 1), source="Landlord")
+        self.create_expense(self.deposit, -100, spent_at=datetime.datetime(2022, 3, 15), source="Agency")
+        self.create_expense(self.income, 1000, spent_at=datetime.datetime(2022, 3, 1), source="Employer")
+        url = reverse("expenses:api_project_slice", args=[self.project.public_id])
+
+        response = self.client.get(url, dict(category=self.mandatory.public_id, periods=3, to="2022-03-01"))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([period["name"] for period in data["periods"]], ["Jan 2022", "Feb 2022", "Mar 2022"])
+        self.assertEqual(data["totals"], [0, -500, -100])
+        self.assertEqual([(child["name"], child["totals"]) for child in data["children"]], [("Rent", [0, -500, -100])])
+        self.assertEqual([source["source"] for source in data["top_sources"]], ["Landlord", "Agency"])
+
+        response = self.client.get(url, dict(periods=3, to="2022-03-01"))
+        self.assertEqual(response.json()["totals"], [0, -500, 900])
+        self.assertEqual(len(response.json()["children"]), 2)
+
+        self.assertEqual(self.client.get(url, dict(category="nope")).status_code, 404)
+        self.assertEqual(self.client.get(url, dict(granularity="decade")).status_code, 400)
+        # Going back from the lower date bound passes the first year there is
+        self.assertEqual(self.client.get(url, dict(periods=3, to="0001-01-05")).status_code, 400)
+        self.assertEqual(self.client.get(url, dict(granularity="week", to="0001-01-05")).status_code, 400)
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "The query plans are checked against SQLite")
+class ExpenseIndexTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.window = dict(spent_at__gte=datetime.datetime(2022, 1, 1), spent_at__lt=datetime.datetime(2022, 7, 1))
+
+    def test_expenses_follow_the_project_of_their_category(self):
+        expense = self.create_expense(self.rent, 500)
+        self.assertEqual(expense.project, self.project)
+
+        other_project = Project.objects.create(user=self.user, name="Work")
+        self.rent.project = other_project
+        self.rent.save()
+        expense.refresh_from_db()
+        self.assertEqual(expense.project, other_project)
+
+    def test_project_aggregations_only_read_the_covering_index(self):
+        plan = (
+            Expense.objects.filter(project=self.project, **self.window)
+            .annotate(month=TruncMonth("spent_at"))
+            .values("category_id", "month")
+            .annotate(total=Sum("amount"))
+            .explain()
+        )
+        self.assertIn(
+            "USING COVERING INDEX expense_project_spent_at (project_id=? AND spent_at>? AND spent_at<?)", plan
+        )
+
+    def test_project_listings_are_range_scans(self):
+        plan = Expense.objects.filter(project=self.project, **self.window).order_by("spent_at", "id").explain()
+        self.assertIn("USING INDEX expense_project_spent_at (project_id=? AND spent_at>? AND spent_at<?)", plan)
+
+    def test_category_listings_are_range_scans(self):
+        plan = Expense.objects.filter(category=self.rent, **self.window).values("amount").explain()
+        self.assertIn("USING INDEX expense_category_spent_at (category_id=? AND spent_at>? AND spent_at<?)", plan)
+
+
+class BenchmarkTests(TestCase):
+    def test_generate_synthetic_data_and_benchmark(self):
+        call_command(
+            "generate_synthetic_data", "--depth=2", "--fan-out=2", "--expenses-per-month=3", stdout=io.StringIO()
+        )
+        project = Project.objects.get()
+        self.assertEqual(project.categories.count(), 6)
+        self.assertEqual(project.expenses.count(), 3 * 24)
+
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = f"{directory}/baseline.json"
+            call_command("benchmark", "--repeat=1", f"--baseline={baseline}", "--save-baseline", stdout=io.StringIO())
+            with open(baseline, encoding="utf-8") as file:
+                measurements = json.load(file)
+            self.assertIn("project_detail_warm", measurements)
+
+            for measurement in measurements.values():
+                measurement["queries"] = 0
+            with open(baseline, "w", encoding="utf-8") as file:
+                json.dump(measurements, file)
+            with self.assertRaisesMessage(CommandError, "Performance regressed over the baseline"):
+                call_command("benchmark", "--repeat=1", f"--baseline={baseline}", stdout=io.StringIO())
+
+
+class TimingMiddlewareTests(ExpensesTestCase):
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("expenses:expense_list", args=[self.project.public_id]))
+        self.assertRegex(
+            response["Server-Timing"], r'^db;dur=[\d.]+;desc="6 queries", tpl;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_query_budget(self):
+        url = reverse("expenses:project_detail", args=[self.project.public_id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch.object(views.project_detail, "query_budget", 2):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(url)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_query_budget_is_logged_in_production(self):
+        url = reverse("expenses:project_detail", args=[self.project.public_id])
+        with mock.patch.object(views.project_detail, "query_budget", 2):
+            with self.assertLogs("helpers.middleware", "WARNING"):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class QueryLogTests(ExpensesTestCase):
+    def test_fingerprints_ignore_the_values(self):
+        self.assertEqual(
+            fingerprint_sql("SELECT * FROM t WHERE a = 'x''s' AND b IN (%s, %s, %s) LIMIT 21"),
+            fingerprint_sql("SELECT *\n  FROM t WHERE a = 'y' AND b IN (%s) LIMIT 1"),
+        )
+        _, normalized = fingerprint_sql("INSERT INTO t2 (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)")
+        self.assertEqual(normalized, "INSERT INTO t2 (a, b) VALUES (?, ?), ...")
+
+    def test_slow_queries_are_sampled_with_their_view_and_location(self):
+        self.create_expense(self.rent, 500)
+        with tempfile.TemporaryDirectory() as directory:
+            query_log = QueryLog(f"{directory}/query_log.sqlite3", slow_threshold_ms=0)
+            with connection.execute_wrapper(query_log):
+                self.client.get(reverse("expenses:expense_list", args=[self.project.public_id]))
+                self.client.get(reverse("expenses:expense_list", args=[self.project.public_id]))
+            query_log.flush()
+
+            top = query_log.get_top(order_by="count")
+            fingerprint, stats = next((key, stats) for key, stats in top if 'FROM "expenses_expense"' in stats.sql)
+            self.assertEqual(stats.count, 2)
+            self.assertLessEqual(stats.get_percentile_ms(95), stats.max_ms)
+            slow_query = query_log.get_slowest(fingerprint)[0]
+            self.assertEqual(slow_query.view, "expenses:expense_list")
+            self.assertRegex(slow_query.location, r"^expenses/views\.py:\d+ in expense_list$")
+
+            stdout = io.StringIO()
+            call_command("query_stats", path=query_log.path, order_by="count", reset=True, stdout=stdout)
+            self.assertIn(f"[{fingerprint}] 2 queries", stdout.getvalue())
+            self.assertEqual(query_log.get_top(), [])
+
+
+class MetricsTests(ExpensesTestCase):
+    def test_histograms_are_cumulative(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram("test_seconds", "Test", labelnames=["view"], buckets=[0.1, 1], registry=registry)
+        for amount in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(amount, view='a"b')
+
+        self.assertEqual(
+            registry.render().splitlines(),
+            [
+                "# HELP test_seconds Test",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{view="a\\"b",le="0.1"} 2',
+                'test_seconds_bucket{view="a\\"b",le="1"} 3',
+                'test_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+                'test_seconds_sum{view="a\\"b"} 2.65',
+                'test_seconds_count{view="a\\"b"} 4',
+            ],
+        )
+
+    def test_worker_processes_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            registries = [metrics.Registry(), metrics.Registry()]
+            for i, registry in enumerate(registries):
+                # Each registry plays the role of a different worker process
+                registry._filename = f"metrics-{i}.json"  # pylint: disable=protected-access
+                metrics.Counter("test_total", "Test", registry=registry).inc(i + 1)
+            registries[1].dump()
+
+            self.assertIn("test_total 3\n", registries[0].render())
+
+    @override_settings(METRICS_TOKEN="token")
+    def test_metrics_view(self):
+        self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+        self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]))
+
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer token")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            response, 'cashflow_requests_total{view="expenses:project_detail",method="GET",status="200"}'
+        )
+        self.assertContains(response, 'cashflow_request_duration_seconds_bucket{view="expenses:project_detail"')
+        self.assertContains(response, 'cashflow_cache_requests_total{cache="dashboard",result="hit"}')
+
+
+class ProfilerTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profiles_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.profiles_dir.cleanup)
+        # The sampling interval is shorter than usual to get samples out of a fast test request
+        self.settings_override = override_settings(PROFILES_DIR=self.profiles_dir.name, PROFILE_SAMPLE_INTERVAL=0.0001)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_only_staff_can_profile(self):
+        response = self.client.get(reverse("expenses:project_detail", args=[self.project.public_id]), {"_profile": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile", response)
+        self.assertEqual(self.client.get(reverse("profile_list")).status_code, 302)
+
+    def test_profiles_can_be_downloaded(self):
+        self.user.is_staff = True
+        self.user.save()
+        url = reverse("expenses:project_detail", args=[self.project.public_id])
+
+        response = self.client.get(url, {"_profile": "cprofile"})
+        self.assertRegex(response["X-Profile"], r"/profiles/\d{8}-\d{6}-\w{8}-expenses:project_detail\.prof$")
+        response = self.client.get(url, HTTP_X_PROFILE="sample")
+        folded_url = response["X-Profile"]
+        self.assertTrue(folded_url.endswith(".folded"))
+
+        response = self.client.get(folded_url)
+        self.assertEqual(response.status_code, 200)
+        folded = b"".join(response.streaming_content).decode()
+        self.assertRegex(folded, r"^\S.* \(helpers/profiling\.py:\d+\);.* \d+\n")
+        self.assertContains(self.client.get(reverse("profile_list")), "expenses:project_detail.prof")
+        self.assertEqual(self.client.get(reverse("profile_download", args=["settings.py"])).status_code, 404)
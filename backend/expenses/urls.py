@@ -1,6 +1,19 @@
 from django.urls import path
 
-from expenses.views import expense_create, expense_detail, expense_list, project_create, project_detail, project_list
+from expenses.api import api_category_list, api_expense_list, api_expense_search, api_project_list, api_project_slice
+from expenses.views import (
+    expense_create,
+    expense_detail,
+    expense_export,
+    expense_import,
+    expense_list,
+    merchant_list,
+    project_create,
+    project_detail,
+    project_export,
+    project_list,
+    project_rows,
+)
 
 app_name = "expenses"
 urlpatterns = [
@@ -8,7 +21,17 @@ urlpatterns = [
     path("", project_list, name="project_list"),
     path("projects/new/", project_create, name="project_create"),
     path("p/<str:project_public_id>/", project_detail, name="project_detail"),
+    path("p/<str:project_public_id>/export/", project_export, name="project_export"),
+    path("p/<str:project_public_id>/rows/", project_rows, name="project_rows"),
     path("p/<str:project_public_id>/e/", expense_list, name="expense_list"),
     path("p/<str:project_public_id>/e/new/", expense_create, name="expense_create"),
+    path("p/<str:project_public_id>/e/import/", expense_import, name="expense_import"),
+    path("p/<str:project_public_id>/e/export/", expense_export, name="expense_export"),
+    path("p/<str:project_public_id>/merchants/", merchant_list, name="merchant_list"),
     path("p/<str:project_public_id>/e/<str:expense_public_id>/", expense_detail, name="expense_detail"),
+    path("api/projects/", api_project_list, name="api_project_list"),
+    path("api/p/<str:project_public_id>/categories/", api_category_list, name="api_category_list"),
+    path("api/p/<str:project_public_id>/expenses/", api_expense_list, name="api_expense_list"),
+    path("api/p/<str:project_public_id>/expenses/search/", api_expense_search, name="api_expense_search"),
+    path("api/p/<str:project_public_id>/slice/", api_project_slice, name="api_project_slice"),
 ]
@@ -1,23 +1,41 @@
+import csv
 import datetime
+import io
+import itertools
+import json
 import logging
 import typing
 import urllib.parse
-from dataclasses import dataclass
+import uuid
 
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.http import HttpRequest, HttpResponseRedirect
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.http import Http404, HttpRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.utils import timezone
 
 from auth.models import User
-from expenses.forms import CreateExpenseFormInline, ProjectCreateForm, UpdateExpenseForm
-from expenses.models import Category, Expense, Project
+from expenses import budgets, recurring
+from expenses.forms import CreateExpenseFormInline, ExpenseImportForm, ProjectCreateForm, UpdateExpenseForm
+from expenses.importers import DEFAULT_CSV_COLUMNS, PARSERS, InvalidStatement, import_expenses
+from expenses.merchants import merchant_indexes
+from expenses.models import Category, CategoryMonthTotal, Expense, Project
+from expenses.periods import GRANULARITIES, MAX_AMOUNT, MONTHLY, Granularity
+from helpers import metrics
+from helpers.timing import query_budget
 
 logger = logging.getLogger(__name__)
 
 DATE_FORMAT = "%Y-%m-%d"
+DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+EXPENSE_LIST_PAGE_SIZE = 200
+MERCHANT_SUGGESTIONS = 10
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ["public_id", "spent_at", "amount", "source", "notes", "category__public_id", "category__name"]
 
 
 class AuthenticatedHttpRequest(HttpRequest):
@@ -53,10 +71,34 @@ def project_create(request: AuthenticatedHttpRequest):
 
 
 @login_required
+@query_budget(15)
 def project_detail(request: AuthenticatedHttpRequest, project_public_id: str):
     project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
-    header_rows = _generate_header_rows(project=project)
-    value_rows = _generate_value_rows(project=project)
+    granularity = _get_granularity(request)
+    periods = _generate_periods(amount=_get_period_amount(request, granularity), granularity=granularity)
+    header_rows, value_rows = _get_dashboard_rows(project=project, periods=periods, granularity=granularity)
+    older_rows_link = _get_older_rows_link(
+        project=project, before=periods[0][0], granularity=granularity, amount=len(periods)
+    )
+    # The periods after the last one shown, as the recurring expenses would fill them. Computed on every request and
+    # never cached, as editing a schedule doesn't change the data version
+    projected_amount = _get_projected_amount(request)
+    projected_rows = list()
+    if projected_amount:
+        projected_periods = _generate_periods(
+            amount=projected_amount,
+            granularity=granularity,
+            to_datetime=granularity.shift(periods[-1][0], projected_amount),
+        )
+        projected_rows = _generate_value_rows(
+            project=project,
+            periods=projected_periods,
+            granularity=granularity,
+            extra_amounts=recurring.project_amounts(project=project, periods=projected_periods),
+        )
+    projection_query_args = {key: value for key, value in request.GET.items() if key != "projected"}
+    if not projected_amount:
+        projection_query_args["projected"] = str(granularity.default_amount)
 
     create_expense_form_inline = CreateExpenseFormInline(project=project)
     next_query_arg = urllib.parse.urlencode(dict(next=request.get_full_path()))
@@ -70,59 +112,158 @@ def project_detail(request: AuthenticatedHttpRequest, project_public_id: str):
         dict(
             header_rows=header_rows,
             value_rows=value_rows,
+            projected_rows=projected_rows,
+            projection_link="?" + urllib.parse.urlencode(projection_query_args),
             project=project,
             create_expense_form_inline=create_expense_form_inline,
+            older_rows_link=older_rows_link,
+            granularity=granularity,
+            granularity_links=[
+                (
+                    name.capitalize(),
+                    "?" + urllib.parse.urlencode(Granularity(name, fiscal_start=granularity.fiscal_start).query_args),
+                )
+                for name in GRANULARITIES
+            ],
         ),
     )
 
 
 @login_required
+@query_budget(6)
+def project_rows(request: AuthenticatedHttpRequest, project_public_id: str):
+    # The dashboard rows of the periods before the ones already shown, for the dashboard to load them lazily
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    granularity = _get_granularity(request)
+    amount = _get_period_amount(request, granularity)
+    try:
+        before = granularity.truncate(datetime.datetime.strptime(request.GET.get("before", ""), DATE_FORMAT))
+    except ValueError as exc:
+        raise Http404(f"{request.GET.get('before')!r} doesn't match the date format {DATE_FORMAT!r}") from exc
+    try:
+        periods = _generate_periods(amount=amount, granularity=granularity, to_datetime=granularity.shift(before, -1))
+    except (ValueError, OverflowError) as exc:
+        # Going back from an early date can pass the first year there is
+        raise Http404(f"There are no periods before {request.GET.get('before')!r}") from exc
+    value_rows = _get_value_rows(project=project, periods=periods, granularity=granularity)
+    older_rows_link = _get_older_rows_link(
+        project=project, before=periods[0][0], granularity=granularity, amount=amount
+    )
+
+    if request.GET.get("format") == "json":
+        return JsonResponse(
+            dict(
+                rows=[
+                    dict(
+                        name=period.name,
+                        period_start=period.period_start.strftime(DATE_FORMAT),
+                        period_end=period.period_end.strftime(DATE_FORMAT),
+                        link=period.link,
+                        values=[
+                            dict(amount=value.amount, name=value.name, link=value.link, budget=value.budget)
+                            for value in values
+                        ],
+                    )
+                    for period, values in value_rows
+                ],
+                older_rows_link=older_rows_link,
+            )
+        )
+    response = render(request, "expenses/project_rows.html", dict(value_rows=value_rows))
+    response["X-Older-Rows"] = older_rows_link or ""
+    return response
+
+
+@login_required
+@query_budget(10)
 def expense_list(request: AuthenticatedHttpRequest, project_public_id: str):
     project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
-    base_filter_args = [Q(category__project=project)]
+    base_filter_args = [Q(project=project)]
     arg_category = request.GET.get("category")
     arg_show_children = request.GET.get("show_children")
+    category = None
     if arg_category:
-        if arg_show_children and arg_show_children.lower() == "true":
-            base_filter_args.append(Q(category__public_id=arg_category) | Q(category__parent__public_id=arg_category))
+        category = Category.objects.filter(project=project, public_id=arg_category).first()
+        if category and arg_show_children and arg_show_children.lower() == "true":
+            base_filter_args.append(Q(category__path__startswith=category.path))
         else:
             base_filter_args.append(Q(category__public_id=arg_category))
-    arg_from = request.GET.get("from")
-    from_datetime = None
-    if arg_from:
-        from_datetime = datetime.datetime.strptime(arg_from, DATE_FORMAT)
-    arg_to = request.GET.get("to")
-    to_datetime = None
-    if arg_to:
-        to_datetime = datetime.datetime.strptime(arg_to, DATE_FORMAT)
-
-    periods_expenses = list()
-    periods = _generate_periods(amount=6, from_datetime=from_datetime, to_datetime=to_datetime)
-    for period_start, period_end in periods:
-        filter_kwargs = dict(
-            spent_at__gte=from_datetime if from_datetime and from_datetime > period_start else period_start,
-            spent_at__lt=to_datetime if to_datetime and to_datetime < period_end else period_end,
-        )
-        expenses = Expense.objects.filter(*base_filter_args, **filter_kwargs).order_by("spent_at").all()
-        if not expenses:
-            continue
+    from_datetime = _get_date(request, "from")
+    to_datetime = _get_date(request, "to")
+
+    granularity = _get_granularity(request)
+    periods = _generate_periods(
+        amount=_get_period_amount(request, granularity),
+        granularity=granularity,
+        from_datetime=from_datetime,
+        to_datetime=to_datetime,
+    )
+    filter_kwargs = dict(
+        spent_at__gte=max(from_datetime, periods[0][0]) if from_datetime else periods[0][0],
+        spent_at__lt=min(to_datetime, periods[-1][1]) if to_datetime else periods[-1][1],
+    )
+    # Keyset pagination: the cursor is the (spent_at, id) of the last expense shown, plus its number in the period
+    arg_after = request.GET.get("after")
+    after_number = 0
+    after_period_start = None
+    if arg_after:
+        try:
+            after_spent_at, after_id_, after_number_ = arg_after.split("_")
+            after_datetime = datetime.datetime.fromisoformat(after_spent_at)
+            after_id = uuid.UUID(after_id_)
+            after_number = int(after_number_)
+        except ValueError as exc:
+            raise Http404(f"{arg_after!r} isn't a cursor") from exc
+        after_period_start = granularity.truncate(after_datetime)
+        base_filter_args.append(Q(spent_at__gt=after_datetime) | Q(spent_at=after_datetime, id__gt=after_id))
+
+    expenses = list(
+        Expense.objects.filter(*base_filter_args, **filter_kwargs)
+        .order_by("spent_at", "id")
+        .values(
+            "id",
+            "public_id",
+            "spent_at",
+            "amount",
+            "source",
+            "notes",
+            "possible_duplicate",
+            category_name=F("category__name"),
+        )[: EXPENSE_LIST_PAGE_SIZE + 1]
+    )
+    load_more_query = None
+    if len(expenses) > EXPENSE_LIST_PAGE_SIZE:
+        expenses = expenses[:EXPENSE_LIST_PAGE_SIZE]
+        load_more_query = request.GET.copy()
+
+    periods_expenses: list[dict[str, typing.Any]] = list()
+    number = 0
+    for period_start, expenses_of_the_period in itertools.groupby(
+        expenses, key=lambda e: granularity.truncate(e["spent_at"])
+    ):
+        # The first period may continue the last one of the previous page
+        number = after_number if period_start == after_period_start else 0
         period_expenses = list()
-        for a, expense in enumerate(expenses):
-            period_expenses.append(dict(number=a + 1, expense=expense, expense_amount="%.2f€" % expense.amount))
+        for expense in expenses_of_the_period:
+            number += 1
+            period_expenses.append(dict(number=number, expense=expense, expense_amount="%.2f€" % expense["amount"]))
         periods_expenses.append(
             dict(
-                period_start_name=period_start.strftime("%b %Y"),
-                period_end_name=period_end.strftime("%b %Y"),
+                period_start_name=granularity.get_name(period_start),
+                period_end_name=granularity.get_name(granularity.shift(period_start, 1)),
                 period_expenses=period_expenses,
             )
         )
+    if load_more_query is not None:
+        last_expense = expenses[-1]
+        load_more_query["after"] = f"{last_expense['spent_at'].isoformat()}_{last_expense['id'].hex}_{number}"
 
     # If there are no expenses, at least show the dates
-    if not periods_expenses:
+    if not periods_expenses and not arg_after:
         periods_expenses.append(
             dict(
-                period_start_name=periods[0][0].strftime("%b %Y"),
-                period_end_name=periods[-1][1].strftime("%b %Y"),
+                period_start_name=granularity.get_name(periods[0][0]),
+                period_end_name=granularity.get_name(periods[-1][1]),
                 period_expenses=list(),
             )
         )
@@ -130,11 +271,8 @@ def expense_list(request: AuthenticatedHttpRequest, project_public_id: str):
     initial_data: dict[str, typing.Any] = dict()
     if to_datetime:
         initial_data["spent_at"] = to_datetime - datetime.timedelta(minutes=1)
-    if arg_category:
-        try:
-            initial_data["category"] = Category.objects.get(public_id=arg_category)
-        except Category.DoesNotExist:
-            pass
+    if category:
+        initial_data["category"] = category
     create_expense_form_inline = CreateExpenseFormInline(initial=initial_data, project=project)
     next_query_arg = urllib.parse.urlencode(dict(next=request.get_full_path()))
     create_expense_form_inline.helper.form_action = (
@@ -149,6 +287,7 @@ def expense_list(request: AuthenticatedHttpRequest, project_public_id: str):
             project=project,
             create_expense_form_inline=create_expense_form_inline,
             next_query_arg=next_query_arg,
+            load_more_query_arg=load_more_query.urlencode() if load_more_query is not None else None,
         ),
     )
 
@@ -156,7 +295,7 @@ def expense_list(request: AuthenticatedHttpRequest, project_public_id: str):
 @login_required
 def expense_detail(request: AuthenticatedHttpRequest, project_public_id: str, expense_public_id: str):
     project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
-    expense = get_object_or_404(Expense, public_id=expense_public_id, category__project=project)
+    expense = get_object_or_404(Expense, public_id=expense_public_id, project=project)
     arg_next = request.GET.get("next")
     if request.method == "POST":
         form = UpdateExpenseForm(request.POST, project=project)
@@ -196,6 +335,13 @@ def expense_create(request: AuthenticatedHttpRequest, project_public_id: str):
                 notes=form.cleaned_data["notes"],
             )
             new_expense.save()
+            month = CategoryMonthTotal.get_month(new_expense.spent_at)
+            for exceeded in budgets.get_exceeded_budgets(category=new_expense.category, month=month):
+                messages.warning(
+                    request,
+                    f"{exceeded.category.name} is over its budget for {month:%b %Y}:"
+                    f" {exceeded.spent:.2f}€ of {exceeded.budget:.2f}€.",
+                )
             return HttpResponseRedirect(
                 arg_next or reverse("expenses:expense_list", kwargs=dict(project_public_id=project.public_id))
             )
@@ -205,157 +351,385 @@ def expense_create(request: AuthenticatedHttpRequest, project_public_id: str):
     return render(request, "expenses/expense_detail.html", dict(form=form, project=project))
 
 
-@dataclass
-class Header:
-    name: str
-    colspan: int
-    rowspan: int
-    category: Category
-    is_total: bool
-
-    @property
-    def color(self):
-        return self.category.color
-
-    @property
-    def link(self):
-        query_args = dict()
-        query_args["category"] = self.category.public_id
-        if self.is_total:
-            query_args["show_children"] = "True"
-
-        return (
-            reverse("expenses:expense_list", kwargs=dict(project_public_id=self.category.project.public_id))
-            + f"?{urllib.parse.urlencode(query_args)}"
+@login_required
+@query_budget(4)
+def merchant_list(request: AuthenticatedHttpRequest, project_public_id: str):
+    # Suggestions for the source of a new expense, with the category its merchant was last filed under (as the form
+    # select value) to prefill it
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    merchants = merchant_indexes.get(project).search(request.GET.get("q", ""), limit=MERCHANT_SUGGESTIONS)
+    return JsonResponse(
+        dict(
+            merchants=[
+                dict(
+                    source=merchant.source,
+                    count=merchant.count,
+                    last_spent_at=merchant.last_spent_at,
+                    category=str(merchant.category_id) if merchant.category_id else None,
+                )
+                for merchant in merchants
+            ]
+        )
+    )
+
+
+@login_required
+def expense_import(request: AuthenticatedHttpRequest, project_public_id: str):
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    result = None
+    if request.method == "POST":
+        form = ExpenseImportForm(request.POST, request.FILES, project=project)
+        if form.is_valid():
+            format_ = form.cleaned_data["format"]
+            parser_kwargs: dict[str, typing.Any] = dict()
+            if form.cleaned_data["date_format"]:
+                parser_kwargs["date_format"] = form.cleaned_data["date_format"]
+            if format_ == "csv":
+                parser_kwargs["columns"] = {
+                    field: form.cleaned_data[f"{field}_column"] for field in DEFAULT_CSV_COLUMNS
+                }
+            # Decode the upload as a stream, so the statement is never held in memory as a whole
+            with io.TextIOWrapper(form.cleaned_data["statement"].open("rb"), encoding="utf-8-sig", newline="") as file:
+                try:
+                    result = import_expenses(
+                        PARSERS[format_](file, **parser_kwargs),
+                        project=project,
+                        default_category=form.cleaned_data["default_category"],
+                        negate_amounts=form.cleaned_data["negate_amounts"],
+                        duplicates=form.cleaned_data["duplicates"] or "skip",
+                    )
+                except (InvalidStatement, UnicodeDecodeError, csv.Error) as exc:
+                    form.add_error("statement", str(exc))
+    else:
+        form = ExpenseImportForm(project=project)
+
+    return render(request, "expenses/expense_import.html", dict(form=form, project=project, result=result))
+
+
+@login_required
+def expense_export(request: AuthenticatedHttpRequest, project_public_id: str):
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    format_ = request.GET.get("format", "csv")
+    if format_ not in ["csv", "ndjson"]:
+        raise Http404(f"Unknown export format {format_!r}")
+    # A server-side cursor keeps the memory flat no matter how many expenses the project has
+    expenses = (
+        Expense.objects.filter(project=project)
+        .order_by("spent_at", "id")
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    if format_ == "csv":
+        writer = csv.writer(_Echo())
+        lines: typing.Iterator[str] = itertools.chain(
+            [writer.writerow(EXPORT_FIELDS)], (writer.writerow(row) for row in expenses)
+        )
+        content_type = "text/csv"
+    else:
+        lines = (json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n" for row in expenses)
+        content_type = "application/x-ndjson"
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="expenses-{project.public_id}.{format_}"'
+    return response
+
+
+@login_required
+def project_export(request: AuthenticatedHttpRequest, project_public_id: str):
+    project = get_object_or_404(Project.objects.filter(user=request.user), public_id=project_public_id)
+    granularity = _get_granularity(request)
+    amount = _get_period_amount(request, granularity)
+    from_datetime = _get_date(request, "from")
+    to_datetime = _get_date(request, "to")
+    try:
+        periods = _generate_periods(
+            amount=amount, granularity=granularity, from_datetime=from_datetime, to_datetime=to_datetime
         )
+    except (ValueError, OverflowError) as exc:
+        # The periods around the first or the last year there is
+        raise Http404(f"There are no periods up to {request.GET.get('to')!r}") from exc
+
+    def generate_lines():
+        writer = csv.writer(_Echo())
+        value_rows = _generate_value_rows(project=project, periods=periods, granularity=granularity)
+        if not value_rows:
+            return
+        _, values = value_rows[0]
+        parent_ids = {value.category.id for value in values if value.is_total and value.category}
+        header = ["Period"]
+        for value in values:
+            if value.category is None:
+                header.append("Total")
+            elif value.is_total:
+                header.append(f"{value.category.name} (total)")
+            elif value.category.id in parent_ids:
+                header.append(f"{value.category.name} (other)")
+            else:
+                header.append(value.category.name)
+        yield writer.writerow(header)
+        for period, values in value_rows:
+            yield writer.writerow([period.period_start.strftime(DATE_FORMAT)] + ["%.2f" % v.amount for v in values])
+
+    response = StreamingHttpResponse(generate_lines(), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="project-{project.public_id}.csv"'
+    return response
+
 
+class _Echo:
+    # A file-like object for csv.writer that hands back each line instead of buffering it
+    def write(self, value):
+        return value
+
+
+class Header:
+    # The dashboard has a cell per category and period, so cells are slotted and their link is built once, when the
+    # (cached) rows are generated, from fragments computed once per render, category and period
+    __slots__ = ("name", "colspan", "rowspan", "category", "is_total", "color", "link")
+
+    def __init__(self, *, name: str, colspan: int, rowspan: int, category: Category, is_total: bool, link: str):
+        self.name = name
+        self.colspan = colspan
+        self.rowspan = rowspan
+        self.category = category
+        self.is_total = is_total
+        self.color = category.color
+        self.link = link
+
+
+def _generate_header_rows(*, project: Project, expense_list_url: typing.Optional[str] = None) -> list[list[Header]]:
+    expense_list_url = expense_list_url or _get_expense_list_url(project)
+
+    def get_link(category: Category, *, is_total: bool) -> str:
+        link = f"{expense_list_url}?{_get_category_query_arg(category)}"
+        return link + "&show_children=True" if is_total else link
+
+    children_by_parent = Category.build_tree(project=project)
+    levels = Category.build_levels(None, children_by_parent=children_by_parent)
+    # The columns under each category: one for a leaf, or those of its children plus its "∑" and "Other" columns.
+    # Deeper levels go first, so the children are always counted before their parent
+    column_counts: dict[uuid.UUID, int] = dict()
+    for level in reversed(levels):
+        for category, has_children in level:
+            column_counts[category.id] = (
+                2 + sum(column_counts[child.id] for child in children_by_parent[category.id]) if has_children else 1
+            )
 
-def _generate_header_rows(*, project: Project) -> list[list[Header]]:
-    levels = Category.build_levels(None, project=project)
-    parents_considered = list()
     header_rows = list()
     for a, level in enumerate(levels):
         levels_left = len(levels) - a
         header_row = list()
         for category, has_children in level:
+            # Levels follow a depth-first walk, so the children of a parent are next to each other in its level
             parent = category.parent
-            if parent and parent not in parents_considered:
-                header_row.append(Header(name="∑", colspan=1, rowspan=levels_left, category=parent, is_total=True))
-
-            if has_children:
-                columns_under_category = sum(
-                    len(level_) + len([has_children for _, has_children in level_ if has_children])
-                    for level_ in category.build_levels()
-                )
+            siblings = children_by_parent[parent.id] if parent else None
+            if parent and siblings and siblings[0] is category:
                 header_row.append(
                     Header(
-                        name=category.name, colspan=columns_under_category, rowspan=1, category=category, is_total=True
+                        name="∑",
+                        colspan=1,
+                        rowspan=levels_left,
+                        category=parent,
+                        is_total=True,
+                        link=get_link(parent, is_total=True),
                     )
                 )
-            else:
-                header_row.append(
-                    Header(name=category.name, colspan=1, rowspan=levels_left, category=category, is_total=False)
+
+            header_row.append(
+                Header(
+                    name=category.name,
+                    colspan=column_counts[category.id] if has_children else 1,
+                    rowspan=1 if has_children else levels_left,
+                    category=category,
+                    is_total=has_children,
+                    link=get_link(category, is_total=has_children),
                 )
+            )
 
-            if parent:
-                parents_considered.append(parent)
-                if parent.children.count() == parents_considered.count(parent):
-                    header_row.append(
-                        Header(name="Other", colspan=1, rowspan=levels_left, category=parent, is_total=False)
+            if parent and siblings and siblings[-1] is category:
+                header_row.append(
+                    Header(
+                        name="Other",
+                        colspan=1,
+                        rowspan=levels_left,
+                        category=parent,
+                        is_total=False,
+                        link=get_link(parent, is_total=False),
                     )
+                )
         header_rows.append(header_row)
     return header_rows
 
 
-@dataclass
 class Period:
-    project: Project
-    period_start: datetime.datetime
-    period_end: datetime.datetime
-
-    @property
-    def name(self):
-        return self.period_start.strftime("%b %Y")
-
-    @property
-    def link(self):
-        query_args = dict()
-        query_args["from"] = self.period_start.strftime(DATE_FORMAT)
-        query_args["to"] = self.period_end.strftime(DATE_FORMAT)
-        return (
-            reverse("expenses:expense_list", kwargs=dict(project_public_id=self.project.public_id))
-            + f"?{urllib.parse.urlencode(query_args)}"
-        )
+    __slots__ = ("period_start", "period_end", "name", "link")
 
+    def __init__(self, *, period_start: datetime.datetime, period_end: datetime.datetime, name: str, link: str):
+        self.period_start = period_start
+        self.period_end = period_end
+        self.name = name
+        self.link = link
 
-@dataclass
-class Value:
-    amount: float
-    category: typing.Optional[Category]
-    period_start: datetime.datetime
-    period_end: datetime.datetime
-    is_total: bool
-    project: typing.Optional[Project] = None
-
-    @property
-    def name(self):
-        return "%.2f€" % self.amount
-
-    @property
-    def link(self):
-        if self.category is None and self.project is None:
-            return ""
-
-        query_args = dict()
-        query_args["from"] = self.period_start.strftime(DATE_FORMAT)
-        query_args["to"] = self.period_end.strftime(DATE_FORMAT)
-        if self.is_total:
-            query_args["show_children"] = "True"
-        if self.category:
-            query_args["category"] = self.category.public_id
-
-        project = self.project or self.category.project
-        return (
-            reverse("expenses:expense_list", kwargs=dict(project_public_id=project.public_id))
-            + f"?{urllib.parse.urlencode(query_args)}"
-        )
 
-
-def _generate_value_rows(*, project: Project) -> list[tuple[Period, list[Value]]]:
+class Value:
+    __slots__ = ("amount", "category", "is_total", "name", "link", "budget", "budget_name", "is_over_budget")
+
+    def __init__(
+        self,
+        *,
+        amount: float,
+        category: typing.Optional[Category],
+        is_total: bool,
+        link: str,
+        budget: typing.Optional[float] = None,
+    ):
+        self.amount = amount
+        self.category = category
+        self.is_total = is_total
+        self.name = "%.2f€" % amount
+        self.link = link
+        self.budget = budget
+        self.budget_name = "" if budget is None else "%.2f€" % budget
+        self.is_over_budget = budget is not None and abs(amount) > budget
+
+
+def _generate_value_rows(
+    *,
+    project: Project,
+    periods: list[tuple[datetime.datetime, datetime.datetime]],
+    granularity: Granularity = MONTHLY,
+    expense_list_url: typing.Optional[str] = None,
+    extra_amounts: typing.Optional[list[dict[uuid.UUID, float]]] = None,
+) -> list[tuple[Period, list[Value]]]:
+    # With extra amounts the rows are projections, named so to tell them apart
+    expense_list_url = expense_list_url or _get_expense_list_url(project)
+    granularity_query_arg = "".join(f"&{key}={value}" for key, value in granularity.query_args.items())
+    category_query_args: dict[uuid.UUID, str] = dict()
     value_rows = list()
-    periods = _generate_periods(amount=6)
-    for period_start, period_end in periods:
-        filter_ = dict(spent_at__gte=period_start, spent_at__lte=period_end)
-        values = Category.build_values(None, filter_=filter_, project=project)
+    values_per_period = Category.build_values_per_period(
+        project=project, periods=periods, granularity=granularity, extra_amounts=extra_amounts
+    )
+    # The categories come along with the values, so the budgets cost no query. The "other" cells of the parents have
+    # none, their budget covers the subtree
+    first_values = values_per_period[0] if values_per_period else []
+    period_budgets = {
+        category_id: budgets.get_period_budget(budget, granularity)
+        for category_id, budget in budgets.roll_up_budgets(
+            category for _, _, category in first_values if category
+        ).items()
+    }
+    parent_ids = {category.id for _, is_total, category in first_values if is_total and category}
+    for (period_start, period_end), values in zip(periods, values_per_period):
+        period_link = (
+            f"{expense_list_url}?from={period_start:{DATE_FORMAT}}&to={period_end:{DATE_FORMAT}}{granularity_query_arg}"
+        )
         total_of_the_period = sum(value for value, is_total, category in values if not is_total)
+        value_row = list()
+        for value, is_total, category in values:
+            if category is None:
+                # A project without categories
+                value_row.append(Value(amount=value, category=None, is_total=is_total, link=""))
+                continue
+            category_query_arg = category_query_args.get(category.id)
+            if category_query_arg is None:
+                category_query_arg = category_query_args[category.id] = "&" + _get_category_query_arg(category)
+            link = (
+                f"{period_link}&show_children=True{category_query_arg}"
+                if is_total
+                else period_link + category_query_arg
+            )
+            budget = period_budgets.get(category.id) if is_total or category.id not in parent_ids else None
+            value_row.append(Value(amount=value, category=category, is_total=is_total, link=link, budget=budget))
+        value_row.append(Value(amount=total_of_the_period, category=None, is_total=False, link=period_link))
         value_rows.append(
             (
-                Period(project=project, period_start=period_start, period_end=period_end),
-                [
-                    Value(
-                        amount=value,
-                        category=category,
-                        period_start=period_start,
-                        period_end=period_end,
-                        is_total=is_total,
-                    )
-                    for value, is_total, category in values
-                ]
-                + [
-                    Value(
-                        amount=total_of_the_period,
-                        category=None,
-                        project=project,
-                        period_start=period_start,
-                        period_end=period_end,
-                        is_total=False,
-                    )
-                ],
+                Period(
+                    period_start=period_start,
+                    period_end=period_end,
+                    name=granularity.get_name(period_start) + (" (projected)" if extra_amounts is not None else ""),
+                    link=period_link,
+                ),
+                value_row,
             )
         )
     return value_rows
 
 
+def _get_expense_list_url(project: Project) -> str:
+    return reverse("expenses:expense_list", kwargs=dict(project_public_id=project.public_id))
+
+
+def _get_category_query_arg(category: Category) -> str:
+    return urllib.parse.urlencode(dict(category=category.public_id))
+
+
+def _get_dashboard_rows(
+    *,
+    project: Project,
+    periods: list[tuple[datetime.datetime, datetime.datetime]],
+    granularity: Granularity = MONTHLY,
+) -> tuple[list[list[Header]], list[tuple[Period, list[Value]]]]:
+    # The versions change on every write that affects the rows, so old entries are simply never read again. The header
+    # layout only depends on the categories, so it outlives the expense writes
+    header_cache_key = f"dashboard-headers:{project.id}:{project.category_version}"
+    value_cache_key = _get_value_rows_cache_key(project=project, periods=periods, granularity=granularity)
+    cached = cache.get_many([header_cache_key, value_cache_key])
+    header_rows = cached.get(header_cache_key)
+    value_rows = cached.get(value_cache_key)
+    metrics.CACHE_REQUESTS.inc(cache="dashboard_headers", result="miss" if header_rows is None else "hit")
+    metrics.CACHE_REQUESTS.inc(cache="dashboard", result="miss" if value_rows is None else "hit")
+
+    expense_list_url = _get_expense_list_url(project) if header_rows is None or value_rows is None else ""
+    if header_rows is None:
+        header_rows = _generate_header_rows(project=project, expense_list_url=expense_list_url)
+        cache.set(header_cache_key, header_rows, timeout=DASHBOARD_CACHE_TIMEOUT)
+    if value_rows is None:
+        value_rows = _generate_value_rows(
+            project=project, periods=periods, granularity=granularity, expense_list_url=expense_list_url
+        )
+        cache.set(value_cache_key, value_rows, timeout=DASHBOARD_CACHE_TIMEOUT)
+    return header_rows, value_rows
+
+
+def _get_value_rows(
+    *, project: Project, periods: list[tuple[datetime.datetime, datetime.datetime]], granularity: Granularity
+) -> list[tuple[Period, list[Value]]]:
+    cache_key = _get_value_rows_cache_key(project=project, periods=periods, granularity=granularity)
+    value_rows = cache.get(cache_key)
+    metrics.CACHE_REQUESTS.inc(cache="dashboard", result="miss" if value_rows is None else "hit")
+    if value_rows is None:
+        value_rows = _generate_value_rows(project=project, periods=periods, granularity=granularity)
+        cache.set(cache_key, value_rows, timeout=DASHBOARD_CACHE_TIMEOUT)
+    return value_rows
+
+
+def _get_value_rows_cache_key(
+    *, project: Project, periods: list[tuple[datetime.datetime, datetime.datetime]], granularity: Granularity
+) -> str:
+    # The category version too, as the rows carry the budgets of the categories
+    return "dashboard-rows:{}:{}:{}:{}:{}:{:%Y-%m-%d}:{:%Y-%m-%d}".format(
+        project.id,
+        project.data_version,
+        project.category_version,
+        granularity.name,
+        granularity.fiscal_start,
+        periods[0][0],
+        periods[-1][1],
+    )
+
+
+def _get_older_rows_link(
+    *, project: Project, before: datetime.datetime, granularity: Granularity, amount: int
+) -> typing.Optional[str]:
+    # Only while there are expenses left further back, so the dashboard can stop asking for more
+    if not Expense.objects.filter(project=project, spent_at__lt=before).exists():
+        return None
+    query_args = dict(before=before.strftime(DATE_FORMAT), periods=amount, **granularity.query_args)
+    return (
+        reverse("expenses:project_rows", kwargs=dict(project_public_id=project.public_id))
+        + f"?{urllib.parse.urlencode(query_args)}"
+    )
+
+
 def _create_categories_from_template(category_template: str, /, *, project: Project):
     BLUE = "#247BA0"
     GREEN = "#70C1B3"
@@ -379,20 +753,45 @@ def _create_categories_from_template(category_template: str, /, *, project: Proj
 
 
 def _generate_periods(
-    *, amount: int, from_datetime: datetime.datetime = None, to_datetime: datetime.datetime = None
+    *,
+    amount: int,
+    granularity: Granularity = MONTHLY,
+    from_datetime: typing.Optional[datetime.datetime] = None,
+    to_datetime: typing.Optional[datetime.datetime] = None,
 ) -> list[tuple[datetime.datetime, datetime.datetime]]:
-    ending_at = to_datetime or timezone.now()
-    ending_at_months = ending_at.month - 1 + ending_at.year * 12 + 1
-    if from_datetime:
-        starting_at_months = from_datetime.month - 1 + from_datetime.year * 12
-    else:
-        starting_at_months = ending_at_months - amount
-
-    return [
-        (_get_datetime_from_month_total(m), _get_datetime_from_month_total(m + 1))
-        for m in range(starting_at_months, ending_at_months)
-    ]
-
-
-def _get_datetime_from_month_total(month_total: int, /):
-    return datetime.datetime(year=month_total // 12, month=month_total % 12 + 1, day=1)
+    return granularity.generate_periods(amount=amount, from_datetime=from_datetime, to_datetime=to_datetime)
+
+
+def _get_granularity(request: HttpRequest) -> Granularity:
+    try:
+        return Granularity.from_query_args(request.GET)
+    except ValueError as exc:
+        raise Http404(str(exc)) from exc
+
+
+def _get_date(request: HttpRequest, name: str) -> typing.Optional[datetime.datetime]:
+    arg_date = request.GET.get(name)
+    if not arg_date:
+        return None
+    try:
+        return datetime.datetime.strptime(arg_date, DATE_FORMAT)
+    except ValueError as exc:
+        raise Http404(f"{arg_date!r} doesn't match the date format {DATE_FORMAT!r}") from exc
+
+
+def _get_period_amount(request: HttpRequest, granularity: Granularity) -> int:
+    arg_periods = request.GET.get("periods")
+    if not arg_periods:
+        return granularity.default_amount
+    if not arg_periods.isdigit():
+        raise Http404(f"{arg_periods!r} isn't an amount of periods")
+    return min(max(int(arg_periods), 1), MAX_AMOUNT)
+
+
+def _get_projected_amount(request: HttpRequest) -> int:
+    arg_projected = request.GET.get("projected")
+    if not arg_projected:
+        return 0
+    if not arg_projected.isdigit():
+        raise Http404(f"{arg_projected!r} isn't an amount of periods")
+    return min(int(arg_projected), MAX_AMOUNT)
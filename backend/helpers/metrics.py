@@ -0,0 +1,204 @@
+import atexit
+import bisect
+import json
+import math
+import os
+import secrets
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = tuple[str, ...]
+
+
+class Registry:
+    """
+    Process-local metric values in the Prometheus data model.
+
+    Gunicorn runs several worker processes, so when settings.METRICS_DIR is set every process dumps its values to its
+    own file there (at most every `dump_interval` seconds, and when it exits) and a scrape adds up all the files. As in
+    the multiprocess mode of the official client, the files of dead processes are kept so counters never go back
+    """
+
+    def __init__(self, *, dump_interval: float = 5.0):
+        self.dump_interval = dump_interval
+        self.metrics: dict[str, "Metric"] = dict()
+        self._lock = threading.Lock()
+        self._values: dict[str, dict[LabelValues, list[float]]] = dict()
+        self._dumped_at = time.monotonic()
+        # The start time tells apart processes that reuse the pid of a dead one
+        self._filename = f"metrics-{os.getpid()}-{int(time.time())}.json"
+        atexit.register(self.dump)
+
+    def register(self, metric: "Metric") -> "Metric":
+        self.metrics[metric.name] = metric
+        self._values[metric.name] = dict()
+        return metric
+
+    def add(self, name: str, label_values: LabelValues, amounts: dict[int, float]):
+        with self._lock:
+            values = self._values[name].get(label_values)
+            if values is None:
+                values = self._values[name][label_values] = [0.0] * self.metrics[name].size
+            for index, amount in amounts.items():
+                values[index] += amount
+        if settings.METRICS_DIR and time.monotonic() - self._dumped_at >= self.dump_interval:
+            self.dump()
+
+    def dump(self):
+        if not settings.METRICS_DIR:
+            return
+        with self._lock:
+            data = {
+                name: [[list(key), value] for key, value in values.items()] for name, values in self._values.items()
+            }
+            self._dumped_at = time.monotonic()
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a scrape never reads half a file
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as file:
+            json.dump(data, file)
+        os.replace(file.name, directory / self._filename)
+
+    def collect(self) -> dict[str, dict[LabelValues, list[float]]]:
+        if not settings.METRICS_DIR:
+            with self._lock:
+                return {
+                    name: {key: list(value) for key, value in values.items()} for name, values in self._values.items()
+                }
+
+        self.dump()
+        collected: dict[str, dict[LabelValues, list[float]]] = {name: dict() for name in self.metrics}
+        for path in Path(settings.METRICS_DIR).glob("metrics-*.json"):
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+            for name, values in data.items():
+                if name not in collected:
+                    continue
+                for key, value in values:
+                    total = collected[name].setdefault(tuple(key), [0.0] * len(value))
+                    for i, amount in enumerate(value):
+                        total[i] += amount
+        return collected
+
+    def render(self) -> str:
+        lines = list()
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_}")
+            for label_values, value in sorted(values.items()):
+                lines.extend(metric.render(label_values, value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type_: str
+    size = 1
+
+    def __init__(
+        self, name: str, documentation: str, *, labelnames: typing.Sequence[str] = (), registry: Registry = REGISTRY
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        registry.register(self)
+
+    def get_label_values(self, labels: dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[labelname]) for labelname in self.labelnames)
+
+    def format_labels(self, label_values: LabelValues, **extra: str) -> str:
+        pairs = [*zip(self.labelnames, label_values), *extra.items()]
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self, label_values: LabelValues, value: list[float]) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        self.registry.add(self.name, self.get_label_values(labels), {0: amount})
+
+    def render(self, label_values: LabelValues, value: list[float]) -> list[str]:
+        return [f"{self.name}{self.format_labels(label_values)} {_format_number(value[0])}"]
+
+
+class Histogram(Metric):
+    """Values are stored as the count of each bucket (not cumulative), followed by the sum and the count"""
+
+    type_ = "histogram"
+
+    def __init__(self, name: str, documentation: str, *, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        self.size = len(self.buckets) + 3  # +Inf, sum and count
+        super().__init__(name, documentation, **kwargs)
+
+    def observe(self, amount: float, **labels: str):
+        # bisect_left puts the amounts equal to a bound into its bucket, as "le" means less or equal
+        amounts = {bisect.bisect_left(self.buckets, amount): 1, self.size - 2: amount, self.size - 1: 1}
+        self.registry.add(self.name, self.get_label_values(labels), amounts)
+
+    def render(self, label_values: LabelValues, value: list[float]) -> list[str]:
+        lines = list()
+        cumulative = 0.0
+        for bound, count in zip([*self.buckets, math.inf], value):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else _format_number(bound)
+            lines.append(f"{self.name}_bucket{self.format_labels(label_values, le=le)} {_format_number(cumulative)}")
+        lines.append(f"{self.name}_sum{self.format_labels(label_values)} {_format_number(value[-2])}")
+        lines.append(f"{self.name}_count{self.format_labels(label_values)} {_format_number(value[-1])}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "cashflow_request_duration_seconds", "Time spent handling each request", labelnames=["view", "method"]
+)
+REQUESTS = Counter("cashflow_requests_total", "Handled requests", labelnames=["view", "method", "status"])
+REQUEST_QUERIES = Histogram(
+    "cashflow_request_queries",
+    "Database queries made by each request",
+    labelnames=["view"],
+    buckets=(1, 2, 5, 10, 15, 20, 50, 100, 200),
+)
+REQUEST_DB_DURATION = Histogram(
+    "cashflow_request_db_duration_seconds", "Time spent in the database by each request", labelnames=["view"]
+)
+CACHE_REQUESTS = Counter("cashflow_cache_requests_total", "Cache lookups", labelnames=["cache", "result"])
+IMPORTED_EXPENSES = Counter("cashflow_imported_expenses_total", "Expenses created by statement imports")
+IMPORT_DURATION = Histogram(
+    "cashflow_import_duration_seconds",
+    "Time spent importing each statement",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+
+def metrics_view(request):
+    # Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>", staff can just open it in the browser
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not (settings.METRICS_TOKEN and secrets.compare_digest(token, settings.METRICS_TOKEN)):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from helpers import metrics
+from helpers.timing import RequestTimings, current_timings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class TimingMiddleware:
+    """
+    Measures the total time, the database queries and time, and the template render time of every request. They are
+    sent back in the Server-Timing header (so they show up in the browser devtools), logged and added to the metrics
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started_at = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings.track_query):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total_seconds = time.perf_counter() - started_at
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries"',
+                f"tpl;dur={timings.template_seconds * 1000:.1f}",
+                f"total;dur={total_seconds * 1000:.1f}",
+            ]
+        )
+        logger.info(
+            f"view={timings.view_name or '-'} method={request.method} status={response.status_code}"
+            f" total_ms={total_seconds * 1000:.1f} db_ms={timings.db_seconds * 1000:.1f} queries={timings.queries}"
+            f" template_ms={timings.template_seconds * 1000:.1f}"
+        )
+
+        view_name = timings.view_name or "unresolved"
+        metrics.REQUESTS.inc(view=view_name, method=request.method, status=str(response.status_code))
+        metrics.REQUEST_DURATION.observe(total_seconds, view=view_name, method=request.method)
+        metrics.REQUEST_QUERIES.observe(timings.queries, view=view_name)
+        metrics.REQUEST_DB_DURATION.observe(timings.db_seconds, view=view_name)
+
+        if timings.query_budget is not None and timings.queries > timings.query_budget:
+            message = f"{timings.view_name} made {timings.queries} queries, over its budget of {timings.query_budget}"
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.view_name = request.resolver_match.view_name
+            timings.query_budget = getattr(view_func, "query_budget", None)
@@ -0,0 +1,152 @@
+import collections
+import cProfile
+import datetime
+import logging
+import re
+import secrets
+import sys
+import threading
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ["sample", "cprofile"]
+PROFILE_NAME_REGEX = re.compile(r"\d{8}-\d{6}-[0-9a-f]{8}-[\w.:-]+\.(folded|prof)")
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread every `interval` seconds from a background thread, and counts the stacks in the
+    "folded" format of flamegraph.pl (also read by speedscope). Unlike cProfile, the profiled code runs at full speed
+    """
+
+    def __init__(self, *, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            names = list()
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({_shorten_filename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def get_folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@dataclass
+class StoredProfile:
+    name: str
+    size: int
+    created_at: datetime.datetime
+
+    @property
+    def link(self) -> str:
+        return reverse("profile_download", args=[self.name])
+
+
+class ProfilerMiddleware:
+    """
+    Profiles the requests of staff users asking for it with "?_profile=sample" (or "cprofile"), or the X-Profile
+    header. The report is stored in settings.PROFILES_DIR and its download link is sent back in the X-Profile header
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = request.GET.get("_profile") or request.headers.get("X-Profile")
+        if not profiler or not request.user.is_staff:
+            return self.get_response(request)
+        if profiler not in PROFILERS:
+            profiler = PROFILERS[0]
+
+        if profiler == "cprofile":
+            profile = cProfile.Profile()
+            response = profile.runcall(self.get_response, request)
+        else:
+            sampler = SamplingProfiler(thread_id=threading.get_ident(), interval=settings.PROFILE_SAMPLE_INTERVAL)
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+
+        # The view name is only known once resolved, after the middlewares were called
+        view_name = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        name = "{:%Y%m%d-%H%M%S}-{}-{}.{}".format(
+            datetime.datetime.now(), secrets.token_hex(4), view_name, "prof" if profiler == "cprofile" else "folded"
+        )
+        path = _get_profiles_dir() / name
+        if profiler == "cprofile":
+            profile.dump_stats(path)
+        else:
+            path.write_text(sampler.get_folded(), encoding="utf-8")
+        _delete_old_profiles()
+        logger.info(f"Stored the {profiler} profile of {request.path} in {path}")
+        response["X-Profile"] = request.build_absolute_uri(reverse("profile_download", args=[name]))
+        return response
+
+
+@staff_member_required
+def profile_list(request):
+    profiles = sorted(_get_stored_profiles(), key=lambda profile: profile.created_at, reverse=True)
+    return render(request, "expenses/profile_list.html", dict(profiles=profiles, profilers=PROFILERS))
+
+
+@staff_member_required
+def profile_download(request, name: str):
+    if not PROFILE_NAME_REGEX.fullmatch(name) or not (_get_profiles_dir() / name).is_file():
+        raise Http404(f"The profile {name!r} doesn't exist")
+    return FileResponse(open(_get_profiles_dir() / name, "rb"), as_attachment=True, filename=name)
+
+
+def _get_profiles_dir() -> Path:
+    directory = Path(settings.PROFILES_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def _get_stored_profiles() -> typing.Iterator[StoredProfile]:
+    for path in _get_profiles_dir().iterdir():
+        if PROFILE_NAME_REGEX.fullmatch(path.name):
+            stat = path.stat()
+            yield StoredProfile(
+                name=path.name, size=stat.st_size, created_at=datetime.datetime.fromtimestamp(stat.st_mtime)
+            )
+
+
+def _delete_old_profiles():
+    profiles = sorted(_get_stored_profiles(), key=lambda profile: profile.created_at, reverse=True)
+    for profile in profiles[settings.PROFILES_MAX_STORED :]:
+        (_get_profiles_dir() / profile.name).unlink(missing_ok=True)
+
+
+def _shorten_filename(filename: str) -> str:
+    # Relative to the project or to the installed packages, e.g. "expenses/views.py" or "django/db/models/query.py"
+    if filename.startswith(str(settings.BASE_DIR)):
+        return str(Path(filename).relative_to(settings.BASE_DIR))
+    return filename.rpartition("site-packages/")[2]
@@ -0,0 +1,320 @@
+import atexit
+import contextlib
+import datetime
+import functools
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+import types
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+
+from helpers.timing import current_timings
+
+logger = logging.getLogger(__name__)
+
+# Durations are counted in logarithmic buckets (each one 25% wider than the previous one), so percentiles can be
+# aggregated across processes and requests with a bounded error and without keeping every sample
+BUCKET_BASE = 1.25
+MIN_DURATION_MS = 0.001
+
+ORDER_BY_COLUMNS = ["total_ms", "count", "max_ms"]
+FINGERPRINT_REGEXES = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%s|\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE), "IN (...)"),
+    # Bulk inserts, e.g. VALUES (?, ?), (?, ?), (?, ?)
+    (re.compile(r"(\((?:\?, )*\?\))(?:, \1)+"), r"\1, ..."),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_stats (
+    fingerprint TEXT PRIMARY KEY,
+    sql TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS query_buckets (
+    fingerprint TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (fingerprint, bucket)
+);
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    view TEXT NOT NULL,
+    location TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slow_queries_fingerprint ON slow_queries (fingerprint, duration_ms);
+"""
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint_sql(sql: str) -> tuple[str, str]:
+    """
+    Normalizes the SQL into the shape of the query: literals and parameters become "?" and lists of them are collapsed,
+    so the same query with different values (or a different number of values) gets the same fingerprint
+    """
+    normalized = sql.strip()
+    for regex, replacement in FINGERPRINT_REGEXES:
+        normalized = regex.sub(replacement, normalized)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized
+
+
+@dataclass
+class FingerprintStats:
+    sql: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    buckets: dict[int, int] = field(default_factory=dict)
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def add(self, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        bucket = _get_bucket(duration_ms)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def get_percentile_ms(self, percentile: float) -> float:
+        # The upper bound of the bucket that holds the percentile, capped by the slowest execution seen
+        remaining = math.ceil(self.count * percentile / 100)
+        for bucket, count in sorted(self.buckets.items()):
+            remaining -= count
+            if remaining <= 0:
+                return min(BUCKET_BASE**bucket, self.max_ms)
+        return self.max_ms
+
+
+@dataclass
+class SlowQuery:
+    fingerprint: str
+    duration_ms: float
+    view: str
+    location: str
+    sql: str
+    recorded_at: datetime.datetime
+
+
+class QueryLog:
+    """
+    A database execute wrapper that aggregates the count, total and percentiles of every query shape, and keeps the
+    slowest executions along with the view and the line of code that made them.
+
+    The stats are buffered in memory and flushed every `flush_interval` seconds to a local SQLite file, so every
+    process (e.g. each gunicorn worker) adds up to the same store
+    """
+
+    def __init__(
+        self,
+        path: typing.Union[str, Path],
+        *,
+        slow_threshold_ms: float,
+        flush_interval: float = 10.0,
+        max_slow: int = 5000,
+    ):
+        self.path = path
+        self.slow_threshold_ms = slow_threshold_ms
+        self.flush_interval = flush_interval
+        self.max_slow = max_slow
+        self._lock = threading.Lock()
+        self._stats: dict[str, FingerprintStats] = dict()
+        self._slow: list[SlowQuery] = list()
+        self._flushed_at = time.monotonic()
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, (time.perf_counter() - started_at) * 1000)
+
+    def record(self, sql: str, duration_ms: float):
+        fingerprint, normalized = fingerprint_sql(sql)
+        slow_query = None
+        if duration_ms >= self.slow_threshold_ms:
+            timings = current_timings.get()
+            slow_query = SlowQuery(
+                fingerprint=fingerprint,
+                duration_ms=duration_ms,
+                view=timings.view_name if timings and timings.view_name else _get_command_name(),
+                location=_get_caller_location(),
+                sql=sql,
+                recorded_at=datetime.datetime.now(),
+            )
+        with self._lock:
+            if fingerprint not in self._stats:
+                self._stats[fingerprint] = FingerprintStats(sql=normalized)
+            self._stats[fingerprint].add(duration_ms)
+            if slow_query:
+                self._slow.append(slow_query)
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            stats, self._stats = self._stats, dict()
+            slow, self._slow = self._slow, list()
+            self._flushed_at = time.monotonic()
+        if not stats and not slow:
+            return
+        try:
+            with self._connect() as db:
+                db.executemany(
+                    """
+                    INSERT INTO query_stats (fingerprint, sql, count, total_ms, max_ms) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (fingerprint) DO UPDATE SET
+                        count = count + excluded.count,
+                        total_ms = total_ms + excluded.total_ms,
+                        max_ms = max(max_ms, excluded.max_ms)
+                    """,
+                    [(key, value.sql, value.count, value.total_ms, value.max_ms) for key, value in stats.items()],
+                )
+                db.executemany(
+                    """
+                    INSERT INTO query_buckets (fingerprint, bucket, count) VALUES (?, ?, ?)
+                    ON CONFLICT (fingerprint, bucket) DO UPDATE SET count = count + excluded.count
+                    """,
+                    [(key, bucket, count) for key, value in stats.items() for bucket, count in value.buckets.items()],
+                )
+                db.executemany(
+                    """
+                    INSERT INTO slow_queries (fingerprint, duration_ms, view, location, sql, recorded_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            query.fingerprint,
+                            query.duration_ms,
+                            query.view,
+                            query.location,
+                            query.sql,
+                            query.recorded_at.isoformat(),
+                        )
+                        for query in slow
+                    ],
+                )
+                db.execute(
+                    "DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?", [self.max_slow]
+                )
+        except sqlite3.Error:
+            # The stats are a diagnostic tool, they must never break the request
+            logger.exception(f"Couldn't flush {len(stats)} query fingerprints to {self.path}")
+
+    def get_top(self, *, order_by: str = "total_ms", limit: int = 20) -> list[tuple[str, FingerprintStats]]:
+        if order_by not in ORDER_BY_COLUMNS:
+            raise ValueError(f"Can't order the query stats by {order_by!r}, only by {ORDER_BY_COLUMNS}")
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT fingerprint, sql, count, total_ms, max_ms FROM query_stats ORDER BY {order_by} DESC LIMIT ?",
+                [limit],
+            ).fetchall()
+            top = [
+                (fingerprint, FingerprintStats(sql=sql, count=count, total_ms=total_ms, max_ms=max_ms))
+                for fingerprint, sql, count, total_ms, max_ms in rows
+            ]
+            stats_by_fingerprint = dict(top)
+            for fingerprint, bucket, count in db.execute(
+                f"SELECT fingerprint, bucket, count FROM query_buckets"
+                f" WHERE fingerprint IN ({', '.join('?' * len(stats_by_fingerprint))})",
+                list(stats_by_fingerprint),
+            ):
+                stats_by_fingerprint[fingerprint].buckets[bucket] = count
+        return top
+
+    def get_slowest(self, fingerprint: str, *, limit: int = 3) -> list[SlowQuery]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT fingerprint, duration_ms, view, location, sql, recorded_at FROM slow_queries"
+                " WHERE fingerprint = ? ORDER BY duration_ms DESC LIMIT ?",
+                [fingerprint, limit],
+            ).fetchall()
+        return [
+            SlowQuery(
+                fingerprint=fingerprint_,
+                duration_ms=duration_ms,
+                view=view,
+                location=location,
+                sql=sql,
+                recorded_at=datetime.datetime.fromisoformat(recorded_at),
+            )
+            for fingerprint_, duration_ms, view, location, sql, recorded_at in rows
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._stats, self._slow = dict(), list()
+        with self._connect() as db:
+            db.executescript("DELETE FROM query_stats; DELETE FROM query_buckets; DELETE FROM slow_queries;")
+
+    @contextlib.contextmanager
+    def _connect(self) -> typing.Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            db.executescript(SCHEMA)
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+_query_log: typing.Optional[QueryLog] = None
+
+
+def get_query_log() -> QueryLog:
+    global _query_log  # pylint: disable=global-statement
+    if _query_log is None:
+        _query_log = QueryLog(settings.QUERY_LOG_PATH, slow_threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS)
+        atexit.register(_query_log.flush)
+    return _query_log
+
+
+def install_query_log(sender, connection, **_):
+    # Receiver of connection_created: every new database connection (one per thread) goes through the query log
+    query_log = get_query_log()
+    if query_log not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_log)
+
+
+def _get_bucket(duration_ms: float) -> int:
+    return math.ceil(math.log(max(duration_ms, MIN_DURATION_MS), BUCKET_BASE))
+
+
+def _get_caller_location() -> str:
+    # The innermost frame of our own code, skipping django, the rest of the libraries and these helpers (middlewares)
+    project_dir = str(settings.BASE_DIR)
+    helpers_dir = str(Path(__file__).parent)
+    frame: typing.Optional[types.FrameType] = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(project_dir)
+            and not filename.startswith(helpers_dir)
+            and "site-packages" not in filename
+        ):
+            return f"{Path(filename).relative_to(project_dir)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "-"
+
+
+def _get_command_name() -> str:
+    # Queries outside requests come from management commands, e.g. "manage.py import_expenses"
+    return " ".join(Path(arg).name if i == 0 else arg for i, arg in enumerate(sys.argv[:2])) or "-"
@@ -0,0 +1,37 @@
+import time
+
+from django.template.backends.django import DjangoTemplates
+
+from helpers.timing import current_timings
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # The Django template backend, adding the render time of the templates to the current request timings
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timings = current_timings.get()
+        if timings is None:
+            return self.template.render(context, request)
+
+        timings.template_depth += 1
+        started_at = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings.template_depth -= 1
+            if not timings.template_depth:
+                timings.template_seconds += time.perf_counter() - started_at
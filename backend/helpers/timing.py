@@ -0,0 +1,42 @@
+import contextvars
+import time
+import typing
+from dataclasses import dataclass, field
+
+
+@dataclass
+class RequestTimings:
+    view_name: str = ""
+    queries: int = 0
+    db_seconds: float = 0.0
+    template_seconds: float = 0.0
+    query_budget: typing.Optional[int] = None
+    # Templates render other templates (e.g. crispy forms), only the outermost render is timed
+    template_depth: int = field(default=0, repr=False)
+
+    def track_query(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started_at
+            self.queries += 1
+
+
+# The timings of the request being handled, if any
+current_timings: contextvars.ContextVar[typing.Optional[RequestTimings]] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+def query_budget(max_queries: int):
+    """
+    Declares how many queries a view is expected to make at most. TimingMiddleware logs the requests over it, or
+    raises when settings.QUERY_BUDGET_RAISE is set (e.g. during development)
+    """
+
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 import enum
 import os
 import re
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -80,13 +81,16 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "helpers.middleware.TimingMiddleware",
+    "helpers.profiling.ProfilerMiddleware",
 ]
 
 ROOT_URLCONF = "root.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # The Django backend, timing the renders for helpers.middleware.TimingMiddleware
+        "BACKEND": "helpers.template_backends.TimedDjangoTemplates",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -130,6 +134,59 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Cached values are keyed by data versions stored in the database, so a per-process cache never serves stale data
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cashflow",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    }
+}
+
+
+# Logging
+# https://docs.djangoproject.com/en/4.0/topics/logging/
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "expenses": {"handlers": ["console"], "level": os.environ.get("LOG_LEVEL", "INFO")},
+        "helpers": {"handlers": ["console"], "level": os.environ.get("LOG_LEVEL", "INFO")},
+    },
+}
+
+# Memory for the columnar copies of the expenses of the most recently used projects (see expenses.cube)
+PROJECT_CUBE_MAX_BYTES = 64 * 1024 * 1024
+# Projects whose merchants are kept in memory for autocompleting the expense sources (see expenses.merchants)
+MERCHANT_INDEX_CACHE_SIZE = 256
+
+# Requests over the query budget of their view (see helpers.timing.query_budget) fail instead of just being logged
+QUERY_BUDGET_RAISE = DEBUG
+
+# Every query shape is aggregated into this SQLite file (see helpers.querylog), and the executions slower than the
+# threshold are sampled. Leave it empty to disable the query log
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH", "")
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", "100"))
+
+# Every worker process dumps its metrics (see helpers.metrics) into this directory, so /metrics adds up all of them.
+# Leave it empty to only report the process serving the scrape. Scrapers authenticate with the token
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Profiles of the requests of staff users with ?_profile=sample|cprofile (see helpers.profiling). Samples can't be
+# taken more often than the interpreter switches threads (sys.getswitchinterval(), 5ms by default)
+PROFILES_DIR = os.environ.get("PROFILES_DIR", os.path.join(tempfile.gettempdir(), "cashflow-profiles"))
+PROFILES_MAX_STORED = 100
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
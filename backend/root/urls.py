@@ -17,6 +17,9 @@ from django.contrib import admin
 from django.contrib.auth.decorators import login_required
 from django.urls import include, path
 
+from helpers.metrics import metrics_view
+from helpers.profiling import profile_download, profile_list
+
 # https://github.com/python/mypy/issues/2427
 admin.site.login = login_required(admin.site.login)  # type: ignore
 
@@ -26,4 +29,7 @@ urlpatterns = [
     path("accounts/", include("auth.urls")),
     path("", include("expenses.urls")),
     path("polls/", include("polls.urls")),
+    path("metrics", metrics_view, name="metrics"),
+    path("profiles/", profile_list, name="profile_list"),
+    path("profiles/<str:name>", profile_download, name="profile_download"),
 ]